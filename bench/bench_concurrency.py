@@ -0,0 +1,101 @@
+'''
+Benchmark of the vision API concurrency controller against a rate limited stub.
+
+Sends the same date reads from many threads (like several batches at once) through
+DateExtractor.read_date, first with a fixed number of requests in flight (the worker count that
+used to be the only limit) and then with the adaptive controller, and reports throughput,
+429 responses, retries, failed reads and how the limit moved:
+
+    python bench/bench_concurrency.py --requests 200 --threads 20 --rate-limit 8 --capacity 6
+'''
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import StubConfig, start_stub
+from synthetic import make_print
+
+
+def run(name, extractor, controller, url, args):
+    import Metrics as metrics
+    metrics.reset()
+    extractor.concurrency = controller
+
+    limits = []
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(0.25):
+            limits.append(controller.limit)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(lambda _: extractor.read_date(url), range(args.requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+
+    values = metrics.snapshot()
+    failed = sum(1 for text, _ in results if text is None)
+    limits = limits or [controller.limit]
+    print(f"{name:<12}{elapsed:>9.1f}{args.requests / elapsed:>10.2f}"
+          f"{int(values.get('imgdate_api_retries_total', 0)):>10}{failed:>8}"
+          f"{np.mean(limits):>11.1f}{max(limits):>8.1f}{controller.limit:>8.1f}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision API concurrency controller.")
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-t", "--threads", type=int, default=20, help="Threads sending requests")
+    parser.add_argument("--fixed", type=int, default=10, help="Requests in flight for the fixed run")
+    parser.add_argument("--rate-limit", type=float, default=8, help="Stub requests per second before 429")
+    parser.add_argument("--capacity", type=int, default=6, help="Stub concurrent requests before latency grows")
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('MODEL_NAME', 'bench')
+    os.chdir(SRC_DIR)
+    import logging
+    import random
+    import SharedVariables as shared
+    from ConcurrencyController import ConcurrencyController
+    from DateExtractor import DateExtractor
+    shared.date_format = 'mm_dd_yy'
+    # Retried 429s are logged as errors; the table counts them instead
+    logging.disable(logging.CRITICAL)
+
+    photo, _ = make_print(1800, 1200, random.Random(args.seed))
+    print(f"{args.requests} reads from {args.threads} threads, stub at {args.rate_limit:g} requests/s, "
+          f"capacity {args.capacity}, {args.latency * 1000:.0f} ms\n")
+    print(f"{'':<12}{'wall s':>9}{'reads/s':>10}{'retries':>10}{'failed':>8}{'mean limit':>11}{'max':>8}{'final':>8}")
+
+    for name, controller in (("fixed", ConcurrencyController(initial_limit=args.fixed, max_limit=args.fixed, adaptive=False)),
+                             ("adaptive", ConcurrencyController())):
+        config = StubConfig(latency=args.latency, jitter=args.latency / 10, low_confidence_rate=0.0, seed=args.seed,
+                            rate_limit=args.rate_limit, capacity=args.capacity)
+        server, url = start_stub(config)
+        os.environ['OPENAI_API_URL'] = url
+        extractor = DateExtractor()
+        data_url = extractor.crop_date_64(photo)
+        run(name, extractor, controller, data_url, args)
+        print(f"{'':<12}stub: {config.rate_limited} x 429, at most {config.max_in_flight} in flight")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+Micro-benchmark of the AutoCrop mask and crop validation.
+
+Compares the allocate-per-call implementation AutoCrop used before MaskBuilder with MaskBuilder
+(single scans and batches) on synthetic scans, reporting ms per megapixel and the peak memory each
+pass allocates according to tracemalloc:
+
+    python bench/bench_mask.py --scans 4 --repeat 5
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+sys.path.insert(0, BENCH_DIR)
+
+from MaskBuilder import MaskBuilder, content_ratio
+from synthetic import make_scan
+
+
+def reference_mask(image):
+    # AutoCrop.create_mask before MaskBuilder
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    adaptive_thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+    color_mask = cv2.inRange(image, np.array([200, 200, 200], dtype=np.uint8), np.array([255, 255, 255], dtype=np.uint8))
+    color_mask_inv = cv2.bitwise_not(color_mask)
+    combined_mask = cv2.bitwise_and(adaptive_thresh, adaptive_thresh, mask=color_mask_inv)
+    return cv2.morphologyEx(combined_mask, cv2.MORPH_CLOSE, np.ones((5, 5), np.uint8), iterations=2)
+
+
+def reference_content_ratio(image):
+    # AutoCrop.is_valid_crop before MaskBuilder
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return np.sum(gray < 240) / (gray.shape[0] * gray.shape[1])
+
+
+def measure(name, func, megapixels, repeat):
+    func()  # Warm up, including the first allocation of scratch buffers
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    # Arrays returned by OpenCV are allocated through numpy, so tracemalloc sees them
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    ms_per_mp = np.median(timings) * 1000 / megapixels
+    print(f"{name:<34}{ms_per_mp:>10.2f}{peak / 1024 ** 2:>16.1f}{peak / megapixels / 1024 ** 2:>16.2f}")
+    return ms_per_mp
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AutoCrop mask builder.")
+    parser.add_argument("-n", "--scans", type=int, default=4, help="Synthetic scans per batch")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    scans = [make_scan(4, rng)[0] for _ in range(args.scans)]
+    height, width = scans[0].shape[:2]
+    scans = [cv2.resize(scan, (width, height)) for scan in scans]
+    megapixels = width * height * len(scans) / 1e6
+
+    builder = MaskBuilder()
+    for scan in scans:
+        if not np.array_equal(builder.build(scan), reference_mask(scan)):
+            raise SystemExit("MaskBuilder output differs from the reference mask")
+
+    print(f"{len(scans)} scans of {width}x{height} ({megapixels:.1f} MP per pass)\n")
+    print(f"{'':<34}{'ms / MP':>10}{'allocated MB':>16}{'MB / MP':>16}")
+    before = measure("create_mask (allocating)", lambda: [reference_mask(scan) for scan in scans], megapixels, args.repeat)
+    after = measure("MaskBuilder.build", lambda: [builder.build(scan) for scan in scans], megapixels, args.repeat)
+    measure("MaskBuilder.build_batch", lambda: builder.build_batch(scans), megapixels, args.repeat)
+    print(f"\nMask speedup: {before / after:.2f}x")
+
+    crops = [scan[: height // 2, : width // 2] for scan in scans]
+    crop_megapixels = megapixels / 4
+    print()
+    before = measure("is_valid_crop (np.sum)", lambda: [reference_content_ratio(crop) for crop in crops], crop_megapixels, args.repeat)
+    after = measure("is_valid_crop (countNonZero)", lambda: [content_ratio(crop) for crop in crops], crop_megapixels, args.repeat)
+    print(f"\nCrop validation speedup: {before / after:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
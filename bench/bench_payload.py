@@ -0,0 +1,121 @@
+'''
+Benchmark of the date crop payload sent to the vision API.
+
+Compares the full corner as a default quality JPEG (what DateExtractor sent before PayloadOptimizer)
+with the optimised payload, with orange enhancement and cut down to the located stamp. For the sample images in
+src/static/images (dated by their filename) and synthetic prints it reports payload bytes and
+request latency against the local stub at a simulated upload bandwidth:
+
+    python bench/bench_payload.py --prints 20 --upload-kbps 256
+
+With --live the requests go to the API configured in .env instead, and read accuracy is reported
+(the stub answers with random dates, so accuracy is only meaningful live).
+'''
+
+import argparse
+import base64
+import os
+import random
+import re
+import sys
+import time
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import StubConfig, start_stub
+from synthetic import make_print
+
+SAMPLE_DATE = re.compile(r'_(\d{2})-(\d{2})-(\d{4})_')
+
+
+def legacy_data_url(corner):
+    _, buffer = cv2.imencode('.jpg', corner)
+    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+
+
+def load_images(num_prints, seed):
+    """
+    (name, image, "mm/dd/yyyy") for the dated sample images and num_prints synthetic prints.
+    """
+    images = []
+    samples = os.path.join(SRC_DIR, 'static', 'images')
+    for filename in sorted(os.listdir(samples)):
+        match = SAMPLE_DATE.search(filename)
+        if match:
+            month, day, year = match.groups()
+            images.append((filename, cv2.imread(os.path.join(samples, filename)), f"{month}/{day}/{year}"))
+
+    rng = random.Random(seed)
+    for i in range(num_prints):
+        photo, date = make_print(1800, 1200, rng)
+        images.append((f"print_{i:03d}", photo, date))
+    return images
+
+
+def run_variant(extractor, name, encode, corners, live):
+    sizes, latencies, correct = [], [], 0
+    for corner, truth in corners:
+        url = encode(corner)
+        sizes.append(len(url))
+        start = time.perf_counter()
+        text, _ = extractor.read_date(url, retries=1)
+        latencies.append(time.perf_counter() - start)
+        if live and text and extractor.validate_date_format(text)[0] == truth:
+            correct += 1
+
+    accuracy = f"{correct}/{len(corners)}" if live else "n/a"
+    print(f"{name:<22}{np.mean(sizes) / 1024:>12.1f}{np.median(sizes) / 1024:>12.1f}"
+          f"{np.median(latencies) * 1000:>12.0f}{np.percentile(latencies, 95) * 1000:>12.0f}{accuracy:>10}")
+    return np.mean(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision API date payload.")
+    parser.add_argument("-n", "--prints", type=int, default=20, help="Synthetic prints besides the sample images")
+    parser.add_argument("--upload-kbps", type=float, default=256, help="Simulated upload bandwidth to the stub in kilobytes/second")
+    parser.add_argument("--latency", type=float, default=0.3, help="Stub latency in seconds before the upload time")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality of the optimised payload")
+    parser.add_argument("--date-format", default="universal", choices=["mm_dd_yy", "yy_mm_dd", "universal"])
+    parser.add_argument("--live", action="store_true", help="Send the requests to the API configured in .env")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.live:
+        config = StubConfig(latency=args.latency, jitter=0.0, low_confidence_rate=0.0, seed=args.seed,
+                            upload_rate=args.upload_kbps * 1024)
+        _, url = start_stub(config)
+        os.environ['OPENAI_API_URL'] = url
+        os.environ.setdefault('OPENAI_API_KEY', 'bench')
+        os.environ.setdefault('MODEL_NAME', 'bench')
+
+    # Log paths are relative to src/, like when running main.py
+    os.chdir(SRC_DIR)
+    import SharedVariables as shared
+    from DateExtractor import DateExtractor
+    from PayloadOptimizer import PayloadOptimizer
+    shared.date_format = args.date_format
+
+    extractor = DateExtractor()
+    images = load_images(args.prints, args.seed)
+    corners = [(extractor.crop_date_64(image, base_64=False), truth) for _, image, truth in images]
+    optimizer = PayloadOptimizer(jpeg_quality=args.quality)
+    enhancer = PayloadOptimizer(jpeg_quality=args.quality, enhance=True)
+    localizer = PayloadOptimizer(jpeg_quality=args.quality, localize=True)
+
+    target = "live API" if args.live else f"stub at {args.upload_kbps:.0f} KB/s upload + {args.latency * 1000:.0f} ms"
+    print(f"{len(images)} images ({len(images) - args.prints} samples), {target}\n")
+    print(f"{'payload':<22}{'mean KB':>12}{'median KB':>12}{'p50 ms':>12}{'p95 ms':>12}{'correct':>10}")
+    before = run_variant(extractor, "corner JPEG (before)", legacy_data_url, corners, args.live)
+    after = run_variant(extractor, "optimised", optimizer.data_url, corners, args.live)
+    run_variant(extractor, "optimised + enhance", enhancer.data_url, corners, args.live)
+    run_variant(extractor, "optimised + stamp crop", localizer.data_url, corners, args.live)
+    print(f"\nPayload reduction: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
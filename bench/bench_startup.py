@@ -0,0 +1,118 @@
+'''
+Benchmark of the time to the first dated image of a batch.
+
+Compares a cold process (interpreter start, imports, loading the models, one photo), a new batch
+that loads its own models the way every ImageOrganizer used to, and a new batch that borrows the
+models ModelRegistry already warmed. Requests go to the local stub of the vision API:
+
+    python bench/bench_startup.py --batches 5
+'''
+
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import StubConfig, start_stub
+from synthetic import make_print
+
+
+def first_image(directory, orientation):
+    """
+    Run one batch of a single photo and return the seconds it took, construction included.
+    """
+    from ImageOrganizer import ImageOrganizer
+    scans_path = os.path.join(directory, 'scans')
+    os.makedirs(scans_path, exist_ok=True)
+    photo, _ = make_print(1800, 1200, random.Random(0))
+    cv2.imwrite(os.path.join(scans_path, 'photo.jpg'), photo)
+
+    start = time.perf_counter()
+    organizer = ImageOrganizer(scans_path=scans_path, save_path=os.path.join(directory, 'processed'),
+                               error_path=os.path.join(directory, 'processed', 'Failed'),
+                               archive_path=os.path.join(directory, 'archive'), archive_scans=False,
+                               sort_images=False, crop_images=False, fix_orientation=orientation)
+    organizer.process_images()
+    return time.perf_counter() - start
+
+
+def batches(count, orientation, reload):
+    import ModelRegistry
+    timings = []
+    for _ in range(count):
+        if reload:
+            # Drop the shared models so the batch loads its own, as before the registry
+            for resource in (ModelRegistry._fix_orientation, ModelRegistry._mask_builder, ModelRegistry._session):
+                resource.value = None
+        with tempfile.TemporaryDirectory() as directory:
+            timings.append(first_image(directory, orientation))
+    return np.array(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the time to the first image of a batch.")
+    parser.add_argument("-b", "--batches", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub latency in seconds")
+    parser.add_argument("--no-orientation", action="store_true", help="Skip FixOrientation (when dlib or its model is missing)")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    orientation = not args.no_orientation
+
+    if args.child:
+        # Cold start: this process only runs one batch
+        os.chdir(SRC_DIR)
+        import logging
+        logging.disable(logging.CRITICAL)
+        first_image(args.child, orientation)
+        return
+
+    config = StubConfig(latency=args.latency, jitter=0.0, low_confidence_rate=0.0)
+    _, url = start_stub(config)
+    os.environ['OPENAI_API_URL'] = url
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('MODEL_NAME', 'bench')
+
+    cold = []
+    for _ in range(args.batches):
+        with tempfile.TemporaryDirectory() as directory:
+            command = [sys.executable, os.path.abspath(__file__), '--child', directory]
+            if not orientation:
+                command.append('--no-orientation')
+            start = time.perf_counter()
+            subprocess.run(command, check=True)
+            cold.append((time.perf_counter() - start) * 1000)
+
+    os.chdir(SRC_DIR)
+    import logging
+    import ModelRegistry
+    import SharedVariables as shared
+    logging.disable(logging.CRITICAL)
+    shared.date_format = 'mm_dd_yy'
+
+    start = time.perf_counter()
+    warm_timings = ModelRegistry.warm(orientation=orientation)
+    warm_ms = (time.perf_counter() - start) * 1000
+
+    reloaded = batches(args.batches, orientation, reload=True)
+    shared_models = batches(args.batches, orientation, reload=False)
+
+    print(f"Time to first image, {args.batches} batches of one photo, stub latency {args.latency * 1000:.0f} ms\n")
+    print(f"{'':<36}{'p50 ms':>10}{'max ms':>10}")
+    print(f"{'cold process':<36}{np.median(cold):>10.0f}{np.max(cold):>10.0f}")
+    print(f"{'new batch, own models (before)':<36}{np.median(reloaded):>10.0f}{np.max(reloaded):>10.0f}")
+    print(f"{'new batch, shared warm models':<36}{np.median(shared_models):>10.0f}{np.max(shared_models):>10.0f}")
+    print(f"\nwarm() took {warm_ms:.0f} ms: {', '.join(f'{name} {seconds * 1000:.0f} ms' for name, seconds in warm_timings.items())}")
+
+
+if __name__ == "__main__":
+    main()
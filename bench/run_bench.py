@@ -0,0 +1,244 @@
+'''
+End to end benchmark of ImageOrganizer.
+
+Generates synthetic scans (plus the sample images in src/static/images), points DateExtractor at a
+local stub of the vision endpoint, runs the organizer and reports per-stage latency percentiles,
+throughput, peak RSS and bytes written. Results can be saved as JSON and compared between commits:
+
+    python bench/run_bench.py --scans 10 --output before.json
+    python bench/run_bench.py --scans 10 --output after.json --compare before.json
+'''
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from threading import Lock
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_server import StubConfig, start_stub
+
+
+class StageTimer:
+    """
+    Wraps methods on live objects and records how long each call takes.
+    """
+    def __init__(self):
+        self.durations = {}
+        self.lock = Lock()
+
+    def wrap(self, obj, method_name, stage):
+        original = getattr(obj, method_name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.durations.setdefault(stage, []).append(elapsed)
+
+        setattr(obj, method_name, timed)
+
+    def summary(self):
+        stages = {}
+        for stage, values in self.durations.items():
+            values = np.array(values) * 1000
+            stages[stage] = {
+                'count': len(values),
+                'p50_ms': round(float(np.percentile(values, 50)), 2),
+                'p90_ms': round(float(np.percentile(values, 90)), 2),
+                'p99_ms': round(float(np.percentile(values, 99)), 2),
+                'max_ms': round(float(values.max()), 2),
+                'total_s': round(float(values.sum()) / 1000, 3),
+            }
+        return stages
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, text=True).strip()
+    except Exception:
+        return None
+
+
+def folder_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def prepare_inputs(scans_path, args):
+    # Generate in a child process so its memory does not count towards the measured peak RSS
+    subprocess.check_call([sys.executable, os.path.join(BENCH_DIR, 'synthetic.py'), scans_path,
+                           '--scans', str(args.scans), '--photos-per-scan', str(args.photos_per_scan),
+                           '--seed', str(args.seed), '--fill', str(args.fill)]
+                          + (['--single'] if args.single else []) + (['--tiff'] if args.tiff else []),
+                          stdout=subprocess.DEVNULL)
+    os.remove(os.path.join(scans_path, 'manifest.json'))
+
+    if args.samples:
+        samples = os.path.join(SRC_DIR, 'static', 'images')
+        for filename in os.listdir(samples):
+            is_scan = filename == 'scan.jpg'
+            if filename.endswith('.jpg') and is_scan != args.single:
+                shutil.copy(os.path.join(samples, filename), os.path.join(scans_path, f"sample_{filename}"))
+
+
+def run(args):
+    config = StubConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                        low_confidence_rate=args.low_confidence_rate, seed=args.seed,
+                        upload_rate=args.upload_kbps * 1024 if args.upload_kbps else None,
+                        rate_limit=args.rate_limit, capacity=args.capacity)
+    server, url = start_stub(config)
+    os.environ['OPENAI_API_URL'] = url
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.setdefault('MODEL_NAME', 'bench')
+
+    # Log paths in the organizer are relative to src/, like when running main.py
+    os.chdir(SRC_DIR)
+    import SharedVariables as shared
+    import Metrics as metrics
+    from ImageOrganizer import ImageOrganizer
+    shared.date_format = 'mm_dd_yy'
+
+    work_dir = tempfile.mkdtemp(prefix='imgdate_bench_')
+    try:
+        scans_path = os.path.join(work_dir, 'scans')
+        save_path = os.path.join(work_dir, 'processed')
+        prepare_inputs(scans_path, args)
+        num_inputs = len(os.listdir(scans_path))
+        input_bytes = folder_bytes(scans_path)
+
+        organizer = ImageOrganizer(scans_path=scans_path,
+                                   save_path=save_path,
+                                   error_path=os.path.join(save_path, 'Failed'),
+                                   archive_path=os.path.join(work_dir, 'archive'),
+                                   crop_images=not args.single,
+                                   date_images=True,
+                                   fix_orientation=args.orientation,
+                                   archive_scans=True,
+                                   sort_images=True,
+                                   tiled_processing=args.tiled,
+                                   memory_budget_mb=args.memory_budget,
+                                   orientation_mode=args.orientation_mode)
+
+        timer = StageTimer()
+        timer.wrap(organizer, 'crop_and_save_scans', 'scan_total')
+        timer.wrap(organizer, 'load_scan', 'load_scan')
+        timer.wrap(organizer.auto_crop, 'crop_and_straighten_tiled' if args.tiled else 'crop_and_straighten', 'crop_and_straighten')
+        timer.wrap(organizer.date_extractor, 'extract_and_validate_date', 'extract_date')
+        timer.wrap(organizer.date_extractor, 'read_date', 'read_date')
+        if organizer.orientation:
+            timer.wrap(organizer.orientation, 'detect_rotation', 'fix_orientation')
+            timer.wrap(organizer.orientation, 'detect_scan_rotation', 'fix_orientation')
+        # Decoded crops are encoded and saved, photos already on disk (--single) are moved with new metadata
+        timer.wrap(organizer, 'update_metadata_and_save', 'save')
+        timer.wrap(organizer, 'update_metadata_and_move', 'save')
+
+        start = time.perf_counter()
+        organizer.process_images()
+        wall = time.perf_counter() - start
+
+        num_images = sum(len(files) for _, _, files in os.walk(save_path))
+        return {
+            'commit': git_commit(),
+            'params': vars(args),
+            'inputs': num_inputs,
+            'input_bytes': input_bytes,
+            'images': num_images,
+            'wall_s': round(wall, 3),
+            'images_per_s': round(num_images / wall, 3) if wall else None,
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'bytes_written': folder_bytes(save_path),
+            'api_requests': config.requests,
+            'api_request_bytes': config.request_bytes,
+            'api_rate_limited': config.rate_limited,
+            'stages': timer.summary(),
+            'counters': metrics.snapshot(),
+        }
+    finally:
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def print_report(result, baseline=None):
+    def delta(key, value, lower_is_better=True):
+        if not baseline or baseline.get(key) in (None, 0) or value is None:
+            return ""
+        change = (value - baseline[key]) / baseline[key] * 100
+        better = change < 0 if lower_is_better else change > 0
+        return f"  ({change:+.1f}% {'better' if better else 'worse'})" if abs(change) >= 0.5 else "  (same)"
+
+    print(f"\nCommit {result['commit']}: {result['inputs']} inputs -> {result['images']} images")
+    print(f"Wall time:      {result['wall_s']} s{delta('wall_s', result['wall_s'])}")
+    print(f"Throughput:     {result['images_per_s']} images/s{delta('images_per_s', result['images_per_s'], False)}")
+    print(f"Peak RSS:       {result['peak_rss_mb']} MB{delta('peak_rss_mb', result['peak_rss_mb'])}")
+    print(f"Bytes written:  {result['bytes_written']}{delta('bytes_written', result['bytes_written'])}")
+    print(f"API requests:   {result['api_requests']} ({result['api_request_bytes']} bytes uploaded, "
+          f"{result.get('api_rate_limited', 0)} rate limited){delta('api_request_bytes', result['api_request_bytes'])}")
+
+    print(f"\n{'stage':<22}{'count':>7}{'p50 ms':>11}{'p90 ms':>11}{'p99 ms':>11}{'max ms':>11}{'total s':>10}")
+    for stage, stats in result['stages'].items():
+        line = f"{stage:<22}{stats['count']:>7}{stats['p50_ms']:>11}{stats['p90_ms']:>11}{stats['p99_ms']:>11}{stats['max_ms']:>11}{stats['total_s']:>10}"
+        base = (baseline or {}).get('stages', {}).get(stage)
+        if base and base['p50_ms']:
+            line += f"  p50 {(stats['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100:+.1f}%"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ImageOrganizer pipeline end to end.")
+    parser.add_argument("-n", "--scans", type=int, default=5, help="Synthetic scans (or photos with --single)")
+    parser.add_argument("-p", "--photos-per-scan", type=int, default=4)
+    parser.add_argument("--fill", type=float, default=0.82, help="Share of its grid cell each print covers (1.0 makes prints touch)")
+    parser.add_argument("--single", action="store_true", help="Benchmark single photos (crop_images=False)")
+    parser.add_argument("--samples", action="store_true", help="Also process the sample images in src/static/images")
+    parser.add_argument("--tiff", action="store_true", help="Generate uncompressed TIFF scans")
+    parser.add_argument("--tiled", action="store_true", help="Crop scans in tiled mode")
+    parser.add_argument("--memory-budget", type=int, help="Memory budget per worker in MB")
+    parser.add_argument("--orientation", action="store_true", help="Enable FixOrientation (needs dlib and the landmark model)")
+    parser.add_argument("--orientation-mode", choices=["scan", "print"], default="scan")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean stub latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--low-confidence-rate", type=float, default=0.1)
+    parser.add_argument("--upload-kbps", type=float, help="Simulated upload bandwidth to the stub in kilobytes/second")
+    parser.add_argument("--rate-limit", type=float, help="Stub requests per second before it answers 429")
+    parser.add_argument("--capacity", type=int, help="Concurrent requests before the stub's latency grows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the organizer's log output")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    if not args.verbose:
+        import logging
+        logging.disable(logging.WARNING)
+
+    result = run(args)
+    print_report(result, baseline)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nResults written to {output}")
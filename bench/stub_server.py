@@ -0,0 +1,157 @@
+'''
+Local stand-in for the OpenAI chat completions endpoint used by DateExtractor.read_date.
+
+Answers every request with a date in the "mm dd 'yy | confidence: N" format after a configurable
+latency, so the pipeline can be benchmarked without network access or API cost. It can also
+simulate an account's rate limit (HTTP 429 with Retry-After and x-ratelimit-* headers) and a
+server that slows down beyond a number of concurrent requests.
+'''
+
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubConfig:
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0, low_confidence_rate=0.1, seed=0, upload_rate=None,
+                 rate_limit=None, capacity=None):
+        self.latency = latency                          # Mean seconds per request
+        self.upload_rate = upload_rate                  # Simulated client upload in bytes/second, None for unlimited
+        self.jitter = jitter                            # Uniform +/- seconds around the mean
+        self.error_rate = error_rate                    # Fraction of requests answered with HTTP 500
+        self.low_confidence_rate = low_confidence_rate  # Fraction of answers with confidence below 9
+        self.rate_limit = rate_limit                    # Requests per second before answering 429, None for unlimited
+        self.capacity = capacity                        # Concurrent requests before latency grows, None for unlimited
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.request_bytes = 0
+        self.rate_limited = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Token bucket holding up to one second of requests
+        self.tokens = max(1, rate_limit or 0)
+        self.refilled = time.monotonic()
+
+    def take_token(self):
+        """
+        :return: (allowed, remaining requests, seconds until the next request is allowed)
+        """
+        now = time.monotonic()
+        self.tokens = min(max(1, self.rate_limit), self.tokens + (now - self.refilled) * self.rate_limit)
+        self.refilled = now
+        if self.tokens < 1:
+            return False, 0, (1 - self.tokens) / self.rate_limit
+        self.tokens -= 1
+        return True, int(self.tokens), max(0.0, (1 - self.tokens) / self.rate_limit)
+
+    def next_answer(self, body_size):
+        """
+        :return: (delay, status, content, headers)
+        """
+        with self.lock:
+            self.requests += 1
+            self.request_bytes += body_size
+            headers = {}
+            if self.rate_limit:
+                allowed, remaining, reset = self.take_token()
+                headers = {
+                    'x-ratelimit-limit-requests': str(self.rate_limit),
+                    'x-ratelimit-remaining-requests': str(remaining),
+                    'x-ratelimit-reset-requests': f"{reset * 1000:.0f}ms",
+                }
+                if not allowed:
+                    self.rate_limited += 1
+                    headers['Retry-After'] = str(math.ceil(reset))
+                    return 0.0, 429, None, headers
+
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            if self.capacity and self.in_flight > self.capacity:
+                # Past its capacity the server queues: latency grows with the excess
+                delay *= self.in_flight / self.capacity
+            if self.upload_rate:
+                delay += body_size / self.upload_rate
+            status = 500 if self.rng.random() < self.error_rate else 200
+            confidence = self.rng.randint(3, 8) if self.rng.random() < self.low_confidence_rate else 10
+            date = f"{self.rng.randint(1, 12):02d} {self.rng.randint(1, 28):02d} '{self.rng.randint(85, 99)}"
+        return delay, status, f"{date} | confidence: {confidence}", headers
+
+    def answered(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+            delay, status, content, headers = config.next_answer(length)
+            if status != 429:
+                time.sleep(delay)
+                config.answered()
+
+            if status != 200:
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            body = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_stub(config, host="127.0.0.1", port=0):
+    """
+    Start the stub on a background thread.
+
+    :return: (server, url) where url is the chat completions endpoint to use as OPENAI_API_URL.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_port}/v1/chat/completions"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stub of the vision endpoint.")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--low-confidence-rate", type=float, default=0.1)
+    parser.add_argument("--upload-kbps", type=float, default=None, help="Simulated upload bandwidth in kilobytes/second")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second before answering 429")
+    parser.add_argument("--capacity", type=int, default=None, help="Concurrent requests before latency grows")
+    args = parser.parse_args()
+
+    upload_rate = args.upload_kbps * 1024 if args.upload_kbps else None
+    config = StubConfig(args.latency, args.jitter, args.error_rate, args.low_confidence_rate, upload_rate=upload_rate,
+                        rate_limit=args.rate_limit, capacity=args.capacity)
+    server, url = start_stub(config, port=args.port)
+    print(f"Stub listening on {url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
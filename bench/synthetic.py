@@ -0,0 +1,179 @@
+'''
+Synthetic flatbed scans for the benchmarks.
+
+Each scan is a white scanner bed with a grid of slightly rotated "prints". Every print has a
+random scene and an orange dot-matrix date stamp in its bottom right corner, like the film
+cameras ImgDate is built for. A manifest.json with the stamped dates is written next to the images.
+'''
+
+import argparse
+import json
+import os
+import random
+import cv2
+import numpy as np
+
+# 5x7 dot-matrix glyphs, one string per row
+GLYPHS = {
+    '0': ["01110", "10001", "10011", "10101", "11001", "10001", "01110"],
+    '1': ["00100", "01100", "00100", "00100", "00100", "00100", "01110"],
+    '2': ["01110", "10001", "00001", "00010", "00100", "01000", "11111"],
+    '3': ["11110", "00001", "00001", "01110", "00001", "00001", "11110"],
+    '4': ["00010", "00110", "01010", "10010", "11111", "00010", "00010"],
+    '5': ["11111", "10000", "11110", "00001", "00001", "10001", "01110"],
+    '6': ["00110", "01000", "10000", "11110", "10001", "10001", "01110"],
+    '7': ["11111", "00001", "00010", "00100", "01000", "01000", "01000"],
+    '8': ["01110", "10001", "10001", "01110", "10001", "10001", "01110"],
+    '9': ["01110", "10001", "10001", "01111", "00001", "00010", "01100"],
+    "'": ["00100", "00100", "01000", "00000", "00000", "00000", "00000"],
+    ' ': ["00000"] * 7,
+}
+
+ORANGE = (20, 140, 255)  # BGR
+
+# Letter sized scanner bed at 300 dpi
+BED_WIDTH = 2550
+BED_HEIGHT = 3510
+
+
+def random_date(rng):
+    year = rng.randint(1985, 2009)
+    month = rng.randint(1, 12)
+    day = rng.randint(1, 28)
+    return f"{month:02d}/{day:02d}/{year}"
+
+
+def stamp_date(image, date):
+    """
+    Draw the date as "mm dd 'yy" in orange dots in the bottom right corner.
+    """
+    month, day, year = date.split('/')
+    text = f"{month} {day} '{year[-2:]}"
+    h, w = image.shape[:2]
+    dot = max(3, w // 300)  # Dot spacing in pixels
+    text_width = len(text) * 6 * dot
+    x0 = int(w * 0.95) - text_width
+    y0 = int(h * 0.92) - 7 * dot
+    for i, char in enumerate(text):
+        for row, bits in enumerate(GLYPHS[char]):
+            for col, bit in enumerate(bits):
+                if bit == '1':
+                    center = (x0 + (i * 6 + col) * dot, y0 + row * dot)
+                    cv2.circle(image, center, max(1, dot // 2), ORANGE, -1, lineType=cv2.LINE_AA)
+    # Slight glow like film date imprints
+    corner = image[y0 - 2 * dot:y0 + 9 * dot, x0 - 2 * dot:x0 + text_width + dot]
+    corner[:] = cv2.GaussianBlur(corner, (3, 3), 0)
+
+
+def random_photo(width, height, rng):
+    """
+    A random "scene": gradient sky, a few shapes and sensor noise. Dark enough to pass AutoCrop.is_valid_crop.
+    """
+    np_rng = np.random.default_rng(rng.randint(0, 2**31))
+    top = np.array([rng.randint(60, 200) for _ in range(3)], dtype=np.float32)
+    bottom = np.array([rng.randint(20, 120) for _ in range(3)], dtype=np.float32)
+    ramp = np.linspace(0, 1, height, dtype=np.float32)[:, None, None]
+    image = (top * (1 - ramp) + bottom * ramp).repeat(width, axis=1).astype(np.uint8)
+
+    for _ in range(rng.randint(3, 8)):
+        color = tuple(rng.randint(0, 220) for _ in range(3))
+        center = (rng.randint(0, width), rng.randint(0, height))
+        axes = (rng.randint(width // 20, width // 4), rng.randint(height // 20, height // 4))
+        cv2.ellipse(image, center, axes, rng.randint(0, 180), 0, 360, color, -1)
+
+    noise = np_rng.normal(0, 6, image.shape).astype(np.int16)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def make_print(width, height, rng):
+    date = random_date(rng)
+    photo = random_photo(width, height, rng)
+    stamp_date(photo, date)
+    return photo, date
+
+
+def make_scan(photos_per_scan, rng, max_skew=4, fill=0.82):
+    """
+    Lay out photos_per_scan prints on a white bed in a grid, each rotated by up to max_skew degrees.
+    fill is the share of its grid cell a print covers; at 1.0 neighbouring prints touch.
+
+    :return: (scan, [dates]) with the dates in placement order.
+    """
+    bed = np.full((BED_HEIGHT, BED_WIDTH, 3), 255, dtype=np.uint8)
+    cols = 2 if photos_per_scan > 1 else 1
+    rows = (photos_per_scan + cols - 1) // cols
+    cell_w, cell_h = BED_WIDTH // cols, BED_HEIGHT // rows
+    dates = []
+
+    for i in range(photos_per_scan):
+        row, col = divmod(i, cols)
+        w, h = int(cell_w * fill), int(cell_h * fill)
+        photo, date = make_print(max(w, h), min(w, h), rng)
+        if h > w:
+            photo = cv2.rotate(photo, cv2.ROTATE_90_CLOCKWISE)
+        dates.append(date)
+
+        # Rotate the print around its center on a white canvas, then paste where it is not white
+        angle = rng.uniform(-max_skew, max_skew)
+        ph, pw = photo.shape[:2]
+        M = cv2.getRotationMatrix2D((pw / 2, ph / 2), angle, 1.0)
+        rotated = cv2.warpAffine(photo, M, (pw, ph), borderValue=(255, 255, 255))
+        mask = cv2.warpAffine(np.full((ph, pw), 255, np.uint8), M, (pw, ph))
+
+        x = col * cell_w + (cell_w - pw) // 2
+        y = row * cell_h + (cell_h - ph) // 2
+        # Prints rotated at full fill reach past the bed; clip them to it
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + pw, BED_WIDTH), min(y + ph, BED_HEIGHT)
+        region = bed[y0:y1, x0:x1]
+        inside = mask[y0 - y:y1 - y, x0 - x:x1 - x] > 0
+        region[inside] = rotated[y0 - y:y1 - y, x0 - x:x1 - x][inside]
+
+    return bed, dates
+
+
+def generate(output_dir, num_scans, photos_per_scan, single, seed=0, quality=92, tiff=False, fill=0.82):
+    """
+    Write num_scans scans (or num_scans single photos when single is True) and a manifest.json.
+    Scans are written as uncompressed TIFFs instead of JPEGs when tiff is True.
+
+    :return: The manifest as a dict of filename -> list of dates.
+    """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = {}
+    for i in range(num_scans):
+        if single:
+            image, date = make_print(1800, 1200, rng)
+            # Some single photos come in portrait, like phone captures of prints
+            if rng.random() < 0.3:
+                image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+            dates = [date]
+            filename = f"photo_{i:04d}.jpg"
+        else:
+            image, dates = make_scan(photos_per_scan, rng, fill=fill)
+            filename = f"scan_{i:04d}.tif" if tiff else f"scan_{i:04d}.jpg"
+        if filename.endswith(".tif"):
+            cv2.imwrite(os.path.join(output_dir, filename), image, [int(cv2.IMWRITE_TIFF_COMPRESSION), 1])
+        else:
+            cv2.imwrite(os.path.join(output_dir, filename), image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        manifest[filename] = dates
+
+    with open(os.path.join(output_dir, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic scans with stamped dates.")
+    parser.add_argument("output_dir")
+    parser.add_argument("-n", "--scans", type=int, default=10, help="Number of scans (or photos with --single)")
+    parser.add_argument("-p", "--photos-per-scan", type=int, default=4)
+    parser.add_argument("--single", action="store_true", help="Write single photos instead of scans")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tiff", action="store_true", help="Write scans as uncompressed TIFFs")
+    parser.add_argument("--fill", type=float, default=0.82, help="Share of its grid cell each print covers (1.0 makes prints touch)")
+    args = parser.parse_args()
+
+    generate(args.output_dir, args.scans, args.photos_per_scan, args.single, args.seed, tiff=args.tiff, fill=args.fill)
+    print(f"Wrote {args.scans} {'photos' if args.single else 'scans'} to {args.output_dir}")
@@ -2,14 +2,44 @@ import cv2
 import numpy as np
 import os
 from LoggerConfig import setup_logger
+from MaskBuilder import MaskBuilder, content_ratio
+import Metrics as metrics
+
+_crops_total = metrics.counter("imgdate_crops_total", "Candidate crops found in scans, by result")
+_prints_per_scan = metrics.histogram("imgdate_prints_per_scan", "Photos cropped out of each scan", buckets=(0, 1, 2, 4, 6, 8, 10, 12, 16, 24))
+
+# Candidate filters, applied to the contours before anything is warped.
+# Areas are relative to the scan so they hold at any scan resolution.
+MIN_AREA_RATIO = 0.01      # Smaller contours are dust, text or scanner noise
+MAX_AREA_RATIO = 0.95      # Larger ones are the scanner bed itself
+MAX_ASPECT_RATIO = 3.5     # Long side over short side of a print, panoramas included
+MIN_RECTANGULARITY = 0.85  # Contour area over the area of its rotated bounding box
+BORDER_MARGIN = 2          # Pixels from the edge of the scan that count as touching it
+BORDER_SPAN_RATIO = 0.9    # Contours touching the edge and spanning this much of the scan are lid or edge shadows
+SPLIT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8)  # Fractions of the peak distance tried to separate touching prints
+SPLIT_COVERAGE = 0.75      # Splits at necks covering less of the contour are also tried along seams
+SIZE_TOLERANCE = 0.12      # How closely a merged box must match a whole number of typical prints to be divided
+SINGLE_PRINT_ASPECT = 2.0  # Longer boxes may be panoramas or prints touching end to end, and are checked for a seam
+
+# Seams between prints that touch along a whole edge, found as straight lines of strong edges
+SEAM_SIZE = 400            # Short side, in pixels, of the box image searched for seams (a seam runs across it)
+SEAM_MAX_SIZE = 1200       # Cap on the long side
+SEAM_GRADIENT = 60         # Sobel response across a seam (two different photos meet there)
+SEAM_MAX_SLANT = 0.12      # Lean of a seam against the box, about 7 degrees, for prints skewed against each other
+SEAM_OFFSET = 8            # Pixels to the parallel lines a seam is compared with
+SEAM_CONTRAST = 0.55       # Share of the seam line on an edge, above the lines next to it. Texture scores
+                           # about as high beside a line as on it: single photos reach 0.45, seams 0.65 or more
+SEAM_MARGIN = 0.2          # Seams in merged contours are looked for between this share of their length and 1 minus it
 
 class AutoCrop:
-    def __init__(self, save_path, draw_contours):
+    def __init__(self, save_path, draw_contours, mask_builder=None):
         self.current_image = 0
         self.draw_contours = draw_contours
         self.save_path = save_path
+        self.mask_builder = mask_builder or MaskBuilder()
         self.log = setup_logger("AutoCrop", "../log/ImgDate.log")
 
+    @metrics.timed("imgdate_stage_seconds", stage="crop_and_straighten")
     def crop_and_straighten(self, image):
 
         # Use the improved method to create a robust mask
@@ -21,64 +51,427 @@ class AutoCrop:
         # Save the mask for debugging
         # cv2.imwrite(f"../img/processed/mask_{self.current_image}.jpg", mask)
 
-        cropped_images = []
-        preview_image = image.copy()
+        preview_image = image.copy() if self.draw_contours else None
+        scan_size = (image.shape[1], image.shape[0])
+        return self.crop_contours(contours, scan_size, preview_image, lambda rect: self.crop_rotated_rectangle(image, rect), image)
 
-        for contour in contours:
-            rect = cv2.minAreaRect(contour)
-            area = cv2.contourArea(contour)
+    @metrics.timed("imgdate_stage_seconds", stage="crop_and_straighten")
+    def crop_and_straighten_tiled(self, reader, factor):
+        """
+        Find the photos on a mask built from a reduced decode of the scan, then read only
+        the region of each photo at full resolution.
+
+        :param reader: ImageLoader.ScanReader of the scan.
+        :param factor: Reduction factor of the decode the mask is built from.
+        """
+        reduced = reader.reduced(factor)
+        mask = self.create_mask(reduced)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        scan_size = (mask.shape[1], mask.shape[0])
+        del mask
 
-            # Debug self.log.info contour areas
+        preview_image = reduced.copy() if self.draw_contours else None
+        width, height = reader.size
 
-            # Filter out too small or too large areas - adjust these values based on image characteristics
-            if area < 1000000 or area > 9000000:
-                continue
+        def crop_full_resolution(rect):
+            box = cv2.boxPoints(rect)
+            x0, y0 = np.maximum(np.floor(box.min(axis=0)).astype(int) - 1, 0)
+            x1, y1 = np.minimum(np.ceil(box.max(axis=0)).astype(int) + 1, (width, height))
+            region = reader.read_region(x0, y0, x1, y1)
+            (cx, cy), size, angle = rect
+            return self.crop_rotated_rectangle(region, ((cx - x0, cy - y0), size, angle))
+
+        # The reduced image is kept for finding seams between touching prints
+        return self.crop_contours(contours, scan_size, preview_image, crop_full_resolution, reduced, factor)
 
+    def crop_contours(self, contours, scan_size, preview_image, crop, image, factor=1):
+        """
+        Crop every contour that looks like a print out of the scan. Contours of touching prints
+        are split first, and candidates are filtered on their shape before anything is warped.
+
+        :param scan_size: (width, height) of the image the contours were found on.
+        :param preview_image: Image the accepted boxes are drawn on when draw_contours is set.
+        :param crop: Function taking a full resolution rotated rectangle and returning the crop.
+        :param image: The image the contours were found on, searched for seams between touching prints.
+        :param factor: Scale of the contours relative to the full resolution scan.
+        """
+        stats = {'contours': len(contours)}
+        candidates = self.find_candidates(contours, scan_size, stats, image)
+        cropped_images = []
+
+        for rect in candidates:
             if self.draw_contours:
                 # debug Draw the rotated rectangle for preview
                 box = cv2.boxPoints(rect)
                 box = np.intp(box)
-                cv2.drawContours(preview_image, [box], 0, (0, 255, 0), 35)
-                
+                cv2.drawContours(preview_image, [box], 0, (0, 255, 0), max(1, 35 // factor))
+
+            (cx, cy), (w, h), angle = rect
+            rect = ((cx * factor, cy * factor), (w * factor, h * factor), angle)
 
             # Extract and process the rotated rectangle
-            cropped = self.crop_rotated_rectangle(image, rect)
+            cropped = crop(rect)
 
             # Validate the cropped image to ensure it has enough non-white content
             if cropped.size > 0 and self.is_valid_crop(cropped):
                 cropped_images.append(cropped)
                 self.current_image += 1
+                self.count(stats, "accepted")
+            else:
+                self.count(stats, "rejected_blank")
 
         if self.draw_contours:
             contour_path = os.path.join(self.save_path, "contours")
             os.makedirs(contour_path, exist_ok=True)
             cv2.imwrite(f"{contour_path}/contours_{self.current_image}.jpg", preview_image)
 
-        self.log.info(f"Detected {len(cropped_images)} images.")
+        _prints_per_scan.observe(len(cropped_images))
+        self.log.info(f"Detected {len(cropped_images)} images. Detection stats: "
+                      + ", ".join(f"{key}={value}" for key, value in stats.items()))
         return cropped_images
 
-    def create_mask(self, image):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    @staticmethod
+    def count(stats, result):
+        stats[result] = stats.get(result, 0) + 1
+        _crops_total.inc(result=result)
+
+    def find_candidates(self, contours, scan_size, stats, image):
+        """
+        Rotated rectangles of the contours that pass the print filters, with merged prints split apart.
+        """
+        min_area = MIN_AREA_RATIO * scan_size[0] * scan_size[1]
+        candidates = []
+        rejected = []
+
+        for contour in contours:
+            # Cheapest check first, it rejects the many small noise contours
+            area = cv2.contourArea(contour)
+            if area < min_area:
+                self.count(stats, "rejected_size")
+                continue
+
+            rect, result = self.check_candidate(contour, area, scan_size)
+            if rect is None:
+                rejected.append((contour, result))
+            else:
+                candidates.append(rect)
+
+        # Prints touching end to end pass the filters as one panorama shaped box
+        candidates = self.split_long(candidates, image, min_area, scan_size, stats)
+        typical = self.typical_print(candidates)
+
+        for contour, result in rejected:
+            rect = self.matched_print(contour, result, typical)
+            if rect is not None:
+                self.count(stats, "matched_size")
+                candidates.append(rect)
+                continue
+
+            # Touching prints merge into one contour that fails the filters, try splitting it at
+            # its necks, then along straight seams for prints that touch along a whole edge
+            part_rects = self.split_candidates(contour, min_area, scan_size)
+            if self.covered_area(part_rects) < SPLIT_COVERAGE * cv2.contourArea(contour):
+                seam_rects = self.split_seams(image, contour, min_area, scan_size, typical)
+                if self.covered_area(seam_rects) > self.covered_area(part_rects):
+                    part_rects = seam_rects
+            if len(part_rects) >= 2:
+                self.count(stats, "split")
+                stats['split_parts'] = stats.get('split_parts', 0) + len(part_rects)
+                candidates.extend(self.split_long(part_rects, image, min_area, scan_size, stats))
+            else:
+                self.count(stats, result)
 
-        # Adaptive thresholding to handle varying lighting conditions
-        adaptive_thresh = cv2.adaptiveThreshold(
-            gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2
-        )
+        # Split parts are prints too; with them the median print is known even on a bed of touching prints
+        return self.divide_oversized(candidates, self.typical_print(candidates), stats)
 
-        # Combine adaptive threshold with color thresholding
-        lower_white = np.array([200, 200, 200], dtype=np.uint8)
-        upper_white = np.array([255, 255, 255], dtype=np.uint8)
-        color_mask = cv2.inRange(image, lower_white, upper_white)
-        color_mask_inv = cv2.bitwise_not(color_mask)
+    def matched_print(self, contour, result, typical):
+        """
+        A print with white sky or snow along its edge has a notched contour that fails the shape
+        filter, but its box is the size of the median print. Returns that box, or None.
+        """
+        if result != "rejected_shape" or typical is None:
+            return None
+        rect = cv2.minAreaRect(contour)
+        return rect if self.print_multiple(*rect[1], *typical)[0] == 1 else None
 
-        # Combine masks to better segment areas
-        combined_mask = cv2.bitwise_and(adaptive_thresh, adaptive_thresh, mask=color_mask_inv)
+    @staticmethod
+    def covered_area(rects):
+        return sum(w * h for _, (w, h), _ in rects) if len(rects) >= 2 else 0
 
-        # Apply morphological operations to clean up the mask
-        kernel = np.ones((5, 5), np.uint8)
-        morph = cv2.morphologyEx(combined_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    @staticmethod
+    def typical_print(candidates):
+        """
+        (short, long) side of the median print-shaped box, or None when there is none.
+        """
+        singles = sorted((sorted(size) for _, size, _ in candidates
+                          if min(size) > 0 and max(size) / min(size) <= SINGLE_PRINT_ASPECT),
+                         key=lambda size: size[0] * size[1])
+        # The lower median, so a bed of as many pairs of touching prints as single prints divides the pairs
+        return tuple(singles[(len(singles) - 1) // 2]) if singles else None
 
-        return morph
+    def divide_oversized(self, candidates, typical, stats):
+        """
+        Prints that touch along a whole edge merge into one clean rectangle with no neck to split at.
+        Beds are usually filled with prints of one size, so a box that is a whole number of the
+        median print long (and one print wide) is divided into that many prints.
+        """
+        if typical is None:
+            return candidates
+
+        short, long = typical
+        divided = []
+        for rect in candidates:
+            (cx, cy), (w, h), angle = rect
+            count, along_width = self.print_multiple(w, h, short, long)
+            if count < 2:
+                divided.append(rect)
+                continue
+
+            # Unit vector of the axis to divide, along the width of the box for minAreaRect's angle
+            theta = np.deg2rad(angle)
+            axis = np.array([np.cos(theta), np.sin(theta)]) if along_width else np.array([-np.sin(theta), np.cos(theta)])
+            length = w if along_width else h
+            for i in range(count):
+                offset = (i + 0.5) * length / count - length / 2
+                size = (w / count, h) if along_width else (w, h / count)
+                divided.append(((cx + axis[0] * offset, cy + axis[1] * offset), size, angle))
+            self.count(stats, "divided")
+            stats['divided_parts'] = stats.get('divided_parts', 0) + count
+        return divided
+
+    def split_long(self, candidates, image, min_area, scan_size, stats):
+        """
+        Boxes too long for a single print are panoramas or two prints touching end to end. The
+        latter are split where a seam across the middle divides them into two print shaped halves;
+        only the middle is searched, as a line across the short side of a panorama is easily
+        straight enough to pass for a seam.
+        """
+        result = []
+        for rect in candidates:
+            if self.has_single_aspect(rect):
+                result.append(rect)
+                continue
+            parts = self.cut_at_seam(image, np.intp(cv2.boxPoints(rect)), min_area, 0.5 - SIZE_TOLERANCE / 2)
+            part_rects = [cv2.minAreaRect(part) for part in parts]
+            if len(part_rects) == 2 and all(self.has_single_aspect(part) for part in part_rects):
+                self.count(stats, "split_seam")
+                stats['split_parts'] = stats.get('split_parts', 0) + len(part_rects)
+                result.extend(part_rects)
+            else:
+                result.append(rect)
+        return result
+
+    @staticmethod
+    def print_multiple(w, h, short, long):
+        """
+        :return: (n, along_width) when a w x h box is n prints of short x long side by side, else (0, None).
+        """
+        def close(value, target):
+            return abs(value - target) <= SIZE_TOLERANCE * target
+
+        for along_width, length, breadth in ((True, w, h), (False, h, w)):
+            for side, other in ((short, long), (long, short)):
+                if close(breadth, other):
+                    count = int(round(length / side))
+                    if count >= 1 and close(length, count * side):
+                        return count, along_width
+        return 0, None
+
+    def split_candidates(self, contour, min_area, scan_size, depth=4):
+        """
+        Split a contour of touching prints, splitting the parts again as long as they keep
+        dividing into print shaped pieces (a row of prints separates one neck at a time).
+        """
+        parts = [part for part in self.split_merged(contour) if cv2.contourArea(part) >= min_area]
+        if len(parts) < 2:
+            return []
+
+        rects = []
+        for part in parts:
+            sub_rects = self.split_candidates(part, min_area, scan_size, depth - 1) if depth > 1 else []
+            if len(sub_rects) >= 2:
+                rects.extend(sub_rects)
+            else:
+                rect, _ = self.check_candidate(part, cv2.contourArea(part), scan_size)
+                if rect is not None:
+                    rects.append(rect)
+        return rects
+
+    def check_candidate(self, contour, area, scan_size):
+        """
+        :return: (rotated rectangle, None) for a contour shaped like a print, or (None, reason) to reject it.
+        """
+        width, height = scan_size
+        if area > MAX_AREA_RATIO * width * height:
+            return None, "rejected_size"
+
+        rect = cv2.minAreaRect(contour)
+        rect_area = rect[1][0] * rect[1][1]
+        if rect_area <= 0 or area / rect_area < MIN_RECTANGULARITY:
+            return None, "rejected_shape"
+
+        x, y, w, h = cv2.boundingRect(contour)
+        touches_border = (x <= BORDER_MARGIN or y <= BORDER_MARGIN
+                          or x + w >= width - BORDER_MARGIN or y + h >= height - BORDER_MARGIN)
+        if touches_border and (w >= BORDER_SPAN_RATIO * width or h >= BORDER_SPAN_RATIO * height):
+            return None, "rejected_border"
+
+        if not self.has_print_aspect(rect):
+            return None, "rejected_aspect"
+        return rect, None
+
+    @staticmethod
+    def has_print_aspect(rect):
+        w, h = rect[1]
+        return min(w, h) > 0 and max(w, h) / min(w, h) <= MAX_ASPECT_RATIO
+
+    @staticmethod
+    def has_single_aspect(rect):
+        w, h = rect[1]
+        return min(w, h) > 0 and max(w, h) / min(w, h) <= SINGLE_PRINT_ASPECT
+
+    def split_seams(self, image, contour, min_area, scan_size, typical=None, depth=4):
+        """
+        Cut a contour along the strongest straight seam in the image and the parts again
+        (a grid of prints needs a cut per row and column). Parts that are neither print shaped
+        nor a notched print of the typical size after depth cuts are dropped.
+        """
+        parts = self.cut_at_seam(image, contour, min_area, SEAM_MARGIN)
+        if len(parts) < 2:
+            return []
+
+        rects = []
+        for part in parts:
+            # A part may pass as a print and still be two (e.g. a column of two landscape prints)
+            sub_rects = self.split_seams(image, part, min_area, scan_size, typical, depth - 1) if depth > 1 else []
+            if len(sub_rects) >= 2:
+                rects.extend(sub_rects)
+                continue
+            rect, result = self.check_candidate(part, cv2.contourArea(part), scan_size)
+            rect = rect or self.matched_print(part, result, typical)
+            if rect is not None:
+                rects.append(rect)
+        return rects if len(rects) >= 2 else []
+
+    def cut_at_seam(self, image, contour, min_area, margin):
+        """
+        Parts of the contour on either side of its strongest seam, or [] when it has none.
+        Seams are looked for between margin and 1 - margin of the box's length.
+        """
+        rect = cv2.minAreaRect(contour)
+        (w, h) = rect[1]
+        if min(w, h) < 1:
+            return []
+
+        # Image of the box, straightened and scaled to SEAM_SIZE; rows run along the box's height
+        scale = min(1.0, SEAM_SIZE / min(w, h), SEAM_MAX_SIZE / max(w, h))
+        pw, ph = max(1, int(w * scale)), max(1, int(h * scale))
+        box = cv2.boxPoints(rect).astype(np.float32)
+        to_patch = cv2.getAffineTransform(box[:3], np.float32([[0, ph - 1], [0, 0], [pw - 1, 0]]))
+        patch = cv2.warpAffine(image, to_patch, (pw, ph))
+
+        best = None
+        for transposed in (False, True):
+            seam = self.find_seam(cv2.transpose(patch) if transposed else patch, margin)
+            if seam and (best is None or seam[0] > best[0]):
+                best = seam + (transposed,)
+        if best is None:
+            return []
+
+        # Ends of the seam a little past the box, back in image coordinates
+        _, x, slant, transposed = best
+        length = pw if transposed else ph
+        ends = [(x - slant * (y - length / 2), y) for y in (-0.1 * length, 1.1 * length)]
+        if transposed:
+            ends = [(y, x) for x, y in ends]
+        to_image = cv2.invertAffineTransform(to_patch)
+        ends = cv2.transform(np.float32([ends]), to_image)[0]
+
+        x0, y0, bw, bh = cv2.boundingRect(contour)
+        filled = np.zeros((bh + 2, bw + 2), dtype=np.uint8)
+        cv2.drawContours(filled, [contour], -1, 255, cv2.FILLED, offset=(1 - x0, 1 - y0))
+        ends = np.intp(np.round(ends - (x0 - 1, y0 - 1)))
+        cv2.line(filled, tuple(ends[0]), tuple(ends[1]), 0, max(3, int(2 / scale)))
+        part_contours, _ = cv2.findContours(filled, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0 - 1, y0 - 1))
+        return [part for part in part_contours if cv2.contourArea(part) >= min_area]
+
+    @staticmethod
+    def find_seam(patch, margin):
+        """
+        Strongest near vertical straight line of edges across the patch.
+
+        Each lean is sheared upright so the lines become columns. A column scores the share of it on
+        an edge minus that of the columns SEAM_OFFSET to either side, so texture does not count.
+
+        :return: (contrast, x at mid height, lean in x per row) or None below SEAM_CONTRAST.
+        """
+        height, width = patch.shape[:2]
+        low, high = int(width * margin), int(width * (1 - margin))
+        if high - low < 1 or width <= 2 * SEAM_OFFSET:
+            return None
+        blurred = cv2.GaussianBlur(patch, (3, 3), 0)
+        edges = (np.abs(cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3)).max(axis=2) >= SEAM_GRADIENT).astype(np.float32)
+        # A seam may fall between two pixels
+        edges = cv2.dilate(edges, np.ones((1, 3), np.uint8))
+
+        best = None
+        # Leans in steps of two pixels over the height
+        for slant in np.linspace(-SEAM_MAX_SLANT, SEAM_MAX_SLANT, 2 * int(SEAM_MAX_SLANT * height / 4) + 1):
+            shear = np.float32([[1, slant, -slant * height / 2], [0, 1, 0]])
+            profile = cv2.warpAffine(edges, shear, (width, height), flags=cv2.INTER_NEAREST).mean(axis=0)
+            beside = np.maximum(np.r_[np.zeros(SEAM_OFFSET), profile[:-SEAM_OFFSET]],
+                                np.r_[profile[SEAM_OFFSET:], np.zeros(SEAM_OFFSET)])
+            contrast = profile[low:high] - beside[low:high]
+            x = int(np.argmax(contrast))
+            if contrast[x] >= SEAM_CONTRAST and (best is None or contrast[x] > best[0]):
+                best = (float(contrast[x]), low + x, float(slant))
+        return best
+
+    def split_merged(self, contour):
+        """
+        Split the contour of touching prints at the narrow necks between them.
+
+        The distance transform of the filled contour peaks in the middle of each print, so raising
+        a threshold on it separates the prints into seeds. Every pixel of the contour then goes to its
+        nearest seed, which gives each print back its full outline.
+        """
+        x, y, w, h = cv2.boundingRect(contour)
+        filled = np.zeros((h + 2, w + 2), dtype=np.uint8)
+        cv2.drawContours(filled, [contour], -1, 255, cv2.FILLED, offset=(1 - x, 1 - y))
+        distance = cv2.distanceTransform(filled, cv2.DIST_L2, 5)
+        peak = distance.max()
+
+        for threshold in SPLIT_THRESHOLDS:
+            seeds = np.where(distance > threshold * peak, 0, 255).astype(np.uint8)
+            count, _ = cv2.connectedComponents(cv2.bitwise_not(seeds))
+            if count - 1 >= 2:
+                break
+        else:
+            return []
+
+        # Label of the nearest seed for every pixel (a Voronoi partition of the seeds)
+        _, labels = cv2.distanceTransformWithLabels(seeds, cv2.DIST_L2, 5, labelType=cv2.DIST_LABEL_CCOMP)
+        parts = []
+        for label in np.unique(labels[filled > 0]):
+            part = np.where((labels == label) & (filled > 0), 255, 0).astype(np.uint8)
+            part_contours, _ = cv2.findContours(part, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x - 1, y - 1))
+            if part_contours:
+                parts.append(max(part_contours, key=cv2.contourArea))
+        return parts
+
+    @metrics.timed("imgdate_stage_seconds", stage="create_mask")
+    def create_mask(self, image):
+        """
+        Segmentation mask of the photos on a scan (adaptive threshold without the white background,
+        closed with a 5x5 kernel). The mask is a per-thread scratch buffer, valid until the next call.
+        """
+        return self.mask_builder.build(image)
+
+    def create_masks(self, scans):
+        """
+        Masks of several scans of the same size, reusing one set of scratch buffers.
+        """
+        return self.mask_builder.build_batch(scans)
 
     def crop_rotated_rectangle(self, image, rect):
         # Extract the bounding box
@@ -101,9 +494,7 @@ class AutoCrop:
         return final_cropped
 
     def is_valid_crop(self, image, min_content_threshold=0.1):
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        non_white_ratio = np.sum(gray < 240) / (gray.shape[0] * gray.shape[1])
-        return non_white_ratio > min_content_threshold
+        return content_ratio(image) > min_content_threshold
 
     def remove_border(self, image, border_size):
         height, width = image.shape[:2]
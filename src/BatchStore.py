@@ -0,0 +1,195 @@
+'''
+State of the web server's upload batches, kept in SQLite instead of the memory of one process.
+
+Every WSGI worker of app.py and every BatchWorker.py process opens the same database, so a batch
+uploaded through one worker can be processed by another process and its status and download
+served by any of them:
+
+    import BatchStore
+
+    store = BatchStore.shared_store()
+    store.create(batch_id, upload_dir, files, options)
+    batch = store.claim(worker)            # in a BatchWorker
+    store.update(batch_id, status='completed', result_path=zip_path)
+'''
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from LoggerConfig import setup_logger
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img', 'web', 'batches.db')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    upload_dir TEXT,
+    files TEXT,
+    options TEXT,
+    ip TEXT,
+    user_agent TEXT,
+    referrer TEXT,
+    error TEXT,
+    num_images INTEGER NOT NULL DEFAULT 0,
+    current_image_num INTEGER NOT NULL DEFAULT 0,
+    processed_count INTEGER,
+    result_path TEXT,
+    worker TEXT,
+    created_at REAL,
+    start_time REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS batches_status ON batches (status, created_at);
+'''
+
+# Columns stored as JSON text
+JSON_COLUMNS = ('files', 'options')
+
+
+class BatchStore:
+    """
+    Batches move through the statuses the upload page polls for: started (uploaded, waiting for
+    a worker), processing, completed or failed.
+    """
+    def __init__(self, db_path=DEFAULT_PATH):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # sqlite3 connections may not be shared between threads, so each thread opens its own
+        self.local = threading.local()
+        with self.connection() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+        self.log = setup_logger("BatchStore", "../log/webserver.log")
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            self.local.connection = connection
+        return connection
+
+    @staticmethod
+    def to_dict(row):
+        if row is None:
+            return None
+        batch = dict(row)
+        for column in JSON_COLUMNS:
+            batch[column] = json.loads(batch[column]) if batch[column] else None
+        return batch
+
+    def create(self, batch_id, upload_dir, files, options, ip=None, user_agent=None, referrer=None):
+        with self.connection() as connection:
+            connection.execute(
+                "INSERT INTO batches (id, status, upload_dir, files, options, ip, user_agent, referrer, created_at) "
+                "VALUES (?, 'started', ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, upload_dir, json.dumps(files), json.dumps(options), ip, user_agent, referrer, time.time()))
+
+    def get(self, batch_id):
+        return self.to_dict(self.connection().execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone())
+
+    def update(self, batch_id, only_status=None, **fields):
+        """
+        Set fields of a batch. With only_status the batch is only updated while it has that status,
+        e.g. so a worker does not complete a batch that was failed as stale meanwhile.
+        Returns whether the batch was updated.
+        """
+        for column in JSON_COLUMNS:
+            if column in fields:
+                fields[column] = json.dumps(fields[column])
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        sql = f"UPDATE batches SET {assignments} WHERE id = ?"
+        params = (*fields.values(), batch_id)
+        if only_status is not None:
+            sql += " AND status = ?"
+            params += (only_status,)
+        with self.connection() as connection:
+            return connection.execute(sql, params).rowcount > 0
+
+    def claim(self, worker):
+        """
+        Mark the oldest batch waiting for a worker as processing and return it, or None.
+        One statement, so two workers never claim the same batch.
+        """
+        with self.connection() as connection:
+            row = connection.execute(
+                "UPDATE batches SET status = 'processing', worker = ?, start_time = ? "
+                "WHERE id = (SELECT id FROM batches WHERE status = 'started' ORDER BY created_at LIMIT 1) "
+                "AND status = 'started' RETURNING *", (worker, time.time())).fetchone()
+        return self.to_dict(row)
+
+    def fail_stale(self, timeout, queue_timeout):
+        """
+        Fail batches that have been processing for longer than timeout seconds (e.g. their worker
+        was killed) or waited queue_timeout seconds for a worker. Returns the failed batches, whose
+        uploads no worker will remove any more.
+        """
+        now = time.time()
+        with self.connection() as connection:
+            rows = connection.execute(
+                "UPDATE batches SET status = 'failed', error = 'Process timed out', finished_at = ? "
+                "WHERE (status = 'processing' AND start_time < ?) OR (status = 'started' AND created_at < ?) "
+                "RETURNING *", (now, now - timeout, now - queue_timeout)).fetchall()
+        return [self.to_dict(row) for row in rows]
+
+    @staticmethod
+    def is_stale(batch, timeout, queue_timeout):
+        """
+        Whether fail_stale would fail this batch, for readers that should not write.
+        """
+        limits = {'started': (batch['created_at'], queue_timeout), 'processing': (batch['start_time'], timeout)}
+        since, limit = limits.get(batch['status'], (None, None))
+        return since is not None and time.time() - since > limit
+
+    def with_status(self, status):
+        return [self.to_dict(row) for row in
+                self.connection().execute("SELECT * FROM batches WHERE status = ? ORDER BY created_at", (status,))]
+
+    def counts(self):
+        return {row['status']: row['count'] for row in
+                self.connection().execute("SELECT status, COUNT(*) AS count FROM batches GROUP BY status")}
+
+    def progress(self, batch_id):
+        return BatchProgress(self, batch_id)
+
+
+class BatchProgress:
+    """
+    The dict ImageOrganizer reports its progress in (batch_progress), writing through to the store.
+    Reads come from the values this process wrote, so only writes touch the database.
+    """
+    COLUMNS = ('num_images', 'current_image_num')
+
+    def __init__(self, store, batch_id):
+        self.store = store
+        self.batch_id = batch_id
+        self.values = {}
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+        if key in self.COLUMNS:
+            self.store.update(self.batch_id, **{key: value})
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_store():
+    """
+    The store of this process, at BATCH_DB (default img/web/batches.db).
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BatchStore(os.getenv('BATCH_DB', DEFAULT_PATH))
+        return _shared
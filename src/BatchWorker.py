@@ -0,0 +1,252 @@
+'''
+Processes the web server's upload batches, separately from the web workers that accept them.
+
+app.py only saves the uploaded files and records the batch in the BatchStore; workers claim
+batches from the store, process them and record the zip to download. Any number of workers can
+run, on the same machine as the web server:
+
+    python BatchWorker.py --threads 4
+
+app.py also runs EMBEDDED_BATCH_WORKERS (default 4) worker threads itself so that "python app.py"
+works on its own. Under a WSGI server with several workers, set it to 0 and run BatchWorker.py
+processes instead.
+'''
+
+import argparse
+import contextlib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import zipfile
+from dotenv import load_dotenv
+import BatchStore
+import ModelRegistry
+from ImageOrganizer import ImageOrganizer
+from LoggerConfig import setup_logger, log_context
+from Profiler import profile_run
+
+load_dotenv()
+log = setup_logger("BatchWorker", "../log/webserver.log")
+
+UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', '../img/web/uploads')
+PROCESSED_FOLDER = os.getenv('PROCESSED_FOLDER', '../img/web/processed')
+
+# Keeps the crops, dates and photos of every uploaded scan so an upload of the same scan is served
+# from it. Off by default because it keeps copies of the users' photos on the server.
+SCAN_INDEX_ENABLED = os.getenv('SCAN_INDEX_ENABLED', 'false').lower() == 'true'
+INDEX_FOLDER = os.getenv('INDEX_FOLDER', '../img/web/index')
+
+# Crop large uploads (e.g. 1200 dpi TIFFs) from a reduced decode, reading each photo at full
+# resolution, so a batch needs far less memory than the decoded scan
+TILED_PROCESSING = os.getenv('TILED_PROCESSING', 'false').lower() == 'true'
+
+POLL_SECONDS = 1
+BATCH_TIMEOUT = 15 * 60  # Batches processing for longer are considered failed
+# Batches waiting for a worker for longer are failed, e.g. because no worker is running; under
+# load a batch may wait much longer than one takes to process
+QUEUE_TIMEOUT = int(os.getenv('BATCH_QUEUE_TIMEOUT', 2 * 60 * 60))
+STALE_CHECK_SECONDS = 60
+
+
+class BatchWorker:
+    def __init__(self, store=None, poll_seconds=POLL_SECONDS):
+        self.store = store or BatchStore.shared_store()
+        self.poll_seconds = poll_seconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+    def run(self, stop=None):
+        """
+        Process batches until stop (a threading.Event) is set.
+        """
+        stop = stop or threading.Event()
+        name = f"{self.name}:{threading.current_thread().name}"
+        last_stale_check = 0.0
+        while not stop.is_set():
+            try:
+                if time.monotonic() - last_stale_check > STALE_CHECK_SECONDS:
+                    last_stale_check = time.monotonic()
+                    self.fail_stale()
+                batch = self.store.claim(name)
+            except Exception as e:
+                log.error(f"Could not claim a batch: {e}")
+                batch = None
+            if batch is None:
+                stop.wait(self.poll_seconds)
+                continue
+            # Tag every log record written for this batch with its id
+            with log_context(batch_id=batch['id']):
+                try:
+                    self.process(batch)
+                except Exception as e:
+                    # A failed batch must not stop the worker, or every later upload waits forever
+                    log.exception(f"Error processing batch: {e}")
+                    self.fail(batch['id'], e)
+                finally:
+                    self.remove_upload(batch)
+
+    @staticmethod
+    def remove_upload(batch):
+        upload_dir = batch.get('upload_dir')
+        if upload_dir and os.path.exists(upload_dir):
+            shutil.rmtree(upload_dir, ignore_errors=True)
+            log.info(f"Deleted upload directory: {upload_dir}")
+
+    def fail_stale(self):
+        """
+        Fail the batches that timed out and remove their uploads, which the worker of a waiting
+        batch would otherwise have removed.
+        """
+        stale = self.store.fail_stale(BATCH_TIMEOUT, QUEUE_TIMEOUT)
+        for batch in stale:
+            with log_context(batch_id=batch['id']):
+                log.warning(f"Batch timed out while {'waiting for a worker' if batch['start_time'] is None else 'processing'}")
+                self.remove_upload(batch)
+        if stale:
+            log.info(f"Failed {len(stale)} timed out batches")
+
+    def fail(self, batch_id, error):
+        try:
+            # A batch failed as stale meanwhile keeps its timeout error
+            self.store.update(batch_id, only_status='processing', status='failed', error=str(error), finished_at=time.time())
+        except Exception as e:
+            log.error(f"Could not mark batch {batch_id} as failed: {e}")
+
+    def process(self, batch):
+        batch_id = batch['id']
+        options = batch['options']
+
+        log.info("\n\n\n-----------------------------------")
+        log.info(f"Processing batch {batch_id}")
+        log.info(f"Uploaded files: {[os.path.basename(file) for file in batch['files']]}")
+
+        with tempfile.TemporaryDirectory() as tmpdirname:
+            scans_path = os.path.join(tmpdirname, 'scans')
+            save_path = os.path.join(tmpdirname, 'processed')
+            contours_path = os.path.join(scans_path, 'contours')
+            error_path = os.path.join(save_path, 'Failed')
+
+            os.makedirs(scans_path)
+            os.makedirs(save_path)
+            os.makedirs(error_path)
+
+            for file_path in batch['files']:
+                if os.path.exists(file_path):
+                    shutil.move(file_path, os.path.join(scans_path, os.path.basename(file_path)))
+                else:
+                    log.error(f"File not found: {file_path}")
+
+            # Process images
+            image_organizer = ImageOrganizer(
+                save_path=save_path,
+                scans_path=scans_path,
+                error_path=error_path,
+                archive_scans=False,
+                sort_images=options.get('sort_images', False),
+                fix_orientation=options.get('fix_orientation', False),
+                orientation_mode=options.get('orientation_mode', 'scan'),
+                crop_images=options.get('crop_images', False),
+                date_images=options.get('date_images', False),
+                draw_contours=options.get('draw_contours', False),
+                tiled_processing=TILED_PROCESSING,
+                batch_progress=self.store.progress(batch_id),
+                batch_id=batch_id,
+                index_path=INDEX_FOLDER if SCAN_INDEX_ENABLED else None,
+                date_format=options.get('date_format'),
+                date_range=options.get('date_range')
+            )
+
+            log.info("Options chosen:\n" + "\n".join(f"{k}={v}" for k, v in options.items()))
+
+            # The profile is written into the save path so it is included in the batch's zip
+            if options.get('profile'):
+                profiler = profile_run(os.path.join(save_path, 'profile'), label=f"batch_{batch_id}")
+            else:
+                profiler = contextlib.nullcontext()
+
+            try:
+                with profiler:
+                    image_organizer.process_images()
+            except Exception as e:
+                self.fail(batch_id, e)
+                log.error(f"Error processing images: {str(e)}")
+                return
+
+            # Apply prefix to processed images if provided
+            prefix = options.get('file_prefix', '')
+            if prefix:
+                for root, _, files_in_dir in os.walk(save_path):
+                    for file in files_in_dir:
+                        old_path = os.path.join(root, file)
+                        new_filename = f"{prefix}_{file}"
+                        new_path = os.path.join(root, new_filename)
+                        os.rename(old_path, new_path)
+
+            # Create a zip file of processed images
+            zip_path = os.path.abspath(os.path.join(PROCESSED_FOLDER, f'ImgDate_{batch_id}.zip'))
+            processed_count = 0
+            with zipfile.ZipFile(zip_path, 'w') as zipf:
+                for root, _, files_in_dir in os.walk(save_path):
+                    for file in files_in_dir:
+                        zipf.write(os.path.join(root, file),
+                                   os.path.relpath(os.path.join(root, file), save_path))
+                        processed_count += 1
+
+                if options.get('draw_contours') and os.path.exists(contours_path):
+                    for root, _, files_in_dir in os.walk(contours_path):
+                        for file in files_in_dir:
+                            zipf.write(os.path.join(root, file),
+                                       os.path.relpath(os.path.join(root, file), scans_path))
+
+            log.info(f"Processed {processed_count} images successfully")
+            log.info("Finished processing request")
+            # Once a batch has timed out its page reports it as failed and stops polling, so nobody
+            # would download the zip; it is only removed when downloaded
+            if time.time() - batch['start_time'] > BATCH_TIMEOUT:
+                self.fail(batch_id, 'Process timed out')
+                completed = False
+            else:
+                completed = self.store.update(batch_id, only_status='processing', status='completed',
+                                              processed_count=processed_count, result_path=zip_path, finished_at=time.time())
+            if not completed:
+                log.warning(f"Batch {batch_id} timed out before it finished, removing its result")
+                os.remove(zip_path)
+
+
+def start_embedded(count):
+    """
+    Run count workers as daemon threads of the calling process (the web server).
+    """
+    for index in range(count):
+        threading.Thread(target=BatchWorker().run, name=f"BatchWorker-{index}", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process the batches uploaded to the web server.")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS, help="Seconds between checks for new batches")
+    parser.add_argument("--threads", type=int, default=1, help="Batches processed at the same time")
+    args = parser.parse_args()
+
+    os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+    timings = ModelRegistry.warm()
+    log.info(f"Models loaded: {', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())}")
+    worker = BatchWorker(poll_seconds=args.poll)
+    log.info(f"Batch worker {worker.name} waiting for batches in {worker.store.db_path} with {args.threads} threads")
+    stop = threading.Event()
+    threads = [threading.Thread(target=worker.run, args=(stop,), name=f"BatchWorker-{index}")
+               for index in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()
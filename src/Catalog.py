@@ -0,0 +1,258 @@
+'''
+SQLite catalog of the photos ImgDate has saved.
+
+Every photo ImageOrganizer saves is recorded with its path, the scan it came from, its date,
+confidence, status (saved or failed), SHA-256, dimensions and how long it took, so questions about
+the library are answered by an indexed query instead of listing folders and reopening EXIF data:
+
+    python Catalog.py query --from 1990-01-01 --to 1994-12-31
+    python Catalog.py query --status failed
+    python Catalog.py stats
+    python Catalog.py relayout ../img/processed      # move photos into <year>/<Month>/ by their catalog date
+    python Catalog.py rebuild ../img/processed       # catalog a library saved before the catalog existed
+'''
+
+import argparse
+import calendar
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from threading import Lock
+from ImageLoader import read_image_size
+from LoggerConfig import setup_logger
+import Metrics as metrics
+
+_catalog_writes_total = metrics.counter("imgdate_catalog_writes_total", "Catalog rows written, by operation")
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'img', 'catalog.db')
+HASH_CHUNK = 1024 * 1024
+PLACEHOLDER_DATE = "01/01/1111"  # Used by ImageOrganizer when date_images is off
+SKIP_FOLDERS = ("archive", "contours", "profile")  # Folders in a save path that hold no saved photos
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS photos (
+    path TEXT PRIMARY KEY,
+    source TEXT,
+    batch TEXT,
+    date TEXT,
+    confidence INTEGER,
+    status TEXT NOT NULL,
+    sha256 TEXT,
+    width INTEGER,
+    height INTEGER,
+    bytes INTEGER,
+    saved_at REAL,
+    seconds REAL
+);
+CREATE INDEX IF NOT EXISTS photos_date ON photos (date);
+CREATE INDEX IF NOT EXISTS photos_status ON photos (status, date);
+CREATE INDEX IF NOT EXISTS photos_batch ON photos (batch);
+CREATE INDEX IF NOT EXISTS photos_sha256 ON photos (sha256);
+'''
+
+# date_MM-DD-YYYY[_confidence-N][_NN].jpg, optionally with a prefix such as digitized_film_
+_FILENAME_DATE = re.compile(r'date_(\d{2})-(\d{2})-(\d{4})(?:_confidence-(\d+))?')
+_DATE = re.compile(r'(\d{2})/(\d{2})/(\d{4})')
+
+
+def iso_date(date):
+    """
+    YYYY-MM-DD for an MM/DD/YYYY date, so dates sort and compare as text. None for no date, or
+    for text that is not a date (the answer of a failed read is passed through as the date).
+    """
+    match = _DATE.fullmatch(date or "")
+    if not match or date == PLACEHOLDER_DATE:
+        return None
+    month, day, year = match.groups()
+    return f"{year}-{month}-{day}"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Catalog:
+    def __init__(self, db_path=DEFAULT_PATH):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # One connection shared by the organizer's workers; WAL lets the file watcher, main.py and
+        # the review page use the same catalog from separate processes
+        self.connection = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = Lock()
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+        self.log = setup_logger("Catalog", "../log/ImgDate.log")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def record(self, path, date=None, confidence=None, status="saved", source=None, batch=None, seconds=None):
+        """
+        Add or replace the row of a saved photo. The file is hashed and its size read from the header.
+        """
+        path = os.path.abspath(path)
+        width, height = read_image_size(path) or (None, None)
+        row = (path, source, batch, iso_date(date), confidence, status, file_hash(path), width, height,
+               os.path.getsize(path), time.time(), seconds)
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        _catalog_writes_total.inc(operation="record")
+
+    def move(self, old_path, new_path, status=None):
+        """
+        Follow a photo that was renamed or moved. The status is updated when given.
+        """
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE photos SET path = ?, status = COALESCE(?, status) WHERE path = ?",
+                                    (os.path.abspath(new_path), status, os.path.abspath(old_path)))
+        _catalog_writes_total.inc(operation="move")
+
+    def remove(self, path):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM photos WHERE path = ?", (os.path.abspath(path),))
+        _catalog_writes_total.inc(operation="remove")
+
+    def where(self, date_from=None, date_to=None, status=None, source=None, batch=None, sha256=None):
+        clauses, params = [], []
+        for clause, value in (("date >= ?", date_from), ("date <= ?", date_to), ("status = ?", status),
+                              ("source = ?", source), ("batch = ?", batch), ("sha256 = ?", sha256)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, limit=None, **filters):
+        """
+        Photos matching the filters (date_from and date_to as YYYY-MM-DD, status, source, batch,
+        sha256), oldest first, as dicts.
+        """
+        where, params = self.where(**filters)
+        sql = f"SELECT * FROM photos{where} ORDER BY date, path"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.connection.execute(sql, params)]
+
+    def date_range(self, **filters):
+        """
+        (oldest, newest) date of the matching photos as YYYY-MM-DD, or (None, None).
+        """
+        where, params = self.where(**filters)
+        with self.lock:
+            oldest, newest = self.connection.execute(f"SELECT MIN(date), MAX(date) FROM photos{where}", params).fetchone()
+        return oldest, newest
+
+    def stats(self):
+        with self.lock:
+            return {row['status']: row['count'] for row in
+                    self.connection.execute("SELECT status, COUNT(*) AS count FROM photos GROUP BY status")}
+
+    def relayout(self, save_path, dry_run=False):
+        """
+        Move every saved photo with a date into save_path/<year>/<Month>/, keeping its file name.
+        Only renames files; the catalog is updated as they move. Returns the moves made, as (old, new).
+        """
+        moves = []
+        save_path = os.path.abspath(save_path)
+        for photo in self.query(status="saved"):
+            if not photo['date']:
+                continue
+            year, month, _ = photo['date'].split('-')
+            folder = os.path.join(save_path, year, calendar.month_name[int(month)])
+            if os.path.dirname(photo['path']) == folder:
+                continue
+            target = self.free_path(os.path.join(folder, os.path.basename(photo['path'])))
+            moves.append((photo['path'], target))
+            if dry_run:
+                continue
+            os.makedirs(folder, exist_ok=True)
+            try:
+                os.rename(photo['path'], target)
+            except OSError as e:
+                self.log.error(f"Could not move {photo['path']} to {target}: {e}")
+                moves.pop()
+                continue
+            self.move(photo['path'], target)
+        return moves
+
+    @staticmethod
+    def free_path(path):
+        # Same _NN numbering as ImageOrganizer.duplicate_check
+        if not os.path.exists(path):
+            return path
+        base, extension = os.path.splitext(path)
+        base = re.sub(r'_\d{2}$', '', base)
+        duplicate = 0
+        while os.path.exists(f"{base}_{duplicate:02d}{extension}"):
+            duplicate += 1
+        return f"{base}_{duplicate:02d}{extension}"
+
+    def rebuild(self, save_path, error_folder="Failed", skip_folders=SKIP_FOLDERS):
+        """
+        Catalog the photos already in save_path, taking the date and confidence from their file
+        names. Photos in error_folder are recorded as failed; archived scans, contour drawings and
+        profiles in skip_folders are left out. Returns the number of photos recorded.
+        """
+        count = 0
+        for root, folders, files in os.walk(save_path):
+            folders[:] = [folder for folder in folders if folder not in skip_folders]
+            status = "failed" if os.path.basename(root) == error_folder else "saved"
+            for filename in files:
+                if not filename.lower().endswith(('.jpg', '.jpeg', '.png', '.tif', '.tiff')):
+                    continue
+                match = _FILENAME_DATE.search(filename)
+                date = f"{match.group(1)}/{match.group(2)}/{match.group(3)}" if match else None
+                confidence = int(match.group(4)) if match and match.group(4) else (10 if match else None)
+                self.record(os.path.join(root, filename), date, confidence, status)
+                count += 1
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query and maintain the catalog of processed photos.")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Catalog database")
+    commands = parser.add_subparsers(dest="command", required=True)
+    query = commands.add_parser("query", help="List photos")
+    query.add_argument("--from", dest="date_from", help="Oldest date, YYYY-MM-DD")
+    query.add_argument("--to", dest="date_to", help="Newest date, YYYY-MM-DD")
+    query.add_argument("--status", choices=["saved", "failed"])
+    query.add_argument("--source", help="File name of the scan the photos came from")
+    query.add_argument("--batch")
+    query.add_argument("--limit", type=int)
+    commands.add_parser("stats", help="Count photos by status")
+    relayout = commands.add_parser("relayout", help="Move photos into <year>/<Month>/ folders by their catalog date")
+    relayout.add_argument("save_path")
+    relayout.add_argument("--dry-run", action="store_true")
+    rebuild = commands.add_parser("rebuild", help="Catalog the photos already in a save path")
+    rebuild.add_argument("save_path")
+    args = parser.parse_args()
+
+    catalog = Catalog(args.db)
+    if args.command == "query":
+        for photo in catalog.query(limit=args.limit, date_from=args.date_from, date_to=args.date_to,
+                                   status=args.status, source=args.source, batch=args.batch):
+            print(f"{photo['date'] or '-':<12}{photo['status']:<8}{photo['confidence'] if photo['confidence'] is not None else '-':<4}{photo['path']}")
+    elif args.command == "stats":
+        for status, count in catalog.stats().items():
+            print(f"{status:<8}{count}")
+    elif args.command == "relayout":
+        moves = catalog.relayout(args.save_path, dry_run=args.dry_run)
+        for old, new in moves:
+            print(f"{old} -> {new}")
+        print(f"{'Would move' if args.dry_run else 'Moved'} {len(moves)} photos")
+    elif args.command == "rebuild":
+        print(f"Recorded {catalog.rebuild(args.save_path)} photos")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+from threading import Condition, Lock
+import Metrics as metrics
+
+_limit_gauge = metrics.gauge("imgdate_api_concurrency_limit", "Vision API requests allowed in flight by the concurrency controller")
+_in_flight_gauge = metrics.gauge("imgdate_api_in_flight", "Vision API requests currently in flight")
+_limit_changes_total = metrics.counter("imgdate_api_concurrency_changes_total", "Concurrency limit changes, by reason")
+_throttled_seconds_total = metrics.counter("imgdate_api_throttled_seconds_total", "Seconds requests were paused by Retry-After or an exhausted rate limit")
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MAX_LIMIT = 32
+DECREASE_FACTOR = 0.5        # On errors and rate limiting
+LATENCY_DECREASE_FACTOR = 0.9  # When latency rises well above the best seen
+LATENCY_TOLERANCE = 2.0      # Latency above this multiple of the baseline counts as congestion
+BASELINE_DECAY = 1.01        # The baseline drifts up slowly so one lucky request does not pin it forever
+MAX_PAUSE = 60               # Upper bound for a pause requested by the server, in seconds
+
+# Durations in OpenAI's x-ratelimit-reset-* headers, e.g. "1s", "6m0s", "120ms"
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(value):
+    """
+    Seconds in a Retry-After or x-ratelimit-reset-* header value, or None if it cannot be parsed.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+class ConcurrencyController:
+    """
+    Additive increase, multiplicative decrease limit on requests in flight to the vision API.
+
+    Every successful request raises the limit by 1/limit (about one per round of requests) while
+    latency stays within LATENCY_TOLERANCE of the best seen; slow responses lower it by 10% and
+    errors or rate limiting halve it, at most once per round trip so one burst of failures counts
+    once. Retry-After and an exhausted x-ratelimit-remaining-requests pause new requests until the
+    server's reset time.
+    """
+    def __init__(self, initial_limit=DEFAULT_INITIAL_LIMIT, min_limit=1, max_limit=DEFAULT_MAX_LIMIT, adaptive=True):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.in_flight = 0
+        self.baseline = None          # Best recent latency in seconds
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.condition = Condition()
+        _limit_gauge.set(self.limit)
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    self.condition.wait(pause)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            _in_flight_gauge.set(self.in_flight)
+
+    def release(self, latency=None, ok=True, rate_limited=False, headers=None):
+        """
+        Record the outcome of a request started with acquire() and adjust the limit.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            _in_flight_gauge.set(self.in_flight)
+            if headers is not None:
+                self.apply_headers(headers, rate_limited)
+            if self.adaptive:
+                if rate_limited:
+                    self.decrease(DECREASE_FACTOR, "rate_limited", latency)
+                elif not ok:
+                    self.decrease(DECREASE_FACTOR, "error", latency)
+                elif latency is not None:
+                    self.observe_latency(latency)
+            self.condition.notify_all()
+
+    def observe_latency(self, latency):
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline *= BASELINE_DECAY
+
+        if latency > self.baseline * LATENCY_TOLERANCE:
+            self.decrease(LATENCY_DECREASE_FACTOR, "latency", latency)
+        elif self.limit < self.max_limit:
+            self.set_limit(self.limit + 1 / self.limit, "increase")
+
+    def decrease(self, factor, reason, latency):
+        # Requests that were already in flight when the limit dropped report the same congestion
+        now = time.monotonic()
+        if now - self.last_decrease < (latency or self.baseline or 0):
+            return
+        self.last_decrease = now
+        self.set_limit(self.limit * factor, reason)
+
+    def set_limit(self, limit, reason):
+        limit = max(self.min_limit, min(limit, self.max_limit))
+        if int(limit) != int(self.limit):
+            _limit_changes_total.inc(reason=reason)
+        self.limit = limit
+        _limit_gauge.set(round(limit, 2))
+
+    def apply_headers(self, headers, rate_limited):
+        """
+        Honour Retry-After and OpenAI's x-ratelimit-* request headers.
+        """
+        pause = parse_duration(headers.get('Retry-After'))
+        remaining = headers.get('x-ratelimit-remaining-requests')
+        if pause is None and (rate_limited or remaining == '0'):
+            pause = parse_duration(headers.get('x-ratelimit-reset-requests'))
+        if pause is None and rate_limited:
+            pause = 1.0
+        if pause:
+            pause = min(pause, MAX_PAUSE)
+            until = time.monotonic() + pause
+            if until > self.paused_until:
+                _throttled_seconds_total.inc(until - max(self.paused_until, time.monotonic()))
+                self.paused_until = until
+        elif remaining is not None and remaining.isdigit() and self.adaptive:
+            # No point in more requests in flight than the window has left
+            self.set_limit(min(self.limit, max(int(remaining), self.min_limit)), "remaining")
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one request slot. The block reports its outcome through the yielded Outcome;
+        a block that raises without reporting one counts as an error.
+        """
+        self.acquire()
+        outcome = Outcome()
+        start = time.perf_counter()
+        try:
+            yield outcome
+        except BaseException:
+            outcome.ok = outcome.ok and outcome.reported
+            raise
+        finally:
+            self.release(time.perf_counter() - start, ok=outcome.ok, rate_limited=outcome.rate_limited,
+                         headers=outcome.headers)
+
+
+class Outcome:
+    def __init__(self):
+        self.ok = True
+        self.rate_limited = False
+        self.headers = None
+        self.reported = False
+
+    def report(self, response):
+        """
+        Record a response: 429 is rate limiting, 5xx an error, anything else a success of the API itself.
+        """
+        self.reported = True
+        self.headers = response.headers
+        self.rate_limited = response.status_code == 429
+        self.ok = not self.rate_limited and response.status_code < 500
+
+
+_shared = None
+_shared_lock = Lock()
+
+
+def shared_controller():
+    """
+    The controller shared by every DateExtractor in the process, so concurrent batches together
+    stay within what the account allows. Configured from API_INITIAL_CONCURRENCY and
+    API_MAX_CONCURRENCY on first use.
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ConcurrencyController(
+                initial_limit=int(os.getenv('API_INITIAL_CONCURRENCY', DEFAULT_INITIAL_LIMIT)),
+                max_limit=int(os.getenv('API_MAX_CONCURRENCY', DEFAULT_MAX_LIMIT)))
+        return _shared
@@ -5,22 +5,42 @@ import tkinter as tk
 from tkinter import ttk
 import cv2
 import os
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 import pyexiv2
-from DateExtractor import DateExtractor
+from ImageLoader import imread_reduced, read_exif_rotation, read_image_size
+from ImagePrefetcher import ImagePrefetcher
 from LoggerConfig import setup_logger
+from ScanDiscovery import discover_images
 
 class ImageDateEditor:
     def __init__(self, source_folder_path, image_organizer):
         self.root = tk.Tk()
+        self.screen_size = (self.root.winfo_screenwidth(), self.root.winfo_screenheight())
         self.image_organizer = image_organizer
         self.source_folder_path = source_folder_path
-        self.date_extractor = DateExtractor()
+        self.date_extractor = image_organizer.date_extractor  # Only its crop fractions and date validation are used
         self.current_image_path = None
         self.current_image = None
         self.current_index = 0
         self.magnifier_size = 200  # Size of the magnifier
         self.zoom_factor = 3  # How much to zoom in
+        self.magnifier_interval_ms = 16  # Redraw the magnifier at most once per frame (~60 Hz)
+        self.magnifier_after_id = None
+        self.magnifier_pos = None
+        self.magnifier_item = None
+        self.magnified_photo = None
+        self.prefetch_count = 5  # Number of upcoming images decoded in the background
+        self.cache_size = 10  # Number of decoded images kept in memory
+        self.resize_delay_ms = 100  # Wait for the window to stop resizing before redrawing
+        self.resize_after_id = None
+        self.display_size = None  # Last known canvas size, used to pre-size prefetched images
+        self.current_entry = None
+        self.prefetcher = None
+        self.pyramid_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Pyramid")
+        self.save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Save")  # One worker keeps saves in order
+        self.pending_saves = []
+        self.save_poll_ms = 50
         self.log = setup_logger("DateEditor", "../log/ImgDate.log")
 
     def setup_gui(self):
@@ -29,6 +49,7 @@ class ImageDateEditor:
         self.failed_images = self.get_failed_images(source_path=self.source_folder_path)
         self.num_images = len(self.failed_images)
         self.image_organizer.num_images = self.num_images
+        self.prefetcher = ImagePrefetcher(self.load_image_data, lookahead=self.prefetch_count, cache_size=self.cache_size)
 
         self.root.title("Quick Date Editor")
         # Make the window appear on top initially
@@ -81,46 +102,130 @@ class ImageDateEditor:
         self.load_next_image()
 
     def update_magnifier(self, event):
-        if not hasattr(self, 'resized_image'):
+        # Only remember the cursor; rendering is throttled to the display refresh rate
+        self.magnifier_pos = (event.x, event.y)
+        if self.magnifier_after_id is None:
+            self.magnifier_after_id = self.root.after(self.magnifier_interval_ms, self.render_magnifier)
+
+    def render_magnifier(self):
+        self.magnifier_after_id = None
+        if self.magnifier_pos is None or not hasattr(self, 'resized_image'):
             return
 
-        # Get the position relative to the image
-        x = event.x - self.image_x
-        y = event.y - self.image_y
+        event_x, event_y = self.magnifier_pos
+        x = event_x - self.image_x
+        y = event_y - self.image_y
 
         # Check if the cursor is over the image
-        if 0 <= x < self.resized_image.shape[1] and 0 <= y < self.resized_image.shape[0]:
-            # Calculate the region to magnify
-            left = max(0, x - self.magnifier_size // (2 * self.zoom_factor))
-            top = max(0, y - self.magnifier_size // (2 * self.zoom_factor))
-            right = min(self.resized_image.shape[1], x + self.magnifier_size // (2 * self.zoom_factor))
-            bottom = min(self.resized_image.shape[0], y + self.magnifier_size // (2 * self.zoom_factor))
+        if not (0 <= x < self.resized_image.shape[1] and 0 <= y < self.resized_image.shape[0]):
+            return
 
-            # Extract the region
-            magnified_region = self.resized_image[top:bottom, left:right]
+        magnified = self.sample_magnifier(x, y)
+        if magnified is None:
+            return
 
-            # Resize the region
-            magnified = cv2.resize(magnified_region, (self.magnifier_size, self.magnifier_size), interpolation=cv2.INTER_LINEAR)
+        # Reuse one PhotoImage and one canvas item instead of recreating them on every move
+        pil_image = Image.fromarray(magnified)
+        if self.magnified_photo is None:
+            self.magnified_photo = ImageTk.PhotoImage(pil_image)
+        else:
+            self.magnified_photo.paste(pil_image)
 
-            # Convert to PhotoImage
-            self.magnified_photo = self.cv2_to_tk(magnified)
+        # Position the magnified image near the cursor
+        mag_x = event_x + 20
+        mag_y = event_y + 20
 
-            # Position the magnified image near the cursor
-            mag_x = event.x + 20
-            mag_y = event.y + 20
+        # Ensure the magnified image stays within the canvas
+        if mag_x + self.magnifier_size > self.canvas.winfo_width():
+            mag_x = event_x - self.magnifier_size - 20
+        if mag_y + self.magnifier_size > self.canvas.winfo_height():
+            mag_y = event_y - self.magnifier_size - 20
 
-            # Ensure the magnified image stays within the canvas
-            if mag_x + self.magnifier_size > self.canvas.winfo_width():
-                mag_x = event.x - self.magnifier_size - 20
-            if mag_y + self.magnifier_size > self.canvas.winfo_height():
-                mag_y = event.y - self.magnifier_size - 20
+        if self.magnifier_item is None:
+            self.magnifier_item = self.canvas.create_image(mag_x, mag_y, anchor=tk.NW, image=self.magnified_photo, tags="magnifier")
+        else:
+            self.canvas.coords(self.magnifier_item, mag_x, mag_y)
+            self.canvas.itemconfigure(self.magnifier_item, state=tk.NORMAL)
 
-            # Display the magnified image
-            self.canvas.delete("magnifier")
-            self.canvas.create_image(mag_x, mag_y, anchor=tk.NW, image=self.magnified_photo, tags="magnifier")
+    def sample_magnifier(self, x, y):
+        """
+        Build the magnified RGB view around display position (x, y).
+        Samples the full resolution date corner pyramid when the cursor is over it,
+        otherwise the screen resolution image, so the zoom is never taken from the downscaled display image.
+        """
+        full_width, full_height = self.current_entry['full_size']
+        display_scale = self.resized_image.shape[1] / full_width
+        magnifier_scale = display_scale * self.zoom_factor  # output pixels per full resolution pixel
+
+        # Cursor position in full resolution coordinates
+        full_x = x / display_scale
+        full_y = y / display_scale
+
+        source, source_scale, origin = None, None, (0, 0)
+        pyramid = self.current_entry['pyramid']
+        if pyramid.done() and pyramid.exception() is None and pyramid.result():
+            corner_box, levels = pyramid.result()
+            left, top, right, bottom = corner_box
+            if left <= full_x < right and top <= full_y < bottom:
+                # Use the smallest level that still has at least as many pixels as the magnifier shows
+                source, source_scale = levels[0]
+                for level, level_scale in levels:
+                    if level_scale >= magnifier_scale:
+                        source, source_scale = level, level_scale
+                origin = (left, top)
+
+        if source is None:
+            source = self.current_image
+            source_scale = self.current_image.shape[1] / full_width
+
+        # Region of the source covered by the magnifier
+        half = self.magnifier_size / (2 * magnifier_scale) * source_scale
+        center_x = (full_x - origin[0]) * source_scale
+        center_y = (full_y - origin[1]) * source_scale
+        left = int(max(0, center_x - half))
+        top = int(max(0, center_y - half))
+        right = int(min(source.shape[1], center_x + half))
+        bottom = int(min(source.shape[0], center_y + half))
+        if right <= left or bottom <= top:
+            return None
+
+        region = source[top:bottom, left:right]
+        interpolation = cv2.INTER_AREA if region.shape[1] > self.magnifier_size else cv2.INTER_CUBIC
+        magnified = cv2.resize(region, (self.magnifier_size, self.magnifier_size), interpolation=interpolation)
+        if source is self.current_image:
+            magnified = cv2.cvtColor(magnified, cv2.COLOR_BGR2RGB)
+        return magnified
+
+    def build_corner_pyramid(self, image_path):
+        """
+        Decode the image at full resolution and keep only the date corner as an RGB pyramid.
+        Landscape images keep the bottom right corner, portrait images the bottom left one.
+
+        :return: ((left, top, right, bottom), [(level_image, scale), ...]) with the full resolution level first.
+        """
+        image = cv2.imread(image_path)
+        if image is None:
+            return None
+
+        h, w = image.shape[:2]
+        top = int(h * self.date_extractor.crop_height)
+        corner_width = int(w * (1 - self.date_extractor.crop_width))
+        left = w - corner_width if w >= h else 0
+        corner_box = (left, top, left + corner_width, h)
+        corner = cv2.cvtColor(image[top:h, left:left + corner_width], cv2.COLOR_BGR2RGB)
+        del image
+
+        levels = [(corner, 1.0)]
+        scale = 1.0
+        while min(levels[-1][0].shape[:2]) > self.magnifier_size:
+            scale /= 2
+            levels.append((cv2.pyrDown(levels[-1][0]), scale))
+        return corner_box, levels
 
     def hide_magnifier(self, event):
-        self.canvas.delete("magnifier")
+        self.magnifier_pos = None
+        if self.magnifier_item is not None:
+            self.canvas.itemconfigure(self.magnifier_item, state=tk.HIDDEN)
 
     def update_date_label(self, text):
         self.date_label.config(text=text)
@@ -140,26 +245,65 @@ class ImageDateEditor:
         self.date_entry.insert(0, "")  # Reset the entry widget
 
     def get_failed_images(self, source_path):
-        return [os.path.join(source_path, file) for file in os.listdir(source_path) if file.endswith(".jpg")]
+        # Reviewed in name order, so photos of the same date and scan follow each other
+        return sorted(discover_images(source_path, recursive=False, extensions=('.jpg',), largest_first=False))
 
-    def get_image_date(self):
-        img_data = pyexiv2.Image(self.current_image_path)
-        exif = img_data.read_exif()
+    def get_image_date(self, image_path=None):
+        img_data = pyexiv2.Image(image_path or self.current_image_path)
         try:
+            exif = img_data.read_exif()
             exif_date = exif['Exif.Image.DateTime']
             date = self.infer_date(exif_date)
         except KeyError:
             date = None
+        finally:
+            img_data.close()
         return date
 
+    def load_image_data(self, image_path):
+        """
+        Decode an image at screen resolution and read its EXIF date.
+        Runs on the prefetcher threads, so it must not touch any Tk widgets.
+        """
+        screen_width, screen_height = self.screen_size
+        image, _ = imread_reduced(image_path, screen_width, screen_height)
+        full_size = read_image_size(image_path)
+        if full_size is not None and read_exif_rotation(image_path) in (90, 270):
+            # The header size is as stored, the decoded image is turned as the EXIF Orientation asks
+            full_size = full_size[::-1]
+        if full_size is None and image is not None:
+            full_size = (image.shape[1], image.shape[0])
+        entry = {
+            'image': image,
+            'full_size': full_size,
+            'date': None,
+            'display': {},
+            # Built separately so a slow full resolution decode never delays showing the image
+            'pyramid': self.pyramid_executor.submit(self.build_corner_pyramid, image_path),
+        }
+        try:
+            entry['date'] = self.get_image_date(image_path)
+        except Exception as e:
+            self.log.error(f"Error reading date from {image_path}: {e}")
+
+        # Pre-size for the current canvas so showing the image only needs a PhotoImage
+        display_size = self.display_size
+        if image is not None and display_size:
+            entry['display'][display_size] = self.fit_to_canvas(image, *display_size)
+        return entry
+
     def load_next_image(self):
         if self.current_index < self.num_images:
+            if self.current_image_path:
+                self.prefetcher.discard(self.current_image_path)
             self.current_image_path = self.failed_images[self.current_index]
             self.current_index += 1
+            self.prefetcher.prefetch(self.failed_images[self.current_index:])
 
-            # Load the large image
-            self.current_image = cv2.imread(self.current_image_path)
-            self.update_date_label(f"Image date: {self.get_image_date()}")
+            # Load the large image (usually already decoded by the prefetcher)
+            self.current_entry = self.prefetcher.get(self.current_image_path)
+            self.current_image = self.current_entry['image']
+            self.update_date_label(f"Image date: {self.current_entry['date']}")
             self.update_num_image_label(f"{self.current_index} of {self.num_images} images")
 
             # Display the large image
@@ -168,6 +312,9 @@ class ImageDateEditor:
             self.update_num_image_label(f"All images processed")
             time.sleep(1)
             self.log.info("No more images to display.")
+            self.prefetcher.shutdown()
+            self.pyramid_executor.shutdown(wait=False, cancel_futures=True)
+            self.save_executor.shutdown(wait=True)  # Let queued saves finish before closing
             self.root.destroy()
 
     def display_image(self):
@@ -178,23 +325,18 @@ class ImageDateEditor:
         canvas_height = self.canvas.winfo_height()
 
         if canvas_width > 1 and canvas_height > 1:
-            # Get original image dimensions
-            img_height, img_width = self.current_image.shape[:2]
-            
-            # Calculate aspect ratios
-            img_aspect = img_width / img_height
-            canvas_aspect = canvas_width / canvas_height
-            
-            if img_aspect > canvas_aspect:
-                # Image is wider than canvas
-                new_width = canvas_width
-                new_height = int(canvas_width / img_aspect)
-            else:
-                # Image is taller than canvas
-                new_height = canvas_height
-                new_width = int(canvas_height * img_aspect)
-            
-            self.resized_image = cv2.resize(self.current_image, (new_width, new_height), interpolation=cv2.INTER_LANCZOS4)
+            self.display_size = (canvas_width, canvas_height)
+
+            # Reuse the display-sized bitmap if it was already built for this canvas size
+            display_cache = self.current_entry['display']
+            resized = display_cache.get(self.display_size)
+            if resized is None:
+                resized = self.fit_to_canvas(self.current_image, canvas_width, canvas_height)
+                display_cache.clear()
+                display_cache[self.display_size] = resized
+
+            self.resized_image = resized
+            new_height, new_width = self.resized_image.shape[:2]
             self.photo_image = self.cv2_to_tk(self.resized_image)
 
             # Calculate position to center the image
@@ -203,10 +345,41 @@ class ImageDateEditor:
 
             # Clear previous image and create new one
             self.canvas.delete("all")
+            self.magnifier_item = None
             self.canvas.create_image(self.image_x, self.image_y, anchor=tk.NW, image=self.photo_image)
 
 
+    def fit_to_canvas(self, image, canvas_width, canvas_height):
+        """
+        Resize an image to fit inside the canvas while keeping its aspect ratio.
+        """
+        # Get original image dimensions
+        img_height, img_width = image.shape[:2]
+
+        # Calculate aspect ratios
+        img_aspect = img_width / img_height
+        canvas_aspect = canvas_width / canvas_height
+
+        if img_aspect > canvas_aspect:
+            # Image is wider than canvas
+            new_width = canvas_width
+            new_height = int(canvas_width / img_aspect)
+        else:
+            # Image is taller than canvas
+            new_height = canvas_height
+            new_width = int(canvas_height * img_aspect)
+
+        interpolation = cv2.INTER_AREA if new_width < img_width else cv2.INTER_LANCZOS4
+        return cv2.resize(image, (max(new_width, 1), max(new_height, 1)), interpolation=interpolation)
+
     def on_resize(self, event):
+        # Debounce: only redraw once the window has stopped changing size
+        if self.resize_after_id is not None:
+            self.root.after_cancel(self.resize_after_id)
+        self.resize_after_id = self.root.after(self.resize_delay_ms, self.on_resize_done)
+
+    def on_resize_done(self):
+        self.resize_after_id = None
         self.display_image()
         
     def move_without_date_change(self):
@@ -227,6 +400,8 @@ class ImageDateEditor:
             except OSError as e:
                 self.log.error(f"Error moving file {self.current_image_path}: {e}")
                 self.show_alert("Failed to save image", "red")
+            else:
+                self.catalog_move(self.current_image_path, destination_path)
             
             # Load the next image
             self.load_next_image()
@@ -234,6 +409,16 @@ class ImageDateEditor:
             self.log.info("No image loaded")
             self.show_alert("No image loaded", "red")
 
+    def catalog_move(self, old_path, new_path):
+        # The photo left the Failed folder, so it is no longer waiting for review
+        catalog = self.image_organizer.catalog
+        if catalog is None:
+            return
+        try:
+            catalog.move(old_path, new_path, status="saved")
+        except Exception as e:
+            self.log.error(f"Could not update {new_path} in the catalog: {e}")
+
     def save_date(self):
         """
         Save the date entered by the user or inferred from the image metadata,
@@ -257,18 +442,15 @@ class ImageDateEditor:
             # Attempt to save the image with the updated metadata
             existing_exif_data = None
             file_name = self.generate_filename(date)
-            success = self.image_organizer.save_image(self.current_image, date, 10, file_name, existing_exif_data)
-            
-            if success:
-                self.show_alert(f"{date}", "green")
-                # Delete the current image file after successful update
-                try:
-                    os.remove(self.current_image_path)
-                    self.log.info(f"Deleted current image: {self.current_image_path}")
-                except OSError as e:
-                    self.log.info(f"Error deleting file {self.current_image_path}: {e}")
-            else:
-                self.show_alert("Failed to save image", "red")
+
+            # Only the metadata changes, so the file is moved with rewritten EXIF instead of
+            # being re-encoded, and this happens off the Tk thread
+            future = self.save_executor.submit(self.image_organizer.save_image_file, self.current_image_path,
+                                               date, 10, file_name, existing_exif_data)
+            self.pending_saves.append((future, self.current_image_path))
+            self.show_alert(f"{date}", "green")
+            if len(self.pending_saves) == 1:
+                self.root.after(self.save_poll_ms, self.check_pending_saves)
 
             # Load the next image
             self.load_next_image()
@@ -277,6 +459,27 @@ class ImageDateEditor:
             self.show_alert("Invalid Date", "red")
             self.log.info("Invalid date format. Please enter a date in the format mm/dd/yyyy.")
 
+    def check_pending_saves(self):
+        """
+        Report saves that finished on the background thread; keeps polling while any are pending.
+        """
+        still_pending = []
+        for future, image_path in self.pending_saves:
+            if not future.done():
+                still_pending.append((future, image_path))
+                continue
+            try:
+                success = future.result()
+            except Exception as e:
+                self.log.error(f"Error saving {image_path}: {e}")
+                success = False
+            if not success:
+                self.show_alert("Failed to save image", "red")
+
+        self.pending_saves = still_pending
+        if self.pending_saves:
+            self.root.after(self.save_poll_ms, self.check_pending_saves)
+
     def infer_date(self, date):
         date = date.strip()
         patterns = [
@@ -1,51 +1,93 @@
-import base64
 import datetime
+import random
+from threading import Lock
 from time import sleep
 import cv2
 import re
 import os
-from dotenv import load_dotenv
 import pyexiv2
 from LoggerConfig import setup_logger
+import Metrics as metrics
+import ModelRegistry
+from ConcurrencyController import shared_controller
+from PayloadOptimizer import PayloadOptimizer, HIGH_DETAIL_SIZE
 import SharedVariables as s
-import requests
+
+_api_requests_total = metrics.counter("imgdate_api_requests_total", "Vision API requests, by result")
+_api_retries_total = metrics.counter("imgdate_api_retries_total", "Vision API requests that were retried")
+_date_reads_total = metrics.counter("imgdate_date_reads_total", "Date extractions, by result")
+_tier_resolved_total = metrics.counter("imgdate_date_tier_resolved_total", "Date extractions by the read tier that resolved them, or unresolved")
+_escalations_total = metrics.counter("imgdate_date_escalations_total", "Extra vision API reads after a low confidence or out of range result, by tier")
+_escalations_skipped_total = metrics.counter("imgdate_date_escalations_skipped_total", "Escalations not made because the batch budget was used up")
+
+REQUEST_TIMEOUT = 60  # Seconds before a vision API request is abandoned and retried
+BACKOFF_BASE = 1      # Seconds before the first retry, doubled for every further one
+BACKOFF_MAX = 30
+
+# Confidence from which a read is accepted; ImageOrganizer sends anything lower to manual review
+ACCEPT_CONFIDENCE = 9
+
+# Reads tried in order until one is confident, valid and in the date range:
+# (tier, detail, corner of the photo, use the alternate date format prompt)
+READ_TIERS = (
+    ("low", "low", "right", False),
+    ("high", "high", "right", False),
+    ("left_corner", "high", "left", False),
+    ("alternate_prompt", "high", "right", True),
+)
 
 
 class DateExtractor:
 
-    def __init__(self):
-        # Locate .env relative to this file regardless of working directory
-        env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
-        if not os.path.isfile(env_path):
-            raise Exception(f".env file not found. Expected at: {os.path.abspath(env_path)}")
+    def __init__(self, escalation_budget=None, date_format=None, date_range=None):
+        # .env is read once per process
+        ModelRegistry.load_env()
+
+        # Per extractor so batches with different formats can run in one process; the process-wide
+        # SharedVariables values are the default for callers that set them
+        self.date_format = date_format if date_format is not None else s.date_format
+        self.date_range = date_range if date_range is not None else s.date_range
 
         self.crop_height = 0.8
         self.crop_width = 0.70
         self.MIN_YEAR = 1985
+        self.payload = PayloadOptimizer()
+        # Escalated reads send the whole corner at up to the high detail size, in case the stamp was mislocated
+        self.high_detail_payload = PayloadOptimizer(max_side=HIGH_DETAIL_SIZE, localize=False)
+
+        # Extra reads this extractor (one per batch) may make after the first; None for no limit
+        self.escalation_budget = escalation_budget
+        self.escalations = 0
+        self.escalation_lock = Lock()
+
+        # Requests in flight are limited process wide, across all batches, and share keep-alive connections
+        self.concurrency = shared_controller()
+        self.session = ModelRegistry.http_session()
 
-        load_dotenv(env_path)
         self.api_key = os.getenv('OPENAI_API_KEY')
         self.FINE_TUNED_MODEL = os.getenv('MODEL_NAME')
+        self.api_url = os.getenv('OPENAI_API_URL', "https://api.openai.com/v1/chat/completions")
         
         self.log = setup_logger("DateExtractor", "../log/ImgDate.log")
 
-    def crop_date_64(self, img, base_64 = True):
+    def crop_date_64(self, img, base_64 = True, corner = "right", detail = "low"):
         """
-        Crop the bottom right corner of the image where the date is located.
-        Converts to base64 and returns the cropped image.
+        Crop the bottom right (or with corner="left" the bottom left) corner of the image where the date is located.
+        With base_64 returns the date stamp in it as the smallest data URL PayloadOptimizer can
+        make for the given detail, otherwise the corner itself.
         """
         
-        # Crop the bottom right corner
+        # Crop the bottom corner
         h, w, _ = img.shape
         # cv2.rectangle(img, (int(w*self.crop_width), int(h*self.crop_height)), (w, h), (0, 255, 0), 5)
-        cropped_img = img[int(h*self.crop_height):h, int(w*self.crop_width):w]
+        if corner == "left":
+            cropped_img = img[int(h*self.crop_height):h, 0:w - int(w*self.crop_width)]
+        else:
+            cropped_img = img[int(h*self.crop_height):h, int(w*self.crop_width):w]
         
         if base_64:
-            _, buffer = cv2.imencode('.jpg', cropped_img)
-
-
-            # Convert the cropped image to base64
-            cropped_img = base64.b64encode(buffer).decode('utf-8')
+            payload = self.payload if detail == "low" else self.high_detail_payload
+            cropped_img = payload.data_url(cropped_img)
 
         # # Debug Optional: Save the processed image for debugging
         # cv2.imwrite(f"../img/processed/date_{random.randint(1, 100)}.jpg", cropped_img)
@@ -53,32 +95,38 @@ class DateExtractor:
         # return base64_img
         return cropped_img
     
-    def get_prompt(self):   
-        if not s.date_range or not s.date_range.strip():
+    def get_prompt(self, date_format=None):   
+        date_format = date_format or self.date_format
+        if not self.date_range or not self.date_range.strip():
             range = ""
-        elif "to" in s.date_range:
-            range = f" The range of date will be {s.date_range}. Any extracted dates not in this range should be re-evaluated."
+        elif "to" in self.date_range:
+            range = f" The range of date will be {self.date_range}. Any extracted dates not in this range should be re-evaluated."
         else:
-            range = f" The date of the images will be on {s.date_range}. Any extracted dates not on this given date should be re-evaluated."
+            range = f" The date of the images will be on {self.date_range}. Any extracted dates not on this given date should be re-evaluated."
             
-        if not s.date_format:
+        if not date_format:
             self.log.error("Error setting prompt: date_format not set.")
             return f'''Extract the date from the image where it is displayed in orange dot-matrix text in the format 'mm dd yy'. The date appears as two digits for the month, day, and year, with the year shown as two digits (e.g., 8 9 '12).{range} Focus on recognizing the orange dot-matrix numbers in the lower corner of the image and return the date as "mm dd 'yy". Please read the date and provide it in the format MM DD 'YY. Respond only with the date and a confidence level from 1 to 10 on how certain you are of its accuracy. Example "12 07 '01 | confidence: 10". If the date is unclear or cannot be read, please respond with "date not found | confidence: -1" as a placeholder.'''
         
-        if s.date_format == 'mm_dd_yy':
+        if date_format == 'mm_dd_yy':
             return f'''Extract the date from the image where it is displayed in orange dot-matrix text in the format 'mm dd yy'. The date appears as two digits for the month, day, and year, with the year shown as two digits (e.g., 8 9 '12).{range} Focus on recognizing the orange dot-matrix numbers in the lower corner of the image and return the date as "mm dd 'yy". Please read the date and provide it in the format MM DD 'YY. Respond only with the date and a confidence level from 1 to 10 on how certain you are of its accuracy. Example "12 07 '01 | confidence: 10". If the date is unclear or cannot be read, please respond with "date not found | confidence: -1" as a placeholder.'''
-        if s.date_format == 'yy_mm_dd':
+        if date_format == 'yy_mm_dd':
             return f'''Extract the date from the image where it is displayed in orange dot-matrix text in the format 'yy mm dd'. The date appears as two digits for the month, day, and year, with the year shown as two digits (e.g., '12 8 9).{range} Focus on recognizing the orange dot-matrix numbers in the lower corner of the image and return the date as "'yy mm dd". Please read the date and provide it in the format MM DD 'YY. Respond only with the date and a confidence level from 1 to 10 on how certain you are of its accuracy. Example "12 07 '01 | confidence: 10". If the date is unclear or cannot be read, please respond with "date not found | confidence: -1" as a placeholder.'''
-        if s.date_format == 'universal':
+        if date_format == 'universal':
             return f'''This film image contains a date, typically displayed in orange or red dot-matrix text. The date will be in one of two formats: "'YY MM DD" or "MM DD 'YY". The year will always begin with an apostrophe (') to differentiate between these formats.{range} It is your job to identify the correct date format accurately. Please read the date and return it in the format "MM DD 'YY". Respond only with the date and a confidence level from 1 to 10 based on how certain you are of its accuracy. Example: "12 07 '01 | confidence: 10". If the date is unclear or unreadable, respond with "date not found | confidence: -1" as a placeholder.'''
             
 
-    def read_date(self, base64_image, retries = 3):
+    @metrics.timed("imgdate_stage_seconds", stage="read_date")
+    def read_date(self, base64_image, retries = 3, detail = "low", date_format = None):
         """
         Use OpenAI Responses API to extract text from the processed image.
+        base64_image is a data URL from crop_date_64 or plain base64 of a JPEG.
+        date_format overrides the prompt for self.date_format.
         """
+        if not base64_image.startswith("data:"):
+            base64_image = f"data:image/jpeg;base64,{base64_image}"
 
-        prompt = self.get_prompt()
+        prompt = self.get_prompt(date_format)
 
         headers = {
             "Content-Type": "application/json",
@@ -98,8 +146,8 @@ class DateExtractor:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "low"
+                                "url": base64_image,
+                                "detail": detail
                             }
                         }
                     ]
@@ -110,8 +158,11 @@ class DateExtractor:
 
         for attempt in range(retries):
             try:
-                response = requests.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+                with self.concurrency.slot() as outcome:
+                    response = self.session.post(self.api_url, headers=headers, json=payload, timeout=REQUEST_TIMEOUT)
+                    outcome.report(response)
                 response.raise_for_status()
+                _api_requests_total.inc(result="ok")
                 content = response.json()["choices"][0]["message"]["content"]
                 if "|" not in content:
                     self.log.warning(f"Unexpected response format (no '|'): {content}")
@@ -121,9 +172,13 @@ class DateExtractor:
                 extracted_date = parts[0].strip()
                 return extracted_date, confidence
             except Exception as e:
+                rate_limited = getattr(getattr(e, 'response', None), 'status_code', None) == 429
+                _api_requests_total.inc(result="rate_limited" if rate_limited else "error")
                 self.log.error(f"Error extracting date (attempt {attempt + 1}/{retries}): {e}")
                 if attempt < retries - 1:
-                    sleep(2 * attempt)  # Exponential backoff
+                    _api_retries_total.inc()
+                    # Exponential backoff with jitter; a Retry-After from the server also pauses the controller
+                    sleep(min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1))
                 else:
                     return None, -1
 
@@ -173,29 +228,105 @@ class DateExtractor:
     def extract_and_validate_date(self, img):
         """
         High-level function to process the image, extract text, and validate the date.
+        Starts with a low detail read and escalates through READ_TIERS while the result is below
+        ACCEPT_CONFIDENCE or outside the date range, as long as the batch has escalations left.
+        Returns the best read: valid and in range first, then by confidence.
         """
-        # Read and process the image
-        cropped_img = self.crop_date_64(img)
-        
-        # Extract text using Google Vision
-        extracted_date, confidence = self.read_date(cropped_img)
-        
-        if extracted_date:
-            # Validate the extracted text as a date
-            clean_date, is_valid = self.validate_date_format(extracted_date)
-            self.log.info(f"Extracted date: {clean_date} | Confidence: {confidence}")
-            if not is_valid:
-                confidence = -1
+        best = None
+        resolved_by = "unresolved"
+        for tier, detail, corner, alternate in READ_TIERS:
+            date_format = self.alternate_date_format() if alternate else None
+            if alternate and date_format is None:
+                continue
+            if best is not None:
+                if not self.take_escalation():
+                    _escalations_skipped_total.inc()
+                    self.log.info(f"Escalation budget used up, keeping {best[0]} with confidence {best[1]}")
+                    break
+                _escalations_total.inc(tier=tier)
+                self.log.info(f"Escalating to {tier} read after {best[0]} with confidence {best[1]}")
 
-            try:
-                return clean_date, int(float(confidence))
-            except (ValueError, TypeError):
-                self.log.warning(f"Could not parse confidence value: {confidence}")
-                return clean_date, 0
-        else:
+            result = self.read_tier(img, detail, corner, date_format)
+            if result is None:
+                # The API failed even after retries; more reads would fail the same way
+                break
+            if best is None or self.rank(result) > self.rank(best):
+                best = result
+            if self.is_resolved(result):
+                resolved_by = tier
+                break
+
+        _tier_resolved_total.inc(tier=resolved_by)
+        if best is None:
+            _date_reads_total.inc(result="not_found")
             self.log.error("No date extracted from the image.")
             return None, -1
 
+        clean_date, confidence, is_valid, _ = best
+        _date_reads_total.inc(result="valid" if is_valid else "invalid")
+        return clean_date, confidence
+
+    def read_tier(self, img, detail, corner, date_format):
+        """
+        One read of the date.
+
+        :return: (date, confidence, is_valid, in_range), or None if the API request failed.
+        """
+        cropped_img = self.crop_date_64(img, corner=corner, detail=detail)
+        extracted_date, confidence = self.read_date(cropped_img, detail=detail, date_format=date_format)
+        if not extracted_date:
+            return None
+
+        # Validate the extracted text as a date
+        clean_date, is_valid = self.validate_date_format(extracted_date)
+        self.log.info(f"Extracted date: {clean_date} | Confidence: {confidence} | {detail} detail, {corner} corner")
+        try:
+            confidence = int(float(confidence))
+        except (ValueError, TypeError):
+            self.log.warning(f"Could not parse confidence value: {confidence}")
+            confidence = 0
+        if not is_valid:
+            confidence = -1
+        return clean_date, confidence, is_valid, is_valid and self.in_date_range(clean_date)
+
+    @staticmethod
+    def rank(result):
+        _, confidence, is_valid, in_range = result
+        return is_valid, in_range, confidence
+
+    @staticmethod
+    def is_resolved(result):
+        _, confidence, is_valid, in_range = result
+        return is_valid and in_range and confidence >= ACCEPT_CONFIDENCE
+
+    def take_escalation(self):
+        with self.escalation_lock:
+            if self.escalation_budget is not None and self.escalations >= self.escalation_budget:
+                return False
+            self.escalations += 1
+            return True
+
+    def alternate_date_format(self):
+        """
+        The prompt to re-read with when the configured date format may be wrong: the universal
+        prompt, which works out the order itself. None when the universal prompt is already in use.
+        """
+        return None if self.date_format == 'universal' else 'universal'
+
+    def in_date_range(self, date):
+        """
+        Whether an mm/dd/yyyy date is within self.date_range ("mm/dd/yyyy to mm/dd/yyyy" or a single day).
+        Dates are in range when no range is set or it cannot be parsed.
+        """
+        if not self.date_range or not self.date_range.strip():
+            return True
+        try:
+            bounds = [datetime.datetime.strptime(part.strip(), "%m/%d/%Y") for part in self.date_range.split("to")]
+            value = datetime.datetime.strptime(date, "%m/%d/%Y")
+        except ValueError:
+            return True
+        return bounds[0] <= value <= bounds[-1]
+
     def read_image_date(self, image_path):
         """
         Reads the EXIF data from the given image and returns a dictionary of date-related EXIF fields
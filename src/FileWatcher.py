@@ -8,13 +8,15 @@ import threading
 import time
 import os
 import pyexiv2
-import requests
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from datetime import datetime
 from ImageOrganizer import ImageOrganizer  # Assuming image_organizer is a module
+import ModelRegistry
 from dotenv import load_dotenv
 from LoggerConfig import setup_logger
+from Notifier import Notifier, StdoutSink, create_sink, DEFAULT_WEBHOOK_URL
+from ScanDiscovery import discover_images
 
 log = setup_logger("FileWatcher", "../log/ImgDate.log")
 check_time = 60
@@ -73,9 +75,9 @@ def monitor_directory(directory_to_watch):  # 1800 seconds = 30 minutes
 
 
 # Step 3: Count the number of images
-def count_images(directory):
-    image_extensions = ('.jpg', '.jpeg', '.png', '.tiff', '.bmp')  # Add more if needed
-    image_files = [f for f in os.listdir(directory) if f.lower().endswith(image_extensions)]
+def count_images(directory, recursive=False):
+    # Paths are relative to directory so they can be joined onto another folder
+    image_files = [os.path.relpath(path, directory) for path in discover_images(directory, recursive=recursive, largest_first=False)]
     log.info(f"Number of images found: {len(image_files)}")
     return len(image_files), image_files
 
@@ -115,7 +117,16 @@ def get_exif_dates(directory, image_files):
     return youngest_date_str, oldest_date_str
 
  
-def prepend_filenames(directory, image_files):
+def catalog_dates(catalog, batch):
+    """
+    Like get_exif_dates for the photos a batch saved, from the catalog instead of their EXIF data.
+    """
+    oldest, youngest = catalog.date_range(batch=batch)
+    to_str = lambda date: datetime.strptime(date, "%Y-%m-%d").strftime("%m:%d:%Y") if date else None
+    return to_str(youngest), to_str(oldest)
+
+
+def prepend_filenames(directory, image_files, catalog=None):
     log.info("Prepending filenames...")
     for filename in image_files:
         counter = 0
@@ -132,11 +143,13 @@ def prepend_filenames(directory, image_files):
 
         try:
             os.rename(os.path.join(directory, filename), new_file_path)
+            if catalog is not None:
+                catalog.move(os.path.join(directory, filename), new_file_path)
             log.info(f"Renamed {filename} to {new_filename}")
         except Exception as e:
             log.error(f"Failed to rename {filename} to {new_filename}: {e}")
         
-def move_failed_to_saved(failed_dir, saved_dir):
+def move_failed_to_saved(failed_dir, saved_dir, catalog=None):
     failed_filenames = []
     for filename in os.listdir(failed_dir):
         failed_file_path = os.path.join(failed_dir, filename)
@@ -144,22 +157,28 @@ def move_failed_to_saved(failed_dir, saved_dir):
         
         if os.path.isfile(failed_file_path):
             shutil.move(failed_file_path, saved_file_path)
+            if catalog is not None:
+                catalog.move(failed_file_path, saved_file_path)
             failed_filenames.append(filename)
             
     return failed_filenames
 
 
 # Step 6: Trigger Image Organizer and Notify Webhook
-def main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK):
+def main(directory_to_watch, save_path, error_path, archive_path, notifier, index_path=None, catalog_path=None):
+    # Load the models once up front; every cycle's organizer borrows them
+    timings = ModelRegistry.warm()
+    log.info(f"Models loaded: {', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())}")
+
     while True:
         # Monitor the directory
         if monitor_directory(directory_to_watch):
             # Count the number of images
-            initial_num_images, image_files = count_images(directory_to_watch)
+            initial_num_images, image_files = count_images(directory_to_watch, recursive=True)
             
             title = "Processing images"
             message = f"Reading date for {initial_num_images} images..."
-            response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+            notifier.notify(title, message)
   
             # create temp save dir
             temp_save_path = os.path.join(save_path, "temp")
@@ -178,26 +197,30 @@ def main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK):
                     fix_orientation=True,
                     crop_images=False,
                     date_images=True,
-                    draw_contours=False
+                    draw_contours=False,
+                    rotation_mode="lossless",
+                    index_path=index_path,
+                    catalog_path=catalog_path
                 )
+                catalog = image_organizer.catalog
                 try:
                     run_with_timeout(image_organizer.process_images(), timeout=600)
                 except TimeoutError:
                     log.error("Main function timed out after 10 minutes")
                     title = "File Watcher Timeout"
                     message = "The file watcher operation timed out after 10 minutes"
-                    response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+                    notifier.notify(title, message)
                     
                 
                 # get files names and list before adding failed one in
                 
-                failed_filenames = move_failed_to_saved(error_path, temp_save_path)
+                failed_filenames = move_failed_to_saved(error_path, temp_save_path, catalog)
                 num_failed = len(failed_filenames)
                 
                 processed_num_images, image_files = count_images(temp_save_path)
                 
                 # Prepend filenames
-                prepend_filenames(temp_save_path, image_files)      
+                prepend_filenames(temp_save_path, image_files, catalog)
                 
                 processed_num_images, image_files = count_images(temp_save_path)
                           
@@ -205,7 +228,10 @@ def main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK):
                 processed_num_images
                 if processed_num_images > 0:
                     # Read EXIF dates and get the youngest and oldest dates
-                    youngest_date, oldest_date = get_exif_dates(temp_save_path, image_files)
+                    if catalog is not None:
+                        youngest_date, oldest_date = catalog_dates(catalog, image_organizer.batch_id)
+                    else:
+                        youngest_date, oldest_date = get_exif_dates(temp_save_path, image_files)
                     if youngest_date and oldest_date:
                         log.info(f"Youngest image date: {youngest_date}")
                         log.info(f"Oldest image date: {oldest_date}")
@@ -224,31 +250,26 @@ def main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK):
                     title = "Failed To Process Images"
                     message = f'''Processed {processed_num_images} of {initial_num_images} images'''
                 
-                log.info(f"Sending webhook notification: {title} - {message}")
-                # Send POST request to the webhook
-                response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+                log.info(f"Queueing notification: {title} - {message}")
+                notifier.notify(title, message)
 
-
-                if response.status_code == 200:
-                    log.info("Webhook notification sent successfully.")
-                else:
-                    log.error(f"Failed to send webhook notification: {response.status_code}")
-                    
                 # move files in temp save dir to actual save dir
                 for image_file in image_files:
                     try:
                         source_path = os.path.join(temp_save_path, image_file)
                         final_save_path = os.path.join(save_path, image_file)
                         shutil.move(source_path, final_save_path)
+                        if catalog is not None:
+                            catalog.move(source_path, final_save_path)
                         log.info(f"Moved scan {image_file} to {final_save_path}")
                     except Exception as e:
                         log.error(f"Failed to move {image_file} to final save directory. Error: {e}")
                         title = "Error moving saved images"
                         message = f"Failed to move saved images out of temp folder:\n{e}"
-                        response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+                        notifier.notify(title, message)
   
                     
-                num_archive, _ = count_images(archive_path)
+                num_archive, _ = count_images(archive_path, recursive=True)
                 
                 if num_archive == processed_num_images:
                     log.info("Deleting old files in archive dir")
@@ -260,7 +281,7 @@ def main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK):
                         log.error(f"Failed to delete files in archive path: {e}")
                         title = "Error deleting archived images"
                         message = f"Failed to delete with error:\n{e}"
-                        response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+                        notifier.notify(title, message)
                 else:
                     log.warning(f"{processed_num_images} Processed images and {num_archive} archive images aren't the same amount")
   
@@ -277,6 +298,9 @@ if __name__ == "__main__":
     save_path = os.path.join(_base, 'processed')
     error_path = os.path.join(save_path, 'Failed')
     archive_path = os.path.join(save_path, 'archive')
+    # Outside the archive, which is deleted once it has been checked
+    index_path = os.path.join(_base, 'index')
+    catalog_path = os.path.join(_base, 'catalog.db')
 
     _env_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
     if not os.path.isfile(_env_path):
@@ -284,14 +308,24 @@ if __name__ == "__main__":
 
     load_dotenv(_env_path)
     WEBHOOK = os.getenv('WEBHOOK')
+    try:
+        sink = create_sink(os.getenv('NOTIFY_SINK', 'webhook'), WEBHOOK, base_url=os.getenv('WEBHOOK_URL', DEFAULT_WEBHOOK_URL))
+    except ValueError as e:
+        # A missing WEBHOOK should not stop the watcher from processing scans
+        log.warning(f"{e} Printing notifications to stdout instead.")
+        sink = StdoutSink()
+    notifier = Notifier(sink)
 
     log.info(f"\n\n------------------------------\nStarting File Watcher\n------------------------------\n")
     try:
         # Run the main function with a 10-minute (600 seconds) timeout
-        main(directory_to_watch, save_path, error_path, archive_path, WEBHOOK)
+        main(directory_to_watch, save_path, error_path, archive_path, notifier, index_path, catalog_path)
 
     except Exception as e:
         log.error(f"An error occurred: {e}")
         title = "Error in File Watcher"
         message = f"An error occurred in the file watcher:\n{e}"
-        response = requests.post(f"https://trigger.macrodroid.com/{WEBHOOK}/universal?title={title}&message={message}")
+        notifier.notify(title, message)
+    finally:
+        # Sends what is still queued, e.g. the error above or a summary coalescing when stopped
+        notifier.close()
@@ -1,22 +1,55 @@
 import cv2
-import dlib
 import os
+import queue
+import threading
+from contextlib import contextmanager
 import numpy as np
 import time
+import Metrics as metrics
+
+_orientation_total = metrics.counter("imgdate_orientation_total", "Orientation corrections, by rotation applied")
+
+_detector_passes_total = metrics.counter("imgdate_face_detector_passes_total", "Face detector runs, one per rotation tried")
+
+ROTATIONS = (0, 90, 180, 270)
+# Skin tones in YCrCb, for ordering prints by how likely they are to show a face
+SKIN_LOW, SKIN_HIGH = (40, 135, 85), (255, 170, 125)
+# Prints of a scan that must agree on a rotation before it is used for the rest
+MIN_SCAN_AGREEMENT = 2
 
 _DEFAULT_PREDICTOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'shape_predictor_5_face_landmarks.dat')
 
 class FixOrientation:
     def __init__(self, predictor_path=_DEFAULT_PREDICTOR):
-        self.detector = dlib.get_frontal_face_detector()
-        self.predictor = dlib.shape_predictor(predictor_path)
+        self.predictor_path = predictor_path
+        # dlib's detector and predictor crash when one instance is used by two threads at once, so
+        # each call borrows a pair of its own. Pairs are created as needed and kept for reuse.
+        self.idle_models = queue.LifoQueue()
+        self.idle_models.put(self.load_models())
+
+    def load_models(self):
+        # Imported here so modules that only need rotate_image do not load dlib
+        import dlib
+        return dlib.get_frontal_face_detector(), dlib.shape_predictor(self.predictor_path)
+
+    @contextmanager
+    def models(self):
+        try:
+            pair = self.idle_models.get_nowait()
+        except queue.Empty:
+            pair = self.load_models()
+        try:
+            yield pair
+        finally:
+            self.idle_models.put(pair)
 
     def detect_faces_and_landmarks(self, gray):
-        faces = self.detector(gray, 1)
-        if not faces:
-            return None
-        face = faces[0]
-        shape = self.predictor(gray, face)
+        with self.models() as (detector, predictor):
+            faces = detector(gray, 1)
+            if not faces:
+                return None
+            face = faces[0]
+            shape = predictor(gray, face)
         return face, np.array([(shape.part(i).x, shape.part(i).y) for i in range(5)])
 
     def determine_orientation(self, keypoints):
@@ -37,8 +70,12 @@ class FixOrientation:
             return image
         return cv2.rotate(image, [cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_180, cv2.ROTATE_90_COUNTERCLOCKWISE][angle // 90 - 1])
 
-    def process_image(self, image):
-        original_image = image.copy()
+    def detect_face_rotation(self, image, rotations=ROTATIONS):
+        """
+        First of the clockwise rotations, tried in the given order, that shows an upright face,
+        or None when there is no face at any of them.
+        Only needs an image of about 1000 px on the short side.
+        """
         h, w = image.shape[:2]
         min_dim = min(h, w)
         scale = 1
@@ -47,28 +84,70 @@ class FixOrientation:
             image = cv2.resize(image, (int(w * scale), int(h * scale)))
 
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # Try upright orientation first
-        result = self.detect_faces_and_landmarks(gray)
-        if result:
-            _, keypoints = result
-            orientation = self.determine_orientation(keypoints)
-            print(f"Detected orientation: {orientation}")
-            return original_image
-
-        # If no face found, try other orientations
-        for angle in [90, 180, 270]:
-            rotated_gray = self.rotate_image(gray, angle)
-            result = self.detect_faces_and_landmarks(rotated_gray)
 
+        for angle in rotations:
+            _detector_passes_total.inc()
+            result = self.detect_faces_and_landmarks(self.rotate_image(gray, angle))
             if result:
                 _, keypoints = result
                 orientation = self.determine_orientation(keypoints)
                 print(f"Detected orientation: {orientation}")
-                return self.apply_orientation(original_image, angle)
+                return angle
+        return None
+
+    @metrics.timed("imgdate_stage_seconds", stage="fix_orientation")
+    def detect_rotation(self, image):
+        """
+        Clockwise rotation (0, 90, 180 or 270) that turns the faces in the image upright.
+        Returns 0 when no face is found.
+        """
+        # Try upright orientation first
+        rotation = self.detect_face_rotation(image)
+        if rotation is None:
+            print("No faces detected.")
+            _orientation_total.inc(rotation="no_face")
+            return 0
+        _orientation_total.inc(rotation=str(rotation))
+        return rotation
+
+    @metrics.timed("imgdate_stage_seconds", stage="fix_orientation")
+    def detect_scan_rotation(self, image, scan):
+        """
+        Like detect_rotation for a print from a scan whose other prints vote through scan, a
+        ScanOrientation. The rotations are tried most voted first; once the prints agree on a
+        rotation it is tried first and also applied when no rotation shows a face.
+        """
+        prior = scan.prior()
+        # The prior outvotes the other rotations, so it is first in the order; a print that was
+        # placed differently is still found at its own rotation
+        rotation = self.detect_face_rotation(image, scan.order())
+        if rotation is None:
+            if prior is None:
+                print("No faces detected.")
+                _orientation_total.inc(rotation="no_face")
+                return 0
+            _orientation_total.inc(rotation=f"scan_{prior}")
+            return prior
+        scan.record(rotation)
+        _orientation_total.inc(rotation=str(rotation))
+        return rotation
 
-        print("No faces detected.")
-        return original_image
+    @staticmethod
+    def face_likelihood(image):
+        """
+        Share of skin coloured pixels after a gray world white balance (old prints are often
+        faded towards orange or blue), used to look for faces first on the prints likely to have them.
+        """
+        h, w = image.shape[:2]
+        scale = min(1.0, 200 / max(h, w))
+        small = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA).astype(np.float32)
+        means = small.reshape(-1, 3).mean(axis=0)
+        balanced = np.clip(small * (means.mean() / np.maximum(means, 1)), 0, 255).astype(np.uint8)
+        skin = cv2.inRange(cv2.cvtColor(balanced, cv2.COLOR_BGR2YCrCb), SKIN_LOW, SKIN_HIGH)
+        return cv2.countNonZero(skin) / skin.size
+
+    def process_image(self, image):
+        return self.apply_orientation(image, self.detect_rotation(image))
 
     def apply_orientation(self, image, angle):
         if angle == 0:
@@ -109,6 +188,35 @@ class FixOrientation:
             print(f"Total processing time: {total_time:.2f} seconds")
             print(f"Average processing time per image: {avg_time:.2f} seconds")
 
+class ScanOrientation:
+    """
+    Rotations found on the prints of one scan. Prints on a flatbed are usually placed the same
+    way, so once MIN_SCAN_AGREEMENT of them agree (and outvote the rest) the rotation becomes the
+    prior for the others.
+    """
+    def __init__(self, min_agreement=MIN_SCAN_AGREEMENT):
+        self.min_agreement = min_agreement
+        self.votes = dict.fromkeys(ROTATIONS, 0)
+        self.lock = threading.Lock()
+
+    def record(self, rotation):
+        with self.lock:
+            self.votes[rotation] += 1
+
+    def prior(self):
+        with self.lock:
+            rotation = max(ROTATIONS, key=lambda r: self.votes[r])
+            count = self.votes[rotation]
+            if count >= self.min_agreement and count > sum(self.votes.values()) - count:
+                return rotation
+            return None
+
+    def order(self):
+        # Most voted first, upright first among equals
+        with self.lock:
+            return tuple(sorted(ROTATIONS, key=lambda r: -self.votes[r]))
+
+
 if __name__ == "__main__":
     input_folder = "../img/unprocessed"
     output_folder = "../img/processed/corrected"
@@ -119,4 +227,4 @@ if __name__ == "__main__":
     corrector.process_images_in_folder(input_folder, output_folder)
     end_time = time.time()
     
-    print(f"\nTotal script execution time: {end_time - start_time:.2f} seconds")
\ No newline at end of file
+    print(f"\nTotal script execution time: {end_time - start_time:.2f} seconds")
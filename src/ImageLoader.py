@@ -0,0 +1,223 @@
+from contextlib import contextmanager
+from threading import Condition
+import cv2
+import numpy as np
+from PIL import Image
+
+# cv2 reduced decode flags keyed by their downscale factor
+REDUCED_COLOR_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def read_image_size(image_path):
+    """
+    Read (width, height) from the file header without decoding the pixels.
+    Returns None if the file cannot be opened.
+    """
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except Exception:
+        return None
+
+
+# EXIF Orientation values of the clockwise rotations a viewer applies before display
+EXIF_ORIENTATIONS = {0: 1, 90: 6, 180: 3, 270: 8}
+
+
+def read_exif_rotation(image_path):
+    """
+    Clockwise rotation requested by the EXIF Orientation tag (0 when there is none).
+    Returns None for the mirrored orientations, which cannot be expressed as a rotation.
+    """
+    try:
+        with Image.open(image_path) as img:
+            orientation = img.getexif().get(0x0112, 1)
+    except Exception:
+        return 0
+    for rotation, value in EXIF_ORIENTATIONS.items():
+        if orientation == value:
+            return rotation
+    return None if orientation in (2, 4, 5, 7) else 0
+
+
+def is_jpeg(image_path):
+    try:
+        with open(image_path, 'rb') as f:
+            return f.read(3) == b'\xff\xd8\xff'
+    except OSError:
+        return False
+
+
+def reduction_factor(size, min_width, min_height):
+    """
+    Largest decode factor (1, 2, 4 or 8) that keeps the image at least min_width x min_height.
+    """
+    if size is None:
+        return 1
+    width, height = size
+    factor = 1
+    for candidate in (2, 4, 8):
+        if width // candidate >= min_width and height // candidate >= min_height:
+            factor = candidate
+    return factor
+
+
+def imread_reduced(image_path, min_width, min_height):
+    """
+    Decode an image at the smallest power-of-two scale that still covers min_width x min_height.
+    JPEGs are scaled in the DCT domain by libjpeg so the full resolution image is never built.
+
+    :return: (image, factor) where factor is the downscale applied, or (None, 1) if decoding failed.
+    """
+    factor = reduction_factor(read_image_size(image_path), min_width, min_height)
+    image = cv2.imread(image_path, REDUCED_COLOR_FLAGS[factor])
+    if image is None:
+        return None, 1
+    return image, factor
+
+
+# Rough peak bytes per pixel while AutoCrop builds its masks (BGR image, preview copy and six 8-bit masks)
+MASK_BYTES_PER_PIXEL = 12
+
+
+class ScanReader:
+    """
+    Reads a scan without holding the full resolution image in memory.
+
+    Uncompressed 8-bit RGB TIFFs are memory-mapped and read strip by strip, so reading a region only
+    touches the pages it covers. Other formats are decoded once, on the first full resolution read.
+    """
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.strips = []  # (first row, last row + 1, view of rows x width x 3 in the file's memmap)
+        self.image = None
+        with Image.open(image_path) as img:
+            self.size = img.size
+            if img.format == 'TIFF' and img.mode == 'RGB':
+                self.strips = self._map_strips(img)
+
+    def _map_strips(self, img):
+        width, height = img.size
+        row_bytes = width * 3
+        ranges = []  # (first row, last row + 1, offset), contiguous strips merged
+        for tile in img.tile:
+            codec, (x0, y0, x1, y1), offset, args = tile
+            rawmode, stride = args[0], args[1] if len(args) > 1 else 0
+            if codec != 'raw' or rawmode != 'RGB' or stride not in (0, row_bytes) or (x0, x1) != (0, width):
+                return []
+            if ranges and ranges[-1][1] == y0 and ranges[-1][2] + (y0 - ranges[-1][0]) * row_bytes == offset:
+                ranges[-1] = (ranges[-1][0], y1, ranges[-1][2])
+            else:
+                ranges.append((y0, y1, offset))
+        if sum(y1 - y0 for y0, y1, _ in ranges) != height:
+            return []
+        # One mapping of the whole file (one descriptor and one map however many strips there
+        # are; writers such as OpenCV use a strip per row), viewed strip by strip
+        mapped = np.memmap(self.image_path, dtype=np.uint8, mode='r')
+        return [(y0, y1, mapped[offset:offset + (y1 - y0) * row_bytes].reshape(y1 - y0, width, 3))
+                for y0, y1, offset in ranges]
+
+    @property
+    def memory_mapped(self):
+        return bool(self.strips)
+
+    def reduced(self, factor):
+        """
+        BGR image downscaled by factor, for building the segmentation mask. Do not modify it.
+        """
+        if factor == 1 and not self.strips:
+            self.read_region(0, 0, 1, 1)
+            return self.image
+        if self.strips:
+            width, height = self.size
+            reduced = np.empty(((height + factor - 1) // factor, (width + factor - 1) // factor, 3), dtype=np.uint8)
+            for y0, y1, rows in self.strips:
+                first = (y0 + factor - 1) // factor * factor  # First row of this strip on the reduced grid
+                if first < y1:
+                    reduced[first // factor:(y1 - 1) // factor + 1] = rows[first - y0::factor, ::factor]
+            return cv2.cvtColor(reduced, cv2.COLOR_RGB2BGR)
+        if self.image is not None:
+            return cv2.resize(self.image, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+        return cv2.imread(self.image_path, REDUCED_COLOR_FLAGS[factor])
+
+    def read_region(self, x0, y0, x1, y1):
+        """
+        BGR copy of the full resolution pixels in [x0, x1) x [y0, y1).
+        """
+        if self.strips:
+            parts = [rows[max(y0, s0) - s0:min(y1, s1) - s0, x0:x1] for s0, s1, rows in self.strips if s0 < y1 and s1 > y0]
+            region = np.concatenate(parts) if len(parts) > 1 else np.array(parts[0])
+            return cv2.cvtColor(region, cv2.COLOR_RGB2BGR)
+        if self.image is None:
+            self.image = cv2.imread(self.image_path)
+            if self.image is None:
+                raise ValueError(f"Could not load image: {self.image_path}")
+        return self.image[y0:y1, x0:x1].copy()
+
+    def mask_factor(self, budget_bytes, min_factor=2):
+        """
+        Smallest reduction factor (at least min_factor) at which building the mask fits in budget_bytes.
+        """
+        width, height = self.size
+        for factor in (1, 2, 4, 8):
+            if factor < min_factor:
+                continue
+            if (width // factor) * (height // factor) * MASK_BYTES_PER_PIXEL <= budget_bytes:
+                return factor
+        return 8
+
+    def estimate_bytes(self, factor):
+        """
+        Peak memory of cropping this scan with the mask built at the given factor.
+        """
+        width, height = self.size
+        mask_bytes = (width // factor) * (height // factor) * MASK_BYTES_PER_PIXEL
+        # Decoded formats keep the full image; mapped TIFFs only hold a photo region and its warp
+        image_bytes = width * height * 3 if not self.strips else width * height * 3 // 4
+        return mask_bytes + image_bytes
+
+    def close(self):
+        self.strips = []
+        self.image = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class MemoryBudget:
+    """
+    Semaphore weighted by bytes. Workers reserve their estimated peak memory before decoding
+    and wait while the total reserved would exceed the limit. A reservation larger than the
+    whole budget still runs, but only once nothing else holds memory.
+    """
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.used = 0
+        self.condition = Condition()
+
+    def acquire(self, nbytes):
+        with self.condition:
+            self.condition.wait_for(lambda: self.used == 0 or self.used + nbytes <= self.limit)
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
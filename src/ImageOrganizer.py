@@ -2,21 +2,58 @@ import datetime
 import os
 import re
 import shutil
+import subprocess
 import tempfile
+import uuid
 import cv2
 import calendar
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextlib
+import contextvars
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
 import pyexiv2
 from threading import Lock
 from AutoCrop import AutoCrop
+from Catalog import Catalog
 from DateExtractor import DateExtractor
-from FixOrientation import FixOrientation
-from LoggerConfig import setup_logger
+from FixOrientation import FixOrientation, ScanOrientation
+import ModelRegistry
+from ImageLoader import ScanReader, MemoryBudget, imread_reduced, is_jpeg, read_image_size, read_exif_rotation, EXIF_ORIENTATIONS, MASK_BYTES_PER_PIXEL
+from LoggerConfig import setup_logger, log_context
+from ScanDiscovery import discover_images
+from ScanIndex import DEFAULT_MAX_GB, ScanIndex
+import Metrics as metrics
 import SharedVariables as shared
 
+_scans_total = metrics.counter("imgdate_scans_total", "Scans or single images processed, by result")
+_images_saved_total = metrics.counter("imgdate_images_saved_total", "Images written to the save or error path, by result")
+_low_confidence_total = metrics.counter("imgdate_low_confidence_total", "Images saved to the error path for manual review")
+_speculative_orientation_total = metrics.counter("imgdate_speculative_orientation_total", "Orientations detected while the date was read, by whether they were used")
+_stages_reused_total = metrics.counter("imgdate_stages_reused_total", "Stage results taken from the scan index instead of being recomputed, by stage")
+_rotations_saved_total = metrics.counter("imgdate_rotations_saved_total", "Rotated photos saved, by how the rotation was applied")
+
+DEFAULT_WORKER_MEMORY_MB = 512  # Mask budget per worker in tiled mode when no memory budget is set
+REDUCED_MIN_SIDE = 1200  # Short side of the decode single photos are dated and oriented from
+DEFAULT_ESCALATION_BUDGET = 100  # Extra date reads per batch for low confidence or out of range results
+
+# When the scan being processed by the current worker started, for the timings in the catalog
+_scan_started = contextvars.ContextVar("scan_started", default=None)
+
+# How single JPEG photos that need rotating are saved:
+#   reencode  rotate the pixels and re-encode the JPEG
+#   exif      copy the original bytes and set the EXIF Orientation tag
+#   lossless  rotate the DCT blocks with jpegtran, falling back to the EXIF tag when it is unavailable
+ROTATION_MODES = ('reencode', 'exif', 'lossless')
+
+# How the orientation of the photos cropped from a scan is found:
+#   print  each photo on its own, trying every rotation until a face is upright
+#   scan   photos most likely to show a face first; once enough of them agree on a rotation it is
+#          tried first on the rest and applied to the ones without a face
+ORIENTATION_MODES = ('print', 'scan')
+
 class ImageOrganizer:
-    def __init__(self, scans_path="../img/unprocessed", save_path="../img/processed", error_path="../img/processed/Failed", archive_path="../img/archive", crop_images = True, date_images = True, fix_orientation = True, archive_scans = True, sort_images = True, draw_contours = False, batch_progress=None):
+    def __init__(self, scans_path="../img/unprocessed", save_path="../img/processed", error_path="../img/processed/Failed", archive_path="../img/archive", crop_images = True, date_images = True, fix_orientation = True, archive_scans = True, sort_images = True, draw_contours = False, batch_progress=None, batch_id=None, tiled_processing=False, memory_budget_mb=None, rotation_mode='reencode', escalation_budget=DEFAULT_ESCALATION_BUDGET, orientation_mode='scan', index_path=None, catalog_path=None, date_format=None, date_range=None, index_max_gb=DEFAULT_MAX_GB):
         self.scans_path = scans_path
         self.save_path = save_path
         self.error_path = error_path
@@ -26,9 +63,24 @@ class ImageOrganizer:
         self.date_images = date_images
         self.fix_orientation = fix_orientation
         self.sort_images = sort_images
-        self.auto_crop = AutoCrop(scans_path, draw_contours)
-        self.date_extractor = DateExtractor()
-        self.orientation = FixOrientation() if fix_orientation else None
+        # Build the crop mask from a reduced decode and read photos at full resolution one region at a time
+        self.tiled_processing = tiled_processing
+        # Per worker; scans wait for memory when the estimate of the running ones would exceed it in total
+        self.memory_budget_mb = memory_budget_mb
+        self.memory_budget = None
+        if rotation_mode not in ROTATION_MODES:
+            raise ValueError(f"Unknown rotation mode: {rotation_mode}. Expected one of {', '.join(ROTATION_MODES)}")
+        self.rotation_mode = rotation_mode
+        if orientation_mode not in ORIENTATION_MODES:
+            raise ValueError(f"Unknown orientation mode: {orientation_mode}. Expected one of {', '.join(ORIENTATION_MODES)}")
+        self.orientation_mode = orientation_mode
+        # Scans seen before (by content) reuse the crops, dates, rotations and photos saved for them
+        self.scan_index = ScanIndex(index_path, max_gb=index_max_gb) if index_path else None
+        # Every saved photo is recorded in the catalog so the library can be queried without listing it
+        self.catalog = Catalog(catalog_path) if catalog_path else None
+        # Models are borrowed from the process-wide registry instead of being loaded per batch
+        self.auto_crop = AutoCrop(scans_path, draw_contours, mask_builder=ModelRegistry.mask_builder())
+        self.date_extractor = DateExtractor(escalation_budget=escalation_budget, date_format=date_format, date_range=date_range)
 
         self.s = shared
         self.s.num_images = 0
@@ -41,6 +93,9 @@ class ImageOrganizer:
             self._batch_progress['num_images'] = 0
             self._batch_progress['current_image_num'] = 0
 
+        # Attached to every log record written while this organizer processes its scans
+        self.batch_id = batch_id or uuid.uuid4().hex[:8]
+
         self.lock = Lock()  # For thread safety
         self.log = setup_logger("ImageOrganizer", "../log/ImgDate.log")
 
@@ -49,73 +104,271 @@ class ImageOrganizer:
         os.makedirs(error_path, exist_ok=True)
         os.makedirs(archive_path, exist_ok=True)
 
-    def process_images(self):
-        scan_file_paths = self.get_scan_file_paths()
-        if self.crop_images:
-            self.log.info(f"Found {len(scan_file_paths)} {'scan' if len(scan_file_paths) == 1 else 'scans'} to process.")
-        else:
-            self.log.info(f"Found {len(scan_file_paths)} {'image' if len(scan_file_paths) == 1 else 'images'} to process.")
-            self.s.num_images = len(scan_file_paths)
-            if self._batch_progress is not None:
-                self._batch_progress['num_images'] = len(scan_file_paths)
-            
-            
+    @property
+    def orientation(self):
+        """
+        The shared FixOrientation, loaded on first use so organizers that never orient a photo
+        (e.g. the one main.py edit saves through) do not load dlib.
+        """
+        return ModelRegistry.fix_orientation() if self.fix_orientation else None
+
+    def process_images(self, max_workers=10):
+        # Scans are discovered lazily and at most max_workers * 2 are queued at a time,
+        # so memory use does not grow with the size of the input folder
+        self.log.info(f"Looking for {'scans' if self.crop_images else 'images'} in {self.scans_path}")
+        found = 0
+        self.create_memory_budget(max_workers)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = set()
+            for scan_path in self.get_scan_file_paths():
+                found += 1
+                if not self.crop_images:
+                    with self.lock:
+                        self.s.num_images += 1
+                        if self._batch_progress is not None:
+                            self._batch_progress['num_images'] = self._batch_progress.get('num_images', 0) + 1
+
+                pending.add(executor.submit(self.crop_and_save_scans, scan_path))
+                if len(pending) >= max_workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self.collect_results(done)
+
+            self.collect_results(pending)
+
+        self.log.info(f"Processed {found} {'scan' if self.crop_images else 'image'}{'' if found == 1 else 's'}.")
+
+    def create_memory_budget(self, max_workers):
+        """
+        Share memory_budget_mb per worker thread between the max_workers threads of a run.
+        """
+        if self.memory_budget_mb:
+            self.memory_budget = MemoryBudget(self.memory_budget_mb * 1024 ** 2 * max_workers)
+
+    def enqueue_scans(self, job_queue):
+        """
+        Coordinator side of worker mode: add every scan in scans_path to a JobQueue.
+        Returns the number of scans queued.
+        """
+        queued = 0
+        for scan_path in self.get_scan_file_paths():
+            stat = os.stat(scan_path)
+            scan = os.path.relpath(scan_path, self.scans_path)
+            if job_queue.enqueue(scan, key=f"{scan}|{stat.st_size}|{stat.st_mtime_ns}"):
+                queued += 1
+        self.log.info(f"Queued {queued} scan{'' if queued == 1 else 's'} in {job_queue.queue_dir}")
+        return queued
+
+    def process_queue(self, job_queue, max_workers=10, poll_seconds=5):
+        """
+        Worker mode: process scans claimed from a JobQueue shared with workers on other hosts,
+        until the queue is drained. Scans in the jobs are relative to scans_path. Only max_workers
+        jobs are held at a time so the other workers get their share.
+        """
+        self.log.info(f"Working on the queue in {job_queue.queue_dir} as {job_queue.worker}")
+        processed = 0
+        self.create_memory_budget(max_workers)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, job_queue.heartbeat():
+            pending = {}
+            while True:
+                while len(pending) < max_workers:
+                    job = job_queue.claim()
+                    if job is None:
+                        break
+                    if not self.crop_images:
+                        self.count_images(1)
+                    pending[executor.submit(self.crop_and_save_scans, os.path.join(self.scans_path, job['scan']))] = job
+
+                if not pending:
+                    # Jobs claimed by other workers may still come back if their lease expires
+                    if job_queue.drained():
+                        break
+                    time.sleep(poll_seconds)
+                    continue
+
+                done, _ = wait(pending, timeout=poll_seconds, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = pending.pop(future)
+                    try:
+                        ok = future.result()
+                    except Exception as e:
+                        ok = False
+                        self.log.error(f"Error processing scan: {e}")
+                    if ok:
+                        job_queue.complete(job)
+                        processed += 1
+                    else:
+                        job_queue.fail(job, f"Error processing {job['scan']}, see the log of {job_queue.worker}")
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-            for scan_path in scan_file_paths:
-                futures.append(executor.submit(self.crop_and_save_scans, scan_path))
+        self.log.info(f"Queue drained, processed {processed} scan{'' if processed == 1 else 's'} here.")
 
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    self.log.error(f"Error processing scan: {e}")
+    def collect_results(self, futures):
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                self.log.error(f"Error processing scan: {e}")
 
+    @metrics.timed("imgdate_stage_seconds", stage="scan_total")
     def crop_and_save_scans(self, scan_path):
-        scan = self.load_scan(scan_path)
         original_filename = os.path.basename(scan_path)  # Get the original filename
-        try:
-            if self.crop_images:
-                # crop scan into a list of images
-                self.log.info(f"Cropping: {scan_path}")
-                cropped_images = self.crop_single_scan(scan)
-            else:
-                # each scan here is an individual image
-                scan = self.auto_crop.make_landscape(scan)
-                cropped_images = [scan]
-
-            if cropped_images:
-                for img in cropped_images:
-                    if self.date_images:
-                        date, confidence = self.date_extractor.extract_and_validate_date(img)
-                        original_exif_data = None
+        _scan_started.set(time.perf_counter())
+        with log_context(batch_id=self.batch_id, image_id=original_filename):
+            try:
+                with self.reserve_memory(scan_path), self.index_entry(scan_path) as entry:
+                    if not self.crop_images:
+                        self.process_single_image(scan_path, original_filename, entry)
                     else:
-                        confidence = 10
-                        date = "01/01/1111" # place holder date wont actually be used
-                        original_exif_data = self.date_extractor.read_image_date(scan_path)
+                        self.process_cropped_images(scan_path, original_filename, entry)
+                    if entry is not None:
+                        entry.save()
+
+                if self.archive_scans:
+                    self.move_scan_to_archive(scan_path)
+                _scans_total.inc(result="ok")
+                return True
+            except Exception as e:
+                _scans_total.inc(result="error")
+                self.log.error(f"Error processing {scan_path}: {e}")
+                return False
 
-                    if self.orientation and confidence > 8:
-                        try:
-                            img = self.orientation.process_image(img)
-                        except Exception as e:
-                            self.log.error(f"Error in FixOrientation: {e}")
 
-                    self.save_image(img, date, confidence, original_filename, original_exif_data)
+    def process_cropped_images(self, scan_path, original_filename, entry=None):
+        """
+        Crop the photos from a scan, then date, orient and save each one. With an index entry the
+        crops and the results of stages whose options have not changed are taken from it.
+        """
+        options = self.stage_options()
+        count = len(entry.photos) if entry is not None and entry.has_crops else 0
+        if count and all(self.indexed_output(entry, index, options) for index in range(count)):
+            # Everything the scan produced is in the index, so the crops are not even decoded
+            _stages_reused_total.inc(stage="crop")
+            self.count_images(count)
+            for index in range(count):
+                with log_context(image_id=f"{original_filename}#{index + 1}"):
+                    self.reuse_output(entry, index, options, original_filename)
+            return
+
+        cropped_images = entry.load_crops() if count else None
+        if cropped_images is None:
+            cropped_images = self.get_cropped_images(scan_path)
+            if entry is not None:
+                entry.store_crops(cropped_images)
+        else:
+            _stages_reused_total.inc(stage="crop")
+            self.count_images(len(cropped_images))
 
+        photos = [entry.photo(index) if entry is not None else {} for index in range(len(cropped_images))]
+        reused = {index for index in range(len(cropped_images)) if self.reuse_output(entry, index, options, original_filename)}
+        detect = [index for index, photo in enumerate(photos) if index not in reused and self.indexed_rotation(photo, options) is None]
+        orientations = dict(zip(detect, self.start_orientations([cropped_images[index] for index in detect])))
 
-            if self.archive_scans:
-                self.move_scan_to_archive(scan_path)
-        except Exception as e:
-            self.log.error(f"Error processing {scan_path}: {e}")
+        for index, img in enumerate(cropped_images):
+            if index in reused:
+                continue
+            with log_context(image_id=f"{original_filename}#{index + 1}"):
+                date, confidence, original_exif_data = self.read_photo_date(img, scan_path, photos[index], options)
+                rotation, oriented = self.photo_rotation(orientations.get(index), confidence, photos[index], options)
+
+                img = FixOrientation.rotate_image(img, rotation)
 
+                filename = self.write_image(img, date, confidence, original_filename, original_exif_data)
+                self.record_photo(entry, index, filename, date, confidence, rotation, oriented, options)
+
+    def index_entry(self, scan_path):
+        if self.scan_index is None:
+            return contextlib.nullcontext()
+        return self.scan_index.entry(scan_path, self.crop_images)
+
+    def stage_options(self):
+        """
+        The options each stage depends on. A stage result in the scan index is reused when its
+        options are the same; lists rather than tuples so they compare equal after a JSON round trip.
+        """
+        return {
+            'date': [self.date_images, self.date_extractor.date_format, self.date_extractor.date_range],
+            'orientation': [self.fix_orientation, self.orientation_mode],
+            'output': [self.sort_images, self.rotation_mode],
+        }
+
+    def indexed_output(self, entry, index, options):
+        """
+        The copy of a photo saved by an earlier run with the same options, or None.
+        """
+        if entry is None or entry.photo(index).get('options') != options:
+            return None
+        return entry.output(index)
+
+    def reuse_output(self, entry, index, options, original_filename):
+        """
+        Save a photo by copying its indexed output. Returns False when there is none.
+        """
+        stored = self.indexed_output(entry, index, options)
+        if stored is None:
+            return False
+        photo = entry.photo(index)
+        with self.lock:
+            filename = self.generate_filename(photo['date'], photo['confidence'], original_filename)
+            try:
+                shutil.copy2(stored, filename)
+                success = True
+            except OSError as e:
+                self.log.error(f"Could not copy {stored} from the scan index: {e}")
+                success = False
+            self.finish_save(filename, success)
+        if success:
+            self.catalog_photo(filename, photo['date'], photo['confidence'], original_filename)
+        _stages_reused_total.inc(stage="output")
+        return True
+
+    def read_photo_date(self, img, scan_path, photo, options):
+        if self.date_images and photo.get('options', {}).get('date') == options['date']:
+            _stages_reused_total.inc(stage="date")
+            return photo['date'], photo['confidence'], None
+        if self.date_images:
+            date, confidence = self.date_extractor.extract_and_validate_date(img)
+            return date, confidence, None
+        # place holder date wont actually be used
+        return "01/01/1111", 10, self.date_extractor.read_image_date(scan_path)
+
+    def indexed_rotation(self, photo, options):
+        """
+        Rotation recorded in the scan index with the same orientation options, or None.
+        """
+        if photo.get('oriented') and photo.get('options', {}).get('orientation') == options['orientation']:
+            return photo['rotation']
+        return None
+
+    def photo_rotation(self, future, confidence, photo, options):
+        """
+        Clockwise rotation for a photo, and whether it was actually detected (it is not for dates
+        that are not confident enough, which may be re-read with other options later).
+        """
+        rotation = self.indexed_rotation(photo, options)
+        if future is None and rotation is not None:
+            _stages_reused_total.inc(stage="orientation")
+            return rotation, True
+        return self.finish_orientation(future, confidence), confidence > 8 or not self.fix_orientation
+
+    def record_photo(self, entry, index, filename, date, confidence, rotation, oriented, options):
+        if entry is None:
+            return
+        photo = entry.photo(index)
+        photo.update(date=date, confidence=confidence, rotation=rotation, oriented=oriented, options=options, output=None)
+        if filename is not None:
+            try:
+                entry.store_output(index, filename)
+            except OSError as e:
+                self.log.error(f"Could not add {filename} to the scan index: {e}")
 
     def move_scan_to_archive(self, scan_path):
         """
         Move the scan file to the archive folder after processing.
         """
         try:  
-            archive_scan_path = os.path.join(self.archive_path, os.path.basename(scan_path))
+            # Keep the folder structure of nested scans
+            archive_scan_path = os.path.join(self.archive_path, os.path.relpath(scan_path, self.scans_path))
+            os.makedirs(os.path.dirname(archive_scan_path), exist_ok=True)
             shutil.move(scan_path, archive_scan_path)
             self.log.info(f"Moved scan {scan_path} to {archive_scan_path}")
         except Exception as e:
@@ -123,21 +376,160 @@ class ImageOrganizer:
 
 
     def get_scan_file_paths(self):
-        image_files = []
-        image_extensions = ('.jpg', '.jpeg', '.png', '.tiff')
-        for file in os.listdir(self.scans_path):
-            if file.lower().endswith(image_extensions):
-                image_files.append(os.path.join(self.scans_path, file))
-        return image_files
+        """
+        Lazily yield the scans in scans_path and its subfolders, largest first within a window.
+        Output folders that live inside scans_path are skipped.
+        """
+        exclude = (self.save_path, self.error_path, self.archive_path, os.path.join(self.scans_path, "contours"))
+        return discover_images(self.scans_path, exclude=exclude)
+
+    def get_cropped_images(self, scan_path):
+        if self.tiled_processing:
+            # crop scan into a list of images without decoding it at full resolution
+            self.log.info(f"Cropping (tiled): {scan_path}")
+            with ScanReader(scan_path) as reader:
+                return self.crop_single_scan(reader)
+
+        # crop scan into a list of images
+        scan = self.load_scan(scan_path)
+        self.log.info(f"Cropping: {scan_path}")
+        return self.crop_single_scan(scan)
+
+    def process_single_image(self, scan_path, original_filename, entry=None):
+        """
+        Date and orient a single photo from a reduced decode. JPEGs are copied with only their metadata
+        rewritten when no rotation is needed, or when rotation_mode can rotate them without re-encoding.
+        Anything else is decoded at full resolution, rotated and re-encoded. With an index entry the
+        results of stages whose options have not changed are taken from it.
+        """
+        options = self.stage_options()
+        if self.reuse_output(entry, 0, options, original_filename):
+            return
+        photo = entry.photo(0) if entry is not None else {}
+
+        image, _ = imread_reduced(scan_path, REDUCED_MIN_SIDE, REDUCED_MIN_SIDE)
+        if image is None:
+            raise ValueError(f"Could not load image: {scan_path}")
+
+        # Clockwise rotation to apply to the original, starting with the turn to landscape
+        rotation = 270 if image.shape[0] > image.shape[1] else 0
+        image = self.auto_crop.make_landscape(image)
+
+        orientation = self.start_orientation(image) if self.indexed_rotation(photo, options) is None else None
+        date, confidence, original_exif_data = self.read_photo_date(image, scan_path, photo, options)
+
+        photo_rotation, oriented = self.photo_rotation(orientation, confidence, photo, options)
+        rotation = (rotation + photo_rotation) % 360
+        del image
+
+        keep_bytes = rotation == 0 or (self.rotation_mode != 'reencode' and read_exif_rotation(scan_path) is not None)
+        if keep_bytes and is_jpeg(scan_path):
+            # The scan is still archived afterwards, so it is copied rather than moved
+            filename = self.write_image_file(scan_path, date, confidence, original_filename, original_exif_data,
+                                             remove_source=False, rotation=rotation)
+        else:
+            if rotation:
+                _rotations_saved_total.inc(method="reencode")
+            img = FixOrientation.rotate_image(self.load_scan(scan_path), rotation)
+            filename = self.write_image(img, date, confidence, original_filename, original_exif_data)
+        self.record_photo(entry, 0, filename, date, confidence, photo_rotation, oriented, options)
+
+    def start_orientation(self, image):
+        """
+        Start detecting the rotation of a photo on the shared CPU pool, so it runs while the
+        worker waits for the date to be read. None when orientation is off.
+        """
+        if not self.fix_orientation:
+            return None
+        try:
+            return ModelRegistry.cpu_pool().submit(self.orientation.detect_rotation, image)
+        except Exception as e:
+            self.log.error(f"Error in FixOrientation: {e}")
+            return None
+
+    def start_orientations(self, images):
+        """
+        start_orientation for all photos cropped from one scan, in their order. In scan mode they
+        are oriented one after another in a single task on the CPU pool, most likely to show a
+        face first, so the rotation they agree on is known before the faceless ones are reached.
+        """
+        if not self.fix_orientation or not images:
+            return [None] * len(images)
+        if self.orientation_mode == 'print':
+            return [self.start_orientation(img) for img in images]
+        futures = [Future() for _ in images]
+        try:
+            ModelRegistry.cpu_pool().submit(self.orient_scan, images, futures)
+        except Exception as e:
+            self.log.error(f"Error in FixOrientation: {e}")
+            return [None] * len(images)
+        return futures
+
+    def orient_scan(self, images, futures):
+        orientation = self.orientation
+        scan = ScanOrientation()
+        for index in sorted(range(len(images)), key=lambda i: -FixOrientation.face_likelihood(images[i])):
+            # Photos already saved without a rotation (low confidence dates) are skipped
+            if not futures[index].set_running_or_notify_cancel():
+                continue
+            try:
+                futures[index].set_result(orientation.detect_scan_rotation(images[index], scan))
+            except Exception as e:
+                futures[index].set_exception(e)
+
+    def finish_orientation(self, future, confidence):
+        """
+        Clockwise rotation to apply from a start_orientation future. Photos whose date is not
+        confident enough are left as they are, so the speculative result is discarded.
+        """
+        if future is None:
+            return 0
+        if confidence <= 8:
+            future.cancel()
+            _speculative_orientation_total.inc(result="discarded")
+            return 0
+        try:
+            rotation = future.result()
+        except Exception as e:
+            _speculative_orientation_total.inc(result="failed")
+            self.log.error(f"Error in FixOrientation: {e}")
+            return 0
+        _speculative_orientation_total.inc(result="used")
+        return rotation
 
     def crop_single_scan(self, scan):
-        cropped_images = self.auto_crop.crop_and_straighten(scan)
+        if isinstance(scan, ScanReader):
+            cropped_images = self.auto_crop.crop_and_straighten_tiled(scan, scan.mask_factor(self.worker_memory_bytes()))
+        else:
+            cropped_images = self.auto_crop.crop_and_straighten(scan)
+        self.count_images(len(cropped_images))
+        return cropped_images
+
+    def count_images(self, count):
         with self.lock:
-            self.s.num_images += len(cropped_images)
+            self.s.num_images += count
             if self._batch_progress is not None:
-                self._batch_progress['num_images'] = self.s.num_images
-        return cropped_images
-    
+                self._batch_progress['num_images'] = self._batch_progress.get('num_images', 0) + count
+
+    def worker_memory_bytes(self):
+        return (self.memory_budget_mb or DEFAULT_WORKER_MEMORY_MB) * 1024 ** 2
+
+    def reserve_memory(self, scan_path):
+        """
+        Wait until the memory budget has room for the estimated peak memory of processing this scan.
+        """
+        if self.memory_budget is None:
+            return contextlib.nullcontext()
+
+        if self.crop_images and self.tiled_processing:
+            with ScanReader(scan_path) as reader:
+                estimate = reader.estimate_bytes(reader.mask_factor(self.worker_memory_bytes()))
+        else:
+            width, height = read_image_size(scan_path) or (0, 0)
+            estimate = width * height * (MASK_BYTES_PER_PIXEL if self.crop_images else 6)
+        return self.memory_budget.reserve(estimate)
+
+    @metrics.timed("imgdate_stage_seconds", stage="load_scan")
     def load_scan(self, scan_path):
         image = cv2.imread(scan_path)
         if image is None:
@@ -146,6 +538,7 @@ class ImageOrganizer:
         
         return image
     
+    @metrics.timed("imgdate_stage_seconds", stage="update_metadata_and_save")
     def update_metadata_and_save(self, img, date, filename, original_exif_data):
         """
         Update the image metadata with the extracted date in the format mm/dd/yyyy and save to file.
@@ -155,15 +548,88 @@ class ImageOrganizer:
 
         # Save PIL image to a unique temp file in the destination directory to avoid
         # collisions when multiple batches are processed concurrently.
+        temp_filename = self.make_temp_file(filename)
+        pil_img.save(temp_filename, format="JPEG", quality=95)
+
+        self.write_date_metadata(temp_filename, date, original_exif_data)
+        return self.rename_temp_file(temp_filename, filename)
+
+    @metrics.timed("imgdate_stage_seconds", stage="update_metadata_and_move")
+    def update_metadata_and_move(self, source_path, date, filename, original_exif_data, remove_source=True, rotation=0):
+        """
+        Lossless alternative to update_metadata_and_save for images that are already encoded on disk.
+        The file is copied byte for byte, only its EXIF dates and comment are rewritten, and the source is removed
+        unless remove_source is False. A clockwise rotation is applied as set by rotation_mode.
+        """
+        temp_filename = self.make_temp_file(filename)
+        try:
+            shutil.copyfile(source_path, temp_filename)
+        except OSError as e:
+            self.log.error(f"Failed to copy {source_path} to {temp_filename}: {e}")
+            os.remove(temp_filename)
+            return False
+
+        orientation = self.apply_lossless_rotation(source_path, temp_filename, rotation) if rotation else None
+        self.write_date_metadata(temp_filename, date, original_exif_data, orientation)
+        if not self.rename_temp_file(temp_filename, filename):
+            return False
+
+        if not remove_source:
+            return True
+        try:
+            os.remove(source_path)
+        except OSError as e:
+            self.log.error(f"Saved {filename} but failed to remove {source_path}: {e}")
+        return True
+
+    def apply_lossless_rotation(self, source_path, temp_filename, rotation):
+        """
+        Rotate the copy of source_path in temp_filename without re-encoding it.
+        :return: The EXIF Orientation value to write into the copy.
+        """
+        # The rotation is relative to the photo as displayed, so add it to the rotation the tag already asks for
+        total = (read_exif_rotation(source_path) + rotation) % 360
+        if total and self.rotation_mode == 'lossless' and self.rotate_jpeg_lossless(source_path, temp_filename, total):
+            _rotations_saved_total.inc(method="lossless")
+            return EXIF_ORIENTATIONS[0]
+        _rotations_saved_total.inc(method="exif")
+        return EXIF_ORIENTATIONS[total]
+
+    def rotate_jpeg_lossless(self, source_path, dest_path, rotation):
+        """
+        Rotate the DCT blocks of source_path into dest_path with jpegtran. Returns False if jpegtran is not
+        installed or the image size is not a multiple of the JPEG block size, in which case dest_path is left
+        as a copy of the source.
+        """
+        jpegtran = shutil.which('jpegtran')
+        if not jpegtran:
+            return False
+        result = subprocess.run([jpegtran, '-copy', 'all', '-perfect', '-rotate', str(rotation), '-outfile', dest_path, source_path],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            self.log.warning(f"Lossless rotation of {source_path} not possible, using the EXIF orientation tag: {result.stderr.strip()}")
+            shutil.copyfile(source_path, dest_path)
+            return False
+        return True
+
+    def make_temp_file(self, filename):
+        """
+        Create an empty temp file next to filename so the final rename stays on one filesystem.
+        """
         dest_dir = os.path.dirname(os.path.abspath(filename))
         os.makedirs(dest_dir, exist_ok=True)
         temp_fd, temp_filename = tempfile.mkstemp(suffix='.jpg', dir=dest_dir)
         os.close(temp_fd)
-        pil_img.save(temp_filename, format="JPEG", quality=95)
+        return temp_filename
 
+    def write_date_metadata(self, image_path, date, original_exif_data, orientation=None):
+        """
+        Write the date (mm/dd/yyyy) or the original EXIF dates and a processing comment into image_path,
+        and the EXIF Orientation tag if orientation is given.
+        """
         img_data = None
         try:
-            img_data = pyexiv2.Image(temp_filename)
+            img_data = pyexiv2.Image(image_path)
             # img_data.read_exif()
 
             # get current date and time
@@ -202,6 +668,8 @@ class ImageOrganizer:
             else:
                 img_data.modify_comment(f"Processed Image: {current_date} {current_time}")
                     
+            if orientation is not None:
+                exif_tags['Exif.Image.Orientation'] = str(orientation)
             img_data.modify_exif(exif_tags)
 
             try:
@@ -226,9 +694,13 @@ class ImageOrganizer:
             if img_data:
                 img_data.close()
 
-        # Rename the temporary file to the final filename
+    def rename_temp_file(self, temp_filename, filename):
+        """
+        Rename the temporary file to the final filename. Returns True if the final file exists afterwards.
+        """
         try:
-            os.rename(temp_filename, filename)
+            # Unlike os.rename on Windows, os.replace overwrites the empty file that reserved the name
+            os.replace(temp_filename, filename)
         except FileNotFoundError:
             self.log.error(f"The file {temp_filename} does not exist. Cannot rename to {filename}.")
             return False
@@ -250,59 +722,118 @@ class ImageOrganizer:
         """
         Save the image with the extracted date in the filename and update metadata.
         """
+        return self.write_image(img, date, confidence, original_filename, original_exif_data) is not None
+
+    def write_image(self, img, date, confidence, original_filename, original_exif_data):
+        """
+        save_image, returning the path the image was saved to or None.
+        """
         with self.lock:
             filename = self.generate_filename(date, confidence, original_filename)
-            success = self.update_metadata_and_save(img, date, filename, original_exif_data)
-            if success:
-                self.log.info(f"Saved image to {filename}")
-            else:
-                self.log.error(f"Failed to update metadata or save image: {filename}")
+            try:
+                success = self.update_metadata_and_save(img, date, filename, original_exif_data)
+            except Exception:
+                self.finish_save(filename, False)
+                raise
+            saved = filename if self.finish_save(filename, success) else None
+        self.catalog_photo(saved, date, confidence, original_filename)
+        return saved
+
+    def save_image_file(self, source_path, date, confidence, original_filename, original_exif_data, remove_source=True, rotation=0):
+        """
+        Like save_image, but for an image that is already encoded on disk: the file is moved (or copied) to its
+        new name with only its metadata rewritten, so the JPEG is never decoded or recompressed.
+        """
+        return self.write_image_file(source_path, date, confidence, original_filename, original_exif_data,
+                                     remove_source, rotation) is not None
 
-            self.s.current_image_num += 1
-            if self._batch_progress is not None:
-                self._batch_progress['current_image_num'] = self._batch_progress.get('current_image_num', 0) + 1
-            self.log.info(f"Image {self.s.current_image_num} of {self.s.num_images} processed\n")
-            return success
+    def write_image_file(self, source_path, date, confidence, original_filename, original_exif_data, remove_source=True, rotation=0):
+        """
+        save_image_file, returning the path the image was saved to or None.
+        """
+        with self.lock:
+            filename = self.generate_filename(date, confidence, original_filename)
+            try:
+                success = self.update_metadata_and_move(source_path, date, filename, original_exif_data, remove_source, rotation)
+            except Exception:
+                self.finish_save(filename, False)
+                raise
+            saved = filename if self.finish_save(filename, success) else None
+        if saved and remove_source and self.catalog is not None:
+            # e.g. a reviewed photo moved out of the Failed folder
+            self.catalog.remove(source_path)
+        self.catalog_photo(saved, date, confidence, original_filename)
+        return saved
+
+    def catalog_photo(self, filename, date, confidence, original_filename):
+        if self.catalog is None or filename is None:
+            return
+        started = _scan_started.get()
+        failed = os.path.dirname(os.path.abspath(filename)) == os.path.abspath(self.error_path)
+        try:
+            self.catalog.record(filename, date, confidence, "failed" if failed else "saved", source=original_filename,
+                                batch=self.batch_id, seconds=round(time.perf_counter() - started, 3) if started else None)
+        except Exception as e:
+            self.log.error(f"Could not add {filename} to the catalog: {e}")
+
+    def finish_save(self, filename, success):
+        # Caller must hold self.lock
+        if success:
+            _images_saved_total.inc(result="saved")
+            self.log.info(f"Saved image to {filename}")
+        else:
+            _images_saved_total.inc(result="failed")
+            self.log.error(f"Failed to update metadata or save image: {filename}")
+            self.release_name(filename)
+
+        self.s.current_image_num += 1
+        if self._batch_progress is not None:
+            self._batch_progress['current_image_num'] = self._batch_progress.get('current_image_num', 0) + 1
+        self.log.info(f"Image {self.s.current_image_num} of {self.s.num_images} processed\n")
+        return success
 
 
     def generate_filename(self, date, confidence, original_filename):
         """
-        Generate a filename based on the date and confidence.
+        Generate a filename based on the date and confidence. The name is reserved with an empty
+        file until the image is written over it.
         """
 
         if date is not None:
             formatted_date = date.replace('/', '-')
             if confidence < 9:
+                _low_confidence_total.inc()
                 file_path = os.path.join(self.error_path, f"date_{formatted_date}_confidence-{confidence}.jpg")
                 self.log.warning(f"Low confidence ({confidence}) for date {date}. Saving to failed location")
-                return self.duplicate_check(file_path)
+                return self.duplicate_check(file_path, reserve=True)
 
             if self.sort_images:
                 year, month_name = self.extract_year_month(date)
                 self.ensure_directories_exist(year, month_name)
                 if self.date_images:
                     file_path = os.path.join(self.save_path, year, month_name, f"date_{formatted_date}.jpg")
-                    return self.duplicate_check(file_path)
+                    return self.duplicate_check(file_path, reserve=True)
                 else:
                     filepath = os.path.join(self.save_path, year, month_name, original_filename)
-                    return self.duplicate_check(filepath)
+                    return self.duplicate_check(filepath, reserve=True)
 
             # Not sorting images
             else:
                 if self.date_images:
                     file_path = os.path.join(self.save_path, f"date_{formatted_date}.jpg")
-                    return self.duplicate_check(file_path)
+                    return self.duplicate_check(file_path, reserve=True)
                 else:
                     file_path = os.path.join(self.save_path, original_filename)
-                    return self.duplicate_check(file_path)
+                    return self.duplicate_check(file_path, reserve=True)
         else:
             file_path = os.path.join(self.error_path, "date_not_found.jpg")
-            return self.duplicate_check(file_path)
+            return self.duplicate_check(file_path, reserve=True)
         
-    def  duplicate_check(self, file_path):
+    def  duplicate_check(self, file_path, reserve=False):
         """
         Check if the filename already exists in the save path and adjust the name to avoid overwriting.
         Handles filenames like 'date_02-01-2000.jpg', 'date_07-11-1997_confidence-8.jpg', and 'date_not_found.jpg'.
+        With reserve the name is taken by creating an empty file, see name_taken.
         """
         path, filename = os.path.split(file_path)
         base_name, extension = os.path.splitext(filename)
@@ -320,7 +851,7 @@ class ImageOrganizer:
             new_file_path = os.path.join(path, new_filename)
             
             # Increment the duplicate counter if the file exists
-            while os.path.exists(new_file_path):
+            while self.name_taken(new_file_path, reserve):
                 duplicate += 1
                 new_filename = f"{prefix}{date}{confidence}_{str(duplicate).zfill(2)}{extension}"
                 new_file_path = os.path.join(path, new_filename)
@@ -337,7 +868,7 @@ class ImageOrganizer:
                 new_filename = f"{base_name}_{str(duplicate).zfill(2)}{extension}"
                 new_file_path = os.path.join(path, new_filename)
                 
-            while os.path.exists(new_file_path):
+            while self.name_taken(new_file_path, reserve):
                 duplicate += 1
                 new_filename = f"{base_name}_{str(duplicate).zfill(2)}{extension}"
                 new_file_path = os.path.join(path, new_filename)
@@ -345,6 +876,27 @@ class ImageOrganizer:
                 
         return new_file_path
 
+    def name_taken(self, file_path, reserve=False):
+        """
+        Whether file_path exists. With reserve a free name is taken at once by creating it
+        exclusively, so workers on other hosts saving to the same folder cannot choose it as well.
+        """
+        if not reserve:
+            return os.path.exists(file_path)
+        try:
+            os.close(os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            return False
+        except FileExistsError:
+            return True
+
+    def release_name(self, file_path):
+        # Remove the reservation of a name nothing was saved to
+        try:
+            if os.path.getsize(file_path) == 0:
+                os.remove(file_path)
+        except OSError:
+            pass
+
     def extract_year_month(self, date):
         """
         Extract year and month name from the date.
@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from LoggerConfig import setup_logger
+import Metrics as metrics
+
+_cache_requests_total = metrics.counter("imgdate_cache_requests_total", "Cache lookups, by cache and result")
+
+
+class ImagePrefetcher:
+    """
+    Loads upcoming images on background threads and keeps the results in an LRU cache.
+
+    The loader is any callable taking a path and returning the data to cache for it,
+    so the caller decides what is decoded (and at what size) ahead of time.
+    """
+    def __init__(self, loader, lookahead=5, cache_size=10, max_workers=2):
+        self.loader = loader
+        self.lookahead = lookahead
+        self.cache_size = max(cache_size, lookahead + 1)
+        self.cache = OrderedDict()  # path -> Future
+        self.lock = Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Prefetch")
+        self.log = setup_logger("ImagePrefetcher", "../log/ImgDate.log")
+
+    def _submit(self, path):
+        # Caller must hold self.lock
+        future = self.cache.get(path)
+        if future is None:
+            future = self.executor.submit(self.loader, path)
+            self.cache[path] = future
+        self.cache.move_to_end(path)
+        while len(self.cache) > self.cache_size:
+            _, evicted = self.cache.popitem(last=False)
+            evicted.cancel()
+        return future
+
+    def prefetch(self, paths):
+        """
+        Schedule loading of the given paths (at most lookahead of them) without blocking.
+        """
+        with self.lock:
+            for path in paths[:self.lookahead]:
+                self._submit(path)
+
+    def get(self, path):
+        """
+        Return the loaded data for path, waiting for it if it is still being loaded.
+        """
+        with self.lock:
+            future = self._submit(path)
+        _cache_requests_total.inc(cache="prefetch", result="hit" if future.done() else "miss")
+        return future.result()
+
+    def discard(self, path):
+        with self.lock:
+            future = self.cache.pop(path, None)
+        if future is not None:
+            future.cancel()
+
+    def shutdown(self):
+        with self.lock:
+            for future in self.cache.values():
+                future.cancel()
+            self.cache.clear()
+        self.executor.shutdown(wait=False)
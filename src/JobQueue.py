@@ -0,0 +1,253 @@
+'''
+Queue of scans to process, shared by workers on several hosts through a common filesystem.
+
+There is no broker: every state is a folder and every transition an atomic rename, which NFS and
+SMB shares also guarantee, so exactly one worker wins each job:
+
+    <queue_dir>/pending/<id>.json    waiting to be claimed
+    <queue_dir>/claimed/<id>.json    being processed, with <id>.lease next to it
+    <queue_dir>/done/<id>.json
+    <queue_dir>/failed/<id>.json     failed max_attempts times
+
+A worker touches the leases of its jobs every lease_seconds / 3. A lease that has not been touched
+for lease_seconds (the worker crashed or lost the share) is taken back to pending by whichever
+worker notices it first. Lease ages are measured against the file server's clock, so the hosts'
+clocks do not need to agree. A job may therefore run twice, never zero times.
+
+    import JobQueue
+
+    queue = JobQueue.JobQueue("../img/queue")
+    queue.enqueue("scan_0001.jpg")
+    job = queue.claim()
+    ...
+    queue.complete(job)
+'''
+
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+from LoggerConfig import setup_logger
+import Metrics as metrics
+
+_jobs_total = metrics.counter("imgdate_queue_jobs_total", "Queue job transitions, by transition")
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+
+class JobQueue:
+    def __init__(self, queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.queue_dir = os.path.abspath(queue_dir)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = {}  # Jobs claimed by this process, by id
+        self.lock = Lock()
+        self.last_reap = 0.0
+        self.log = setup_logger("JobQueue", "../log/ImgDate.log")
+        for state in STATES + ('clock',):
+            os.makedirs(os.path.join(self.queue_dir, state), exist_ok=True)
+
+    def path(self, state, job_id, suffix='.json'):
+        return os.path.join(self.queue_dir, state, job_id + suffix)
+
+    @staticmethod
+    def job_id(scan):
+        return hashlib.sha1(scan.encode('utf-8')).hexdigest()[:16]
+
+    def enqueue(self, scan, key=None):
+        """
+        Add a scan, given relative to the workers' scans path. Returns the job id, or None when
+        the job is already queued, being processed or done. Jobs are identified by key (the scan
+        by default), e.g. include the file's size and modification time so a new scan saved
+        under an old name is queued again.
+        """
+        job_id = self.job_id(key or scan)
+        if any(os.path.exists(self.path(state, job_id)) for state in STATES):
+            return None
+        job = {'id': job_id, 'scan': scan, 'attempts': 0, 'enqueued_at': time.time()}
+        try:
+            # O_EXCL so two coordinators queueing the same folder create the job once
+            fd = os.open(self.path('pending', job_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        _jobs_total.inc(transition="enqueued")
+        return job_id
+
+    def claim(self):
+        """
+        Take a pending job, or None when there is none. Jobs whose lease expired are reclaimed first.
+        """
+        self.reap_expired()
+        for name in sorted(os.listdir(os.path.join(self.queue_dir, 'pending'))):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-5]
+            try:
+                os.rename(self.path('pending', job_id), self.path('claimed', job_id))
+            except FileNotFoundError:
+                continue  # Claimed by another worker first
+            self.write_lease(job_id)
+            job = self.read(self.path('claimed', job_id))
+            job['attempts'] += 1
+            job['worker'] = self.worker
+            self.write(self.path('claimed', job_id), job)
+            with self.lock:
+                self.held[job_id] = job
+            _jobs_total.inc(transition="claimed")
+            return job
+        return None
+
+    def complete(self, job):
+        self.finish(job, 'done')
+
+    def fail(self, job, error):
+        """
+        Put a failed job back in pending, or in failed once it has used its attempts.
+        """
+        job['error'] = str(error)
+        self.finish(job, 'failed' if job['attempts'] >= self.max_attempts else 'pending')
+
+    def finish(self, job, state):
+        job_id = job['id']
+        with self.lock:
+            self.held.pop(job_id, None)
+        if not self.holds(job):
+            # The lease expired and another worker took the job back; it is theirs now
+            self.log.warning(f"Job {job_id} ({job['scan']}) was no longer held by {self.worker}")
+            _jobs_total.inc(transition="lost")
+            return
+        if state == 'pending':
+            # Whoever claims it next records themselves
+            job.pop('worker', None)
+        # Written before the rename, since a pending job may be claimed again at once
+        self.write(self.path('claimed', job_id), job)
+        try:
+            os.rename(self.path('claimed', job_id), self.path(state, job_id))
+        except FileNotFoundError:
+            self.log.warning(f"Job {job_id} ({job['scan']}) was no longer held by {self.worker}")
+            _jobs_total.inc(transition="lost")
+            return
+        self.remove_lease(job_id)
+        _jobs_total.inc(transition=state)
+
+    def holds(self, job):
+        """
+        Whether the claimed file of job is still this worker's claim, not a later one of the same
+        job by another worker (or by this one) after the lease expired.
+        """
+        try:
+            current = self.read(self.path('claimed', job['id']))
+        except (FileNotFoundError, ValueError):
+            return False
+        return current.get('worker') == self.worker and current.get('attempts') == job['attempts']
+
+    def write_lease(self, job_id):
+        with open(self.path('claimed', job_id, '.lease'), 'w') as f:
+            f.write(self.worker)
+
+    def remove_lease(self, job_id):
+        try:
+            os.remove(self.path('claimed', job_id, '.lease'))
+        except FileNotFoundError:
+            pass
+
+    def renew_leases(self):
+        with self.lock:
+            held = list(self.held)
+        for job_id in held:
+            try:
+                os.utime(self.path('claimed', job_id, '.lease'))
+            except FileNotFoundError:
+                self.log.warning(f"Lease of job {job_id} is gone, another worker may run it again")
+
+    @contextmanager
+    def heartbeat(self):
+        """
+        Keep the leases of the jobs this process holds alive for the duration of the block.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease_seconds / 3):
+                self.renew_leases()
+
+        thread = threading.Thread(target=beat, name="JobQueueHeartbeat", daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def server_time(self):
+        """
+        Current time on the file server: the modification time of a file this worker just touched.
+        """
+        clock = os.path.join(self.queue_dir, 'clock', self.worker.replace(':', '_'))
+        with open(clock, 'w'):
+            pass
+        return os.stat(clock).st_mtime
+
+    def reap_expired(self):
+        """
+        Move jobs whose lease has not been renewed for lease_seconds back to pending.
+        Checked at most every lease_seconds / 3.
+        """
+        if time.monotonic() - self.last_reap < self.lease_seconds / 3:
+            return
+        self.last_reap = time.monotonic()
+        now = self.server_time()
+        claimed = os.path.join(self.queue_dir, 'claimed')
+        for name in os.listdir(claimed):
+            if not name.endswith('.json'):
+                continue
+            job_id = name[:-5]
+            try:
+                lease = os.stat(self.path('claimed', job_id, '.lease')).st_mtime
+            except FileNotFoundError:
+                # Claimed but the lease was never written: age it by the rename into claimed/
+                try:
+                    lease = os.stat(self.path('claimed', job_id)).st_ctime
+                except FileNotFoundError:
+                    continue
+            if now - lease < self.lease_seconds:
+                continue
+            try:
+                # Cleared so the late finish of the expired holder does not take the job from its next holder
+                job = self.read(self.path('claimed', job_id))
+                job.pop('worker', None)
+                self.write(self.path('claimed', job_id), job)
+                os.rename(self.path('claimed', job_id), self.path('pending', job_id))
+            except (FileNotFoundError, ValueError):
+                continue  # Finished or reaped by someone else in the meantime
+            self.remove_lease(job_id)
+            self.log.warning(f"Lease of job {job_id} expired, moved it back to pending")
+            _jobs_total.inc(transition="expired")
+
+    def counts(self):
+        return {state: sum(name.endswith('.json') for name in os.listdir(os.path.join(self.queue_dir, state)))
+                for state in STATES}
+
+    def drained(self):
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['claimed'] == 0
+
+    @staticmethod
+    def read(path):
+        with open(path) as f:
+            return json.load(f)
+
+    @staticmethod
+    def write(path, job):
+        # Rewritten in place: only the worker holding the job, or the one reaping it, writes it
+        with open(path, 'w') as f:
+            json.dump(job, f)
@@ -1,5 +1,184 @@
+import atexit
+import contextvars
+import datetime
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import socket
+import threading
+import Metrics as metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Records are handed to one writer thread through a bounded queue so a slow disk never blocks the
+# threads doing the work. When the queue is full records are dropped and counted instead.
+QUEUE_SIZE = 10000
+MAX_LOG_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_dropped_total = metrics.counter("imgdate_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+# Identify the batch and image a record belongs to; set with log_context()
+_batch_id = contextvars.ContextVar('batch_id', default=None)
+_image_id = contextvars.ContextVar('image_id', default=None)
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class log_context:
+    """
+    Attach a batch and/or image id to every record logged inside the block.
+    Context variables do not follow work submitted to thread pools, so set it inside the worker.
+    """
+    def __init__(self, batch_id=None, image_id=None):
+        self.values = [(var, value) for var, value in ((_batch_id, batch_id), (_image_id, image_id)) if value is not None]
+        self.tokens = []
+
+    def __enter__(self):
+        self.tokens = [(var, var.set(value)) for var, value in self.values]
+        return self
+
+    def __exit__(self, *exc_info):
+        for var, token in reversed(self.tokens):
+            var.reset(token)
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'logger': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        if getattr(record, 'batch_id', None):
+            entry['batch_id'] = record.batch_id
+        if getattr(record, 'image_id', None):
+            entry['image_id'] = record.image_id
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Tags records with their log file and context ids, and never blocks when the queue is full.
+    """
+    def __init__(self, log_queue, log_file):
+        super().__init__(log_queue)
+        self.log_file = log_file
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.log_file = self.log_file
+        record.batch_id = _batch_id.get()
+        record.image_id = _image_id.get()
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped_total.inc()
+
+
+class _RoutingHandler(logging.Handler):
+    """
+    Runs on the writer thread: sends each record to the rotating file of its logger and to stderr.
+    Each process rotates only a file it has to itself, see claim.
+    """
+    def __init__(self):
+        super().__init__()
+        self.file_handlers = {}
+        self.lock_files = []
+        self.stream_handler = logging.StreamHandler()
+        self.reported_drops = 0
+
+    def file_handler(self, log_file):
+        handler = self.file_handlers.get(log_file)
+        if handler is None:
+            log_dir = os.path.dirname(log_file)
+            if log_dir:
+                os.makedirs(log_dir, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(self.claim(log_file), maxBytes=MAX_LOG_BYTES,
+                                                           backupCount=BACKUP_COUNT, encoding='utf-8')
+            # LOG_FORMAT=text keeps the classic line format instead of one JSON object per line
+            if os.getenv('LOG_FORMAT', 'json') == 'text':
+                handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+            else:
+                handler.setFormatter(JsonFormatter())
+            self.file_handlers[log_file] = handler
+        return handler
+
+    def claim(self, log_file):
+        """
+        log_file if no other process is writing it, otherwise a file of this process next to it
+        (ImgDate-<host>-<pid>.log), since rotating a file shared by processes loses records.
+        The lock is released when the process exits.
+        """
+        if fcntl is None:
+            return log_file
+        lock_file = open(f"{log_file}.lock", 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            base, extension = os.path.splitext(log_file)
+            return f"{base}-{socket.gethostname()}-{os.getpid()}{extension}"
+        self.lock_files.append(lock_file)
+        return log_file
+
+    def emit(self, record):
+        handler = self.file_handler(record.log_file)
+        dropped = _dropped_total.get()
+        if dropped > self.reported_drops:
+            warning = logging.LogRecord("LoggerConfig", logging.WARNING, __file__, 0,
+                                        f"Dropped {dropped - self.reported_drops} log records because the log queue was full",
+                                        None, None)
+            handler.handle(warning)
+            self.reported_drops = dropped
+        handler.handle(record)
+        self.stream_handler.handle(record)
+
+    def close(self):
+        for handler in self.file_handlers.values():
+            handler.close()
+        for lock_file in self.lock_files:
+            lock_file.close()
+        super().close()
+
+
+def _start_listener():
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = logging.handlers.QueueListener(_queue, _RoutingHandler())
+            _listener.start()
+            atexit.register(stop_logging)
+
+
+def stop_logging():
+    """
+    Flush every queued record and stop the writer thread.
+    """
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            try:
+                _listener.stop()
+            except queue.Full:
+                pass
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
 
 def setup_logger(name, log_file, level=logging.INFO):
     """Function to setup as many loggers as you want"""
@@ -9,15 +188,7 @@ def setup_logger(name, log_file, level=logging.INFO):
 
     # Check if the logger already has handlers to prevent duplication
     if not logger.hasHandlers():
-        log_dir = os.path.dirname(log_file)
-        if log_dir:
-            os.makedirs(log_dir, exist_ok=True)
-        handler = logging.FileHandler(log_file, encoding='utf-8')
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        handler.setFormatter(formatter)
-        logger.addHandler(handler)
-
-        stream_handler = logging.StreamHandler()
-        logger.addHandler(stream_handler)
+        _start_listener()
+        logger.addHandler(_QueueHandler(_queue, os.path.abspath(log_file)))
 
     return logger
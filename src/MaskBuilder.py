@@ -0,0 +1,76 @@
+import threading
+import cv2
+import numpy as np
+
+
+class MaskBuilder:
+    """
+    Builds the AutoCrop segmentation mask into scratch buffers that are allocated once per thread
+    and reused for every scan of the same size, so a batch of scans does not allocate a new set
+    of full size arrays per scan.
+    """
+    def __init__(self, block_size=11, c=2, white_threshold=200, kernel_size=5, iterations=2):
+        self.block_size = block_size
+        self.c = c
+        self.lower_white = np.array([white_threshold] * 3, dtype=np.uint8)
+        self.upper_white = np.array([255, 255, 255], dtype=np.uint8)
+        self.kernel = np.ones((kernel_size, kernel_size), np.uint8)
+        self.iterations = iterations
+        self.local = threading.local()
+
+    def scratch(self, height, width):
+        """
+        Per thread buffers for an image of the given size, reallocated only when the size changes.
+        """
+        buffers = getattr(self.local, 'buffers', None)
+        if buffers is None or buffers[0].shape != (height, width):
+            buffers = tuple(np.empty((height, width), dtype=np.uint8) for _ in range(3))
+            self.local.buffers = buffers
+        return buffers
+
+    def build(self, image, out=None):
+        """
+        Mask of the photos on a BGR scan. Written into out if given, otherwise into a scratch
+        buffer that is only valid until the next call on the same thread.
+        """
+        height, width = image.shape[:2]
+        gray, thresh, white = self.scratch(height, width)
+
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+
+        # Adaptive thresholding to handle varying lighting conditions
+        cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV,
+                              self.block_size, self.c, dst=thresh)
+
+        # Remove near white areas; both masks are 0 or 255 so a saturating subtract is "thresh and not white"
+        cv2.inRange(image, self.lower_white, self.upper_white, dst=white)
+        cv2.subtract(thresh, white, dst=thresh)
+
+        # Clean up the mask, reusing the gray buffer when there is no output array
+        if out is None:
+            out = gray
+        cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, self.kernel, dst=out, iterations=self.iterations)
+        return out
+
+    def build_batch(self, images):
+        """
+        Masks of several scans of the same size, as one (n, height, width) array.
+        """
+        if not images:
+            return np.empty((0, 0, 0), dtype=np.uint8)
+        height, width = images[0].shape[:2]
+        masks = np.empty((len(images), height, width), dtype=np.uint8)
+        for image, mask in zip(images, masks):
+            if image.shape[:2] != (height, width):
+                raise ValueError(f"All scans in a batch must be {width}x{height}, got {image.shape[1]}x{image.shape[0]}")
+            self.build(image, out=mask)
+        return masks
+
+
+def content_ratio(image, white_level=240):
+    """
+    Fraction of pixels darker than white_level, counted without a full size boolean temporary.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    cv2.threshold(gray, white_level - 1, 255, cv2.THRESH_BINARY_INV, dst=gray)
+    return cv2.countNonZero(gray) / (gray.shape[0] * gray.shape[1])
@@ -0,0 +1,259 @@
+'''
+Process-wide counters, gauges and timing histograms.
+
+Usage:
+    import Metrics as metrics
+
+    metrics.counter("imgdate_api_retries_total", "Retried vision API requests").inc()
+
+    with metrics.timed("imgdate_stage_seconds", stage="load_scan"):
+        ...
+
+    @metrics.timed("imgdate_stage_seconds", stage="read_date")
+    def read_date(...):
+        ...
+
+render_prometheus() returns every metric in the Prometheus text format and summary_table()
+a human readable table for the end of a run.
+'''
+
+import functools
+import random
+import time
+from threading import Lock
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RESERVOIR_SIZE = 1024  # Samples kept per label set to estimate percentiles for the summary table
+
+_metrics = {}
+_lock = Lock()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in items) + "}"
+
+
+class Counter:
+    type_name = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self.lock = Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_label_key(labels), 0)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label key -> {'counts', 'sum', 'count', 'max', 'reservoir'}
+        self.lock = Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0, 'max': 0.0, 'reservoir': []}
+                self.series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+            series['max'] = max(series['max'], value)
+
+            # Reservoir sampling keeps a uniform sample of every observation for percentiles
+            reservoir = series['reservoir']
+            if len(reservoir) < RESERVOIR_SIZE:
+                reservoir.append(value)
+            else:
+                slot = random.randrange(series['count'])
+                if slot < RESERVOIR_SIZE:
+                    reservoir[slot] = value
+
+    def percentile(self, percent, **labels):
+        series = self.series.get(_label_key(labels))
+        if not series or not series['reservoir']:
+            return None
+        values = sorted(series['reservoir'])
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['counts']):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, cumulative, (('le', bound),)))
+                samples.append((f"{self.name}_bucket", key, series['count'], (('le', '+Inf'),)))
+                samples.append((f"{self.name}_sum", key, series['sum']))
+                samples.append((f"{self.name}_count", key, series['count']))
+        return samples
+
+
+def _get_or_create(cls, name, help_text, **kwargs):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = cls(name, help_text, **kwargs)
+            _metrics[name] = metric
+        elif type(metric) is not cls:
+            raise ValueError(f"Metric {name} already registered as a {metric.type_name}")
+        return metric
+
+
+def counter(name, help_text=""):
+    return _get_or_create(Counter, name, help_text)
+
+
+def gauge(name, help_text=""):
+    return _get_or_create(Gauge, name, help_text)
+
+
+def histogram(name, help_text="", buckets=DEFAULT_BUCKETS):
+    return _get_or_create(Histogram, name, help_text, buckets=buckets)
+
+
+class timed:
+    """
+    Record the duration of a block or function call (in seconds) into a histogram.
+    Works as a context manager or as a decorator.
+    """
+    def __init__(self, name, help_text="Duration in seconds", **labels):
+        self.metric = histogram(name, help_text)
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+    def __call__(self, func):
+        metric, labels = self.metric, self.labels
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metric.observe(time.perf_counter() - start, **labels)
+        return wrapper
+
+
+def reset():
+    """
+    Forget every recorded value (metrics stay registered).
+    """
+    with _lock:
+        for metric in _metrics.values():
+            with metric.lock:
+                if isinstance(metric, Histogram):
+                    metric.series.clear()
+                else:
+                    metric.values.clear()
+
+
+def snapshot():
+    """
+    Current counter and gauge values as a dict of "name{labels}" -> value.
+    """
+    values = {}
+    with _lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        if isinstance(metric, Counter):
+            for name, key, value in metric.samples():
+                values[name + _format_labels(key)] = value
+    return values
+
+
+def render_prometheus():
+    """
+    All metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+    for metric in metrics:
+        if metric.help:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        for sample in metric.samples():
+            name, key, value = sample[:3]
+            extra = sample[3] if len(sample) > 3 else ()
+            lines.append(f"{name}{_format_labels(key, extra)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary_table():
+    """
+    Human readable table of every histogram (count, mean, p50, p90, max in ms) and counter.
+    """
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+
+    lines = [f"{'timer':<50}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'max ms':>10}"]
+    for metric in metrics:
+        if not isinstance(metric, Histogram):
+            continue
+        for key, series in sorted(metric.series.items()):
+            labels = dict(key)
+            mean = series['sum'] / series['count'] * 1000 if series['count'] else 0
+            p50 = (metric.percentile(50, **labels) or 0) * 1000
+            p90 = (metric.percentile(90, **labels) or 0) * 1000
+            lines.append(f"{metric.name + _format_labels(key):<50}{series['count']:>8}{mean:>10.1f}{p50:>10.1f}{p90:>10.1f}{series['max'] * 1000:>10.1f}")
+
+    counters = snapshot()
+    if counters:
+        lines.append("")
+        lines.append(f"{'counter':<50}{'value':>8}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<50}{value:>8g}")
+    return "\n".join(lines)
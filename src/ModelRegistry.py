@@ -0,0 +1,139 @@
+'''
+Process-wide models and clients, loaded once and shared by every ImageOrganizer.
+
+Each resource is created on first use under its own lock, so concurrent batches wait for one
+load instead of each doing their own, and nothing is loaded that a command does not use
+(e.g. "main.py edit" never loads dlib). Servers call warm() at start so the first batch does not
+pay for the loading:
+
+    import ModelRegistry
+
+    orientation = ModelRegistry.fix_orientation()
+    session = ModelRegistry.http_session()
+'''
+
+import os
+import time
+from threading import Lock
+import Metrics as metrics
+from LoggerConfig import setup_logger
+
+_load_seconds = metrics.gauge("imgdate_model_load_seconds", "Seconds it took to load each shared model or client")
+
+ENV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '.env')
+
+
+class LazyResource:
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+        self.value = None
+        self.lock = Lock()
+
+    @property
+    def loaded(self):
+        return self.value is not None
+
+    def get(self):
+        # Checked once without the lock so loaded resources cost no locking
+        if self.value is None:
+            with self.lock:
+                if self.value is None:
+                    start = time.perf_counter()
+                    self.value = self.factory()
+                    elapsed = time.perf_counter() - start
+                    _load_seconds.set(round(elapsed, 3), model=self.name)
+                    setup_logger("ModelRegistry", "../log/ImgDate.log").info(f"Loaded {self.name} in {elapsed:.2f} seconds")
+        return self.value
+
+
+def _load_env():
+    """
+    Read .env into the environment. Variables that are already set are kept, so a run can
+    override them (the benchmarks point OPENAI_API_URL at a local stub).
+    """
+    from dotenv import load_dotenv
+    if not os.path.isfile(ENV_PATH) and not os.getenv('OPENAI_API_KEY'):
+        raise Exception(f".env file not found. Expected at: {os.path.abspath(ENV_PATH)}")
+    load_dotenv(ENV_PATH)
+    return True
+
+
+def _make_session():
+    """
+    Keep-alive HTTP session for the vision API, with a connection pool large enough for the
+    most requests the concurrency controller lets through at once.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from ConcurrencyController import DEFAULT_MAX_LIMIT
+
+    load_env()
+    pool_size = int(os.getenv('API_MAX_CONCURRENCY', DEFAULT_MAX_LIMIT))
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+def _make_fix_orientation():
+    from FixOrientation import FixOrientation
+    return FixOrientation()
+
+
+def _make_cpu_pool():
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="CPU")
+
+
+def _make_mask_builder():
+    from MaskBuilder import MaskBuilder
+    return MaskBuilder()
+
+
+_env = LazyResource("env", _load_env)
+_session = LazyResource("http_session", _make_session)
+_fix_orientation = LazyResource("fix_orientation", _make_fix_orientation)
+_mask_builder = LazyResource("mask_builder", _make_mask_builder)
+_cpu_pool = LazyResource("cpu_pool", _make_cpu_pool)
+
+
+def load_env():
+    return _env.get()
+
+
+def http_session():
+    return _session.get()
+
+
+def fix_orientation():
+    """
+    The dlib face detector and landmark model. Shared by all threads, like the single instance
+    an ImageOrganizer used to hand to all of its workers.
+    """
+    return _fix_orientation.get()
+
+
+def mask_builder():
+    return _mask_builder.get()
+
+
+def cpu_pool():
+    """
+    Thread pool sized to the CPUs for work that overlaps with waiting on the network,
+    e.g. detecting the orientation of a photo while its date is being read.
+    """
+    return _cpu_pool.get()
+
+
+def warm(orientation=True):
+    """
+    Load everything a batch needs. Returns the seconds each resource took, 0 for ones already loaded.
+    """
+    resources = [_env, _session, _mask_builder] + ([_fix_orientation] if orientation else [])
+    timings = {}
+    for resource in resources:
+        start = time.perf_counter()
+        resource.get()
+        timings[resource.name] = round(time.perf_counter() - start, 3)
+    return timings
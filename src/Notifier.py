@@ -0,0 +1,170 @@
+'''
+Background notification dispatcher.
+
+Notifications are queued and sent from a single worker thread so a slow endpoint
+never blocks the caller. Bursts of notifications that arrive within the coalesce
+window are merged into one summary message.
+'''
+
+import json
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+import requests
+from LoggerConfig import setup_logger
+
+DEFAULT_WEBHOOK_URL = "https://trigger.macrodroid.com"
+
+
+class WebhookSink:
+    """
+    Sends notifications to a MacroDroid style webhook as GET-style query parameters on a POST.
+    """
+    def __init__(self, webhook, base_url=DEFAULT_WEBHOOK_URL, timeout=10):
+        self.url = f"{base_url.rstrip('/')}/{webhook}/universal"
+        self.timeout = timeout
+
+    def send(self, title, message):
+        response = requests.post(self.url, params={'title': title, 'message': message}, timeout=self.timeout)
+        response.raise_for_status()
+
+
+class FileSink:
+    """
+    Appends notifications as JSON lines to a local file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, title, message):
+        record = {'time': datetime.now().isoformat(), 'title': title, 'message': message}
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + "\n")
+
+
+class StdoutSink:
+    """
+    Prints notifications to stdout.
+    """
+    def send(self, title, message):
+        print(f"[{title}] {message}", file=sys.stdout, flush=True)
+
+
+def create_sink(spec, webhook=None, base_url=DEFAULT_WEBHOOK_URL, timeout=10):
+    """
+    Build a sink from a spec string: "webhook", "file:<path>" or "stdout".
+    """
+    spec = (spec or "webhook").strip()
+    if spec == "stdout":
+        return StdoutSink()
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec == "webhook":
+        if not webhook:
+            raise ValueError("Webhook sink requires a WEBHOOK id.")
+        return WebhookSink(webhook, base_url=base_url, timeout=timeout)
+    raise ValueError(f"Unknown notification sink: {spec}")
+
+
+class Notifier:
+    def __init__(self, sink, coalesce_window=5, min_interval=2, retries=3, max_queue=100):
+        """
+        :param sink: Object with a send(title, message) method.
+        :param coalesce_window: Seconds to wait for more notifications before sending a burst as one summary.
+        :param min_interval: Minimum seconds between two sends to the sink.
+        :param retries: Attempts per message before it is dropped.
+        :param max_queue: Notifications beyond this many pending are dropped.
+        """
+        self.sink = sink
+        self.coalesce_window = coalesce_window
+        self.min_interval = min_interval
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.last_send_time = 0
+        self.log = setup_logger("Notifier", "../log/ImgDate.log")
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="Notifier", daemon=True)
+        self._thread.start()
+
+    def notify(self, title, message):
+        """
+        Queue a notification. Never blocks.
+        """
+        try:
+            self.queue.put_nowait((title, message))
+        except queue.Full:
+            self.dropped += 1
+            self.log.warning(f"Notification queue full, dropped: {title}")
+
+    def flush(self, timeout=None):
+        """
+        Block until every queued notification has been handled or the timeout expires.
+        Returns True if the queue was drained.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=30):
+        self.flush(timeout)
+        self._stop.set()
+        self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.time() + self.coalesce_window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                title, message = self.coalesce(batch)
+                self._send_with_retry(title, message)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    @staticmethod
+    def coalesce(batch):
+        """
+        Merge a list of (title, message) pairs into one notification.
+        """
+        if len(batch) == 1:
+            return batch[0]
+        title = f"{len(batch)} notifications: {batch[-1][0]}"
+        message = "\n\n".join(f"{t}\n{m}" for t, m in batch)
+        return title, message
+
+    def _send_with_retry(self, title, message):
+        for attempt in range(self.retries):
+            wait = self.min_interval - (time.time() - self.last_send_time)
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.last_send_time = time.time()
+                self.sink.send(title, message)
+                self.log.info(f"Notification sent: {title}")
+                return True
+            except Exception as e:
+                self.log.error(f"Failed to send notification (attempt {attempt + 1}/{self.retries}): {e}")
+                if attempt < self.retries - 1:
+                    time.sleep(2 ** attempt)
+        return False
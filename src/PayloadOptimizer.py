@@ -0,0 +1,170 @@
+import base64
+import cv2
+import Metrics as metrics
+
+_payload_bytes = metrics.histogram("imgdate_payload_bytes", "Encoded size of the date crop sent to the vision API, by format",
+                                   buckets=(2048, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576))
+_stamp_located_total = metrics.counter("imgdate_stamp_located_total", "Date crops by whether the stamp was localised in the corner")
+
+# With "detail": "low" the model only sees a 512x512 version of the image, so anything larger is
+# uploaded just to be downsampled on the other end.
+LOW_DETAIL_SIZE = 512
+# With "detail": "high" images are fitted into 2048x2048 before tiling
+HIGH_DETAIL_SIZE = 2048
+
+# PNG is only tried for crops up to this many pixels, e.g. a stamp cut out of the corner. For a
+# whole photo corner it costs hundreds of milliseconds of CPU and is always larger than the JPEG.
+PNG_MAX_PIXELS = 256 * 128
+PNG_COMPRESSION = 3  # Fast level; 9 is several times slower for a few percent
+
+# A date stamp is one line of at least six dot-matrix characters, so it is much wider than tall
+MIN_STAMP_ASPECT = 4.0
+MIN_STAMP_FILL = 0.2        # Stamp pixels per square of the line height
+MAX_STAMP_HEIGHT = 0.3      # Share of the corner height
+STAMP_CONTRAST = 40         # Minimum brightness and warmth above the local background
+# Saturated orange in OpenCV HSV (hue 0-180), the usual imprint colour
+ORANGE_LOW, ORANGE_HIGH = (5, 100, 120), (25, 255, 255)
+
+
+class PayloadOptimizer:
+    """
+    Turns the corner of a photo into the smallest image that still shows the date stamp:
+    the crop is scaled down to what the model looks at, optionally has its orange dots enhanced,
+    and is encoded as JPEG (or PNG when that is smaller for a tiny crop). With localize the stamp
+    is also cut out of the corner; off by default until bench_payload.py --live shows it reads
+    as many dates correctly as the whole corner.
+    """
+    def __init__(self, max_side=LOW_DETAIL_SIZE, jpeg_quality=80, localize=False, enhance=False):
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.localize = localize
+        self.enhance = enhance
+
+    def stamp_mask(self, corner):
+        """
+        Pixels that are warmer (red minus blue) than their surroundings, or brighter and at least
+        somewhat warm. Film date imprints are orange or, when overexposed, a pale pink, and sit on
+        any background.
+        """
+        height = corner.shape[0]
+        size = max(3, (height // 10) | 1)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+        blue, _, red = cv2.split(corner)
+        warmth = cv2.subtract(red, blue)
+        gray = cv2.cvtColor(corner, cv2.COLOR_BGR2GRAY)
+
+        # Top-hat keeps only features smaller than the kernel, i.e. dots and strokes, not warm scenery
+        warm_detail = cv2.morphologyEx(warmth, cv2.MORPH_TOPHAT, kernel)
+        bright_detail = cv2.morphologyEx(gray, cv2.MORPH_TOPHAT, kernel)
+        _, warm_detail = cv2.threshold(warm_detail, STAMP_CONTRAST, 255, cv2.THRESH_BINARY)
+        _, bright_detail = cv2.threshold(bright_detail, STAMP_CONTRAST, 255, cv2.THRESH_BINARY)
+
+        # Warm details are only kept when they are also bright or saturated orange, not e.g.
+        # the edge of a pink object; pale stamps on blue sky are barely warm but stand out by brightness
+        hsv = cv2.cvtColor(corner, cv2.COLOR_BGR2HSV)
+        orange = cv2.inRange(hsv, ORANGE_LOW, ORANGE_HIGH)
+        mask = cv2.bitwise_and(warm_detail, cv2.bitwise_or(orange, bright_detail, dst=orange))
+        pale = cv2.bitwise_and(bright_detail, cv2.inRange(warmth, 1, 255))
+        return cv2.bitwise_or(mask, pale, dst=mask), size
+
+    def locate_stamp(self, corner):
+        """
+        Bounding box (x, y, w, h) of the date stamp within the corner, or None if no line of
+        stamp-like characters is found.
+        """
+        mask, size = self.stamp_mask(corner)
+        corner_height = corner.shape[0]
+
+        # Join the dots of each character, then read the characters off as components
+        characters = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (size, max(3, size // 3))))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(characters)
+        groups = []
+        for x, y, w, h, _ in stats[1:count]:
+            dots = cv2.countNonZero(mask[y:y + h, x:x + w])
+            if dots and h <= corner_height * MAX_STAMP_HEIGHT:
+                groups.append((dots, x, y, w, h))
+        groups.sort(reverse=True)
+
+        # Grow a line from each of the strongest groups and keep the first that looks like a date
+        for dots, x, y, w, h in groups[:5]:
+            line = [x, y, x + w, y + h]
+            total = dots
+            for other_dots, ox, oy, ow, oh in groups:
+                center = oy + oh / 2
+                if (ox, oy) != (x, y) and y <= center <= y + h and 0.5 * h <= oh <= 2 * h:
+                    # Only characters within a few line heights of the line so far
+                    if ox <= line[2] + 3 * h and ox + ow >= line[0] - 3 * h:
+                        line = [min(line[0], ox), min(line[1], oy), max(line[2], ox + ow), max(line[3], oy + oh)]
+                        total += other_dots
+            line_width, line_height = line[2] - line[0], line[3] - line[1]
+            if line_width >= MIN_STAMP_ASPECT * line_height and total >= MIN_STAMP_FILL * line_height ** 2:
+                return line[0], line[1], line_width, line_height
+        return None
+
+    def crop_stamp(self, corner):
+        """
+        The stamp with a margin of half its height above and below and two heights to the sides,
+        so characters the mask missed (e.g. on a background of the same colour) are still included.
+        Falls back to the whole corner when no stamp is found.
+        """
+        box = self.locate_stamp(corner) if self.localize else None
+        _stamp_located_total.inc(result="found" if box else "corner")
+        if box is None:
+            return corner
+        x, y, w, h = box
+        corner_height, corner_width = corner.shape[:2]
+        return corner[max(0, y - h // 2):min(corner_height, y + h + h // 2),
+                      max(0, x - 2 * h):min(corner_width, x + w + 2 * h)]
+
+    def resize(self, image):
+        height, width = image.shape[:2]
+        scale = self.max_side / max(height, width)
+        if scale >= 1:
+            return image
+        return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+    def enhance_orange(self, image):
+        """
+        Push warm details further towards orange: add their warmth to red and take it from blue.
+        """
+        blue, green, red = cv2.split(image)
+        warmth = cv2.subtract(red, blue)
+        size = max(3, (image.shape[0] // 6) | 1)
+        detail = cv2.morphologyEx(warmth, cv2.MORPH_TOPHAT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+        return cv2.merge((cv2.subtract(blue, detail), green, cv2.add(red, detail)))
+
+    def encode(self, image):
+        """
+        Encode as JPEG at the configured quality. Crops of up to PNG_MAX_PIXELS are also encoded
+        as PNG, and the smaller is kept.
+
+        :return: (mime type, encoded bytes)
+        """
+        candidates = []
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if ok:
+            candidates.append(('image/jpeg', jpeg))
+        if image.shape[0] * image.shape[1] <= PNG_MAX_PIXELS or not candidates:
+            ok, png = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+            if ok:
+                candidates.append(('image/png', png))
+        mime, buffer = min(candidates, key=lambda candidate: candidate[1].size)
+        _payload_bytes.observe(buffer.size, format=mime.split('/')[1])
+        return mime, buffer.tobytes()
+
+    def optimize(self, corner):
+        """
+        Smallest encoding of the date stamp in the corner.
+
+        :return: (mime type, encoded bytes)
+        """
+        image = self.resize(self.crop_stamp(corner))
+        if self.enhance:
+            image = self.enhance_orange(image)
+        return self.encode(image)
+
+    def data_url(self, corner):
+        mime, data = self.optimize(corner)
+        return f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+
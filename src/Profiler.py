@@ -0,0 +1,195 @@
+'''
+Opt-in profiling of a run.
+
+profile_run is a context manager that samples the stacks of every thread (the pipeline does its
+work on ThreadPoolExecutor threads, which cProfile does not follow) and records tracemalloc
+statistics. Nothing is started unless it is used, so there is no overhead when profiling is off.
+Both cover the whole process, so runs that overlap (e.g. profiled batches of concurrent web
+workers) share their samples; the reports say when that happened.
+
+    with profile_run(output_dir, "organize"):
+        image_organizer.process_images()
+
+Writes to output_dir:
+    <label>_hotpath.txt      top functions overall and in the pipeline modules
+    <label>_stacks.txt       collapsed stacks, usable with flamegraph.pl or speedscope
+    <label>_memory.txt       top allocation sites and peak traced memory
+    <label>_memory.snapshot  tracemalloc snapshot for later analysis
+'''
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from LoggerConfig import setup_logger
+
+# tracemalloc is process wide, so overlapping runs (e.g. profiled batches of the web workers) share
+# it; it is stopped when the last of them ends, if one of them started it
+_profiles_lock = threading.Lock()
+_active_profiles = 0
+_profiles_started = 0
+_started_tracemalloc = False
+
+# Modules named in the hot-path report
+HOT_PATH_MODULES = ('AutoCrop.py', 'FixOrientation.py', 'ImageOrganizer.py', 'DateExtractor.py')
+
+# Leaf functions where a thread is idle rather than working
+IDLE_FUNCTIONS = {
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('selectors.py', 'select'),
+    ('socketserver.py', 'serve_forever'),
+    ('thread.py', '_worker'),
+}
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.self_counts = {}        # function -> samples where it was running
+        self.cumulative_counts = {}  # function -> samples where it was on the stack
+        self.stacks = {}             # "outer;...;inner" -> samples
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="SamplingProfiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self._record(frame)
+
+    def _record(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+
+        leaf = stack[0]
+        if (leaf[0], leaf[1]) in IDLE_FUNCTIONS:
+            return
+
+        self.samples += 1
+        self.self_counts[leaf] = self.self_counts.get(leaf, 0) + 1
+        for function in set(stack):
+            self.cumulative_counts[function] = self.cumulative_counts.get(function, 0) + 1
+        collapsed = ";".join(f"{name} ({filename}:{line})" for filename, name, line in reversed(stack))
+        self.stacks[collapsed] = self.stacks.get(collapsed, 0) + 1
+
+    def report(self, top=25):
+        def table(title, counts, modules=None):
+            rows = [(count, function) for function, count in counts.items() if not modules or function[0] in modules]
+            rows.sort(reverse=True)
+            lines = [title, f"{'samples':>8} {'%':>6}  function"]
+            for count, (filename, name, line) in rows[:top]:
+                percent = count / self.samples * 100 if self.samples else 0
+                lines.append(f"{count:>8} {percent:>6.1f}  {name} ({filename}:{line})")
+            return "\n".join(lines)
+
+        return "\n\n".join([
+            f"{self.samples} busy samples every {self.interval * 1000:.0f} ms",
+            table("Hot path in the pipeline modules (cumulative)", self.cumulative_counts, HOT_PATH_MODULES),
+            table("Hot path in the pipeline modules (self)", self.self_counts, HOT_PATH_MODULES),
+            table("Top functions overall (self)", self.self_counts),
+            table("Top functions overall (cumulative)", self.cumulative_counts),
+        ]) + "\n"
+
+
+class profile_run:
+    def __init__(self, output_dir, label="profile", interval=0.005, memory_frames=10):
+        self.output_dir = output_dir
+        self.label = label
+        self.memory_frames = memory_frames
+        self.profiler = SamplingProfiler(interval)
+        self.log = setup_logger("Profiler", "../log/ImgDate.log")
+        self.start_time = None
+
+    def __enter__(self):
+        global _active_profiles, _profiles_started, _started_tracemalloc
+        self.log.info(f"Profiling run '{self.label}'")
+        with _profiles_lock:
+            if _active_profiles == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.memory_frames)
+                _started_tracemalloc = True
+            _active_profiles += 1
+            _profiles_started += 1
+            self.overlapped = _active_profiles > 1
+            self.started_index = _profiles_started
+        self.start_time = time.perf_counter()
+        self.profiler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active_profiles, _started_tracemalloc
+        self.profiler.stop()
+        elapsed = time.perf_counter() - self.start_time
+        try:
+            with _profiles_lock:
+                # Runs started after this one overlapped it even if they have ended since
+                self.overlapped = self.overlapped or _active_profiles > 1 or _profiles_started != self.started_index
+                snapshot, current, peak = None, 0, 0
+                if tracemalloc.is_tracing():
+                    snapshot = tracemalloc.take_snapshot()
+                    current, peak = tracemalloc.get_traced_memory()
+            self.write(snapshot, current, peak, elapsed)
+        except Exception as e:
+            self.log.error(f"Failed to write profile for '{self.label}': {e}")
+        finally:
+            with _profiles_lock:
+                _active_profiles -= 1
+                if _active_profiles == 0 and _started_tracemalloc:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                    _started_tracemalloc = False
+        return False
+
+    def write(self, snapshot, current, peak, elapsed):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, self.label)
+
+        with open(f"{base}_hotpath.txt", "w", encoding="utf-8") as f:
+            f.write(f"Run '{self.label}' took {elapsed:.2f} seconds\n")
+            if self.overlapped:
+                # The sampler sees every thread of the process, not only the ones of this run
+                f.write("Other profiled runs overlapped this one; their samples are mixed into this report\n")
+            f.write("\n")
+            f.write(self.profiler.report())
+
+        with open(f"{base}_stacks.txt", "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.profiler.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+        if snapshot is None:
+            with open(f"{base}_memory.txt", "w", encoding="utf-8") as f:
+                f.write("tracemalloc was stopped outside the profiler, no memory statistics\n")
+            self.log.info(f"Profile for '{self.label}' written to {self.output_dir}")
+            return
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        with open(f"{base}_memory.txt", "w", encoding="utf-8") as f:
+            f.write(f"Traced memory: current {current / 1024 ** 2:.1f} MB, peak {peak / 1024 ** 2:.1f} MB\n")
+            if self.overlapped:
+                f.write("Other profiled runs overlapped this one; the memory figures are for the whole process\n")
+            f.write("\n")
+            f.write("Top allocation sites still alive at the end of the run:\n")
+            for stat in snapshot.statistics('lineno')[:25]:
+                f.write(f"{stat}\n")
+        snapshot.dump(f"{base}_memory.snapshot")
+
+        self.log.info(f"Profile for '{self.label}' written to {self.output_dir}")
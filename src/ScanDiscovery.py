@@ -0,0 +1,79 @@
+import heapq
+import os
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
+# Leading bytes of the formats above, so renamed or truncated non-image files are skipped
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',        # JPEG
+    b'\x89PNG\r\n\x1a\n',   # PNG
+    b'II*\x00',             # TIFF, little endian
+    b'MM\x00*',             # TIFF, big endian
+    b'BM',                  # BMP
+)
+
+
+def has_image_signature(path):
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(8)
+    except OSError:
+        return False
+    return header.startswith(IMAGE_SIGNATURES)
+
+
+def _iter_entries(directory, extensions, recursive, exclude):
+    """
+    Depth first walk with os.scandir yielding (path, size) of every file with a matching extension,
+    in directory order. Only the directories still to visit are kept in memory, never the listing of
+    the files, so the first file comes at once even from a very large flat folder.
+    """
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                subdirectories = []
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and os.path.abspath(entry.path) not in exclude:
+                                subdirectories.append(entry.path)
+                        elif entry.is_file() and entry.name.lower().endswith(extensions):
+                            yield entry.path, entry.stat().st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        # Reversed so the stack visits subdirectories in name order
+        pending.extend(sorted(subdirectories, reverse=True))
+
+
+def discover_images(directory, recursive=True, extensions=IMAGE_EXTENSIONS, check_signature=True,
+                    largest_first=True, window=256, exclude=()):
+    """
+    Lazily yield the paths of the images in directory, in no particular order within a folder.
+
+    With largest_first, files are reordered by size within a sliding window of the given number
+    of files, so the slowest scans start early without reading the whole tree first.
+    Directories listed in exclude (e.g. an output folder inside the input folder) are not entered.
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    entries = _iter_entries(directory, tuple(extensions), recursive, exclude)
+    if check_signature:
+        entries = ((path, size) for path, size in entries if has_image_signature(path))
+
+    if not largest_first:
+        for path, _ in entries:
+            yield path
+        return
+
+    heap = []
+    for index, (path, size) in enumerate(entries):
+        heapq.heappush(heap, (-size, index, path))
+        if len(heap) >= window:
+            yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
@@ -0,0 +1,258 @@
+'''
+Disk index of processed scans, see ScanIndex. The index is pruned to its size and age limits as it
+is used; it can also be pruned by hand, e.g. to a smaller limit:
+
+    python ScanIndex.py prune ../img/index --max-gb 2 --max-days 30
+'''
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Lock
+import cv2
+from LoggerConfig import setup_logger
+import Metrics as metrics
+
+_cache_requests_total = metrics.counter("imgdate_cache_requests_total", "Cache lookups, by cache and result")
+_index_evictions_total = metrics.counter("imgdate_index_evictions_total", "Scan index entries removed, by reason")
+
+HASH_CHUNK = 1024 * 1024
+DEFAULT_MAX_GB = 10         # Size the index is pruned to, least recently used entries first
+DEFAULT_MAX_DAYS = 180      # Entries not used for this long are removed
+PRUNE_EVERY = 20            # Entries used between two prunes
+PNG_COMPRESSION = 1         # Crops are stored losslessly; a low level keeps storing them fast
+
+
+class ScanIndex:
+    """
+    Disk index of the scans processed so far and what came out of them.
+
+    Entries are keyed by the SHA-256 of the scan's bytes (and whether it was cropped), so a scan
+    that is uploaded again or re-synced under another name finds the crops, dates, rotations and
+    saved photos of the first run. Each entry is a folder:
+
+        <index_dir>/<sha256>_<crop|single>/manifest.json
+                                          /crop_00.png     photos cropped from the scan
+                                          /output_00.jpg   copy of each saved photo
+
+    Files are copied rather than hard linked in both directions, so editing a saved photo in
+    place never changes the index. The crops are PNG so stages run again on them start from the
+    same pixels as the first run.
+
+    Using an entry marks it as recently used. When the index is created and after every
+    PRUNE_EVERY entries, entries unused for max_days are removed, then the least recently used
+    ones until the index is at most max_gb.
+    """
+    def __init__(self, index_dir, max_gb=DEFAULT_MAX_GB, max_days=DEFAULT_MAX_DAYS):
+        self.index_dir = os.path.abspath(index_dir)
+        self.max_bytes = max_gb * 1024 ** 3 if max_gb is not None else None
+        self.max_age = max_days * 86400 if max_days is not None else None
+        self.locks = {}
+        self.locks_lock = Lock()
+        self.uses = 0
+        self.log = setup_logger("ScanIndex", "../log/ImgDate.log")
+        os.makedirs(index_dir, exist_ok=True)
+        self.prune()
+
+    @staticmethod
+    def file_hash(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @contextmanager
+    def entry(self, scan_path, cropped):
+        """
+        The entry of a scan, held for the block so a second copy of the scan processed at the
+        same time waits and then reuses the results of the first.
+        """
+        key = f"{self.file_hash(scan_path)}_{'crop' if cropped else 'single'}"
+        with self.locks_lock:
+            lock, users = self.locks.get(key, (Lock(), 0))
+            self.locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                entry = ScanEntry(os.path.join(self.index_dir, key))
+                _cache_requests_total.inc(cache="scan_index", result="hit" if entry.photos else "miss")
+                if entry.photos:
+                    entry.touch()
+                yield entry
+        finally:
+            with self.locks_lock:
+                lock, users = self.locks[key]
+                if users == 1:
+                    del self.locks[key]
+                else:
+                    self.locks[key] = (lock, users - 1)
+                self.uses += 1
+                prune = self.uses % PRUNE_EVERY == 0
+            if prune:
+                self.prune()
+
+    def entries(self):
+        """
+        (last used, bytes, key) of every entry, least recently used first.
+        """
+        entries = []
+        for key in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, key)
+            if not os.path.isdir(path):
+                continue
+            try:
+                size = sum(item.stat().st_size for item in os.scandir(path) if item.is_file())
+                manifest = os.path.join(path, 'manifest.json')
+                used = os.path.getmtime(manifest if os.path.isfile(manifest) else path)
+            except OSError:
+                # Removed by another process while it was listed
+                continue
+            entries.append((used, size, key))
+        return sorted(entries)
+
+    def prune(self, max_bytes=None, max_age=None):
+        """
+        Remove the entries unused for longer than max_age seconds, then the least recently used
+        ones until the index fits in max_bytes. Both default to the limits of the index; entries
+        this process is using are kept. Returns (entries removed, bytes freed).
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        if max_bytes is None and max_age is None:
+            return 0, 0
+
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        removed, freed = 0, 0
+        now = time.time()
+        for used, size, key in entries:
+            if max_age is not None and now - used > max_age:
+                reason = "age"
+            elif max_bytes is not None and total > max_bytes:
+                reason = "size"
+            else:
+                continue
+            with self.locks_lock:
+                if key in self.locks:
+                    continue
+                shutil.rmtree(os.path.join(self.index_dir, key), ignore_errors=True)
+            _index_evictions_total.inc(reason=reason)
+            total -= size
+            removed += 1
+            freed += size
+
+        if removed:
+            self.log.info(f"Pruned {removed} scan index entr{'y' if removed == 1 else 'ies'} ({freed / 1024 ** 2:.1f} MB), "
+                          f"{total / 1024 ** 2:.1f} MB left in {self.index_dir}")
+        return removed, freed
+
+
+class ScanEntry:
+    """
+    What one scan produced. Each photo records the options of the stages that produced it:
+
+        {"date": "01/02/1999", "confidence": 10, "rotation": 90, "oriented": true,
+         "options": {"date": [...], "orientation": [...], "output": [...]}, "output": "output_00.jpg"}
+
+    "oriented" is false when the orientation was not detected because the date was not confident.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.photos = []
+        self.has_crops = False
+        manifest = os.path.join(path, 'manifest.json')
+        if os.path.isfile(manifest):
+            try:
+                with open(manifest) as f:
+                    data = json.load(f)
+                self.photos = data['photos']
+                self.has_crops = data.get('crops', False)
+            except (OSError, ValueError, KeyError) as e:
+                setup_logger("ScanIndex", "../log/ImgDate.log").error(f"Ignoring unreadable index entry {manifest}: {e}")
+
+    def touch(self):
+        # The manifest's modification time is when the entry was last used
+        try:
+            os.utime(os.path.join(self.path, 'manifest.json'))
+        except OSError:
+            pass
+
+    def photo(self, index):
+        while len(self.photos) <= index:
+            self.photos.append({})
+        return self.photos[index]
+
+    def load_crops(self):
+        """
+        The stored crops, or None when any of them is missing.
+        """
+        if not self.has_crops:
+            return None
+        crops = []
+        for index in range(len(self.photos)):
+            # Entries stored before the crops were lossless have JPEG crops
+            crop = cv2.imread(os.path.join(self.path, f"crop_{index:02d}.png"))
+            if crop is None:
+                crop = cv2.imread(os.path.join(self.path, f"crop_{index:02d}.jpg"))
+            if crop is None:
+                return None
+            crops.append(crop)
+        return crops
+
+    def store_crops(self, crops):
+        # New crops invalidate everything that was read from the old ones
+        os.makedirs(self.path, exist_ok=True)
+        self.photos = [{} for _ in crops]
+        for index, crop in enumerate(crops):
+            cv2.imwrite(os.path.join(self.path, f"crop_{index:02d}.png"), crop, [int(cv2.IMWRITE_PNG_COMPRESSION), PNG_COMPRESSION])
+        self.has_crops = True
+
+    def output(self, index):
+        """
+        Path of the stored copy of a saved photo, or None.
+        """
+        name = self.photo(index).get('output')
+        path = os.path.join(self.path, name) if name else None
+        return path if path and os.path.isfile(path) else None
+
+    def store_output(self, index, saved_path):
+        name = f"output_{index:02d}{os.path.splitext(saved_path)[1]}"
+        os.makedirs(self.path, exist_ok=True)
+        shutil.copy2(saved_path, os.path.join(self.path, name))
+        self.photo(index)['output'] = name
+
+    def save(self):
+        # Written to a temp file and renamed so a reader never sees a partial manifest
+        os.makedirs(self.path, exist_ok=True)
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.json', dir=self.path)
+        try:
+            with os.fdopen(temp_fd, 'w') as f:
+                json.dump({'crops': self.has_crops, 'photos': self.photos}, f, indent=1)
+            os.replace(temp_path, os.path.join(self.path, 'manifest.json'))
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the index of processed scans.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    prune = commands.add_parser("prune", help="Remove old and least recently used entries")
+    prune.add_argument("index_dir")
+    prune.add_argument("--max-gb", type=float, default=DEFAULT_MAX_GB, help="Size to prune the index to")
+    prune.add_argument("--max-days", type=float, default=DEFAULT_MAX_DAYS, help="Remove entries unused for this many days")
+    args = parser.parse_args()
+
+    if args.command == "prune":
+        index = ScanIndex(args.index_dir, max_gb=None, max_days=None)
+        removed, freed = index.prune(args.max_gb * 1024 ** 3, args.max_days * 86400)
+        print(f"Removed {removed} entries, freed {freed / 1024 ** 2:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
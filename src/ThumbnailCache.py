@@ -0,0 +1,82 @@
+import hashlib
+import os
+import tempfile
+from threading import Lock
+import cv2
+from ImageLoader import imread_reduced
+from LoggerConfig import setup_logger
+import Metrics as metrics
+
+_cache_requests_total = metrics.counter("imgdate_cache_requests_total", "Cache lookups, by cache and result")
+
+
+class ThumbnailCache:
+    """
+    Disk cache of small JPEG renditions of images.
+
+    Entries are keyed by the source path, its size and modification time, so an edited or
+    replaced image gets a new entry and stale ones are simply never read again.
+    """
+    def __init__(self, cache_dir, thumbnail_size=320, quality=80):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.thumbnail_size = thumbnail_size
+        self.quality = quality
+        self.locks = {}
+        self.locks_lock = Lock()
+        self.log = setup_logger("ThumbnailCache", "../log/ImgDate.log")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def cache_path(self, image_path, variant):
+        stat = os.stat(image_path)
+        key = f"{os.path.abspath(image_path)}|{stat.st_size}|{stat.st_mtime_ns}|{variant}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + ".jpg")
+
+    def get(self, image_path, variant="thumbnail", builder=None):
+        """
+        Return the path of the cached rendition of image_path, building it first if needed.
+
+        :param variant: Name of the rendition, part of the cache key.
+        :param builder: Callable taking the image path and returning a BGR array. Defaults to a thumbnail.
+        :return: Path to the cached JPEG, or None if the image could not be read.
+        """
+        cached = self.cache_path(image_path, variant)
+        if os.path.exists(cached):
+            _cache_requests_total.inc(cache="thumbnail", result="hit")
+            return cached
+        _cache_requests_total.inc(cache="thumbnail", result="miss")
+
+        # One build per entry at a time; concurrent requests for it wait for the first one
+        with self.locks_lock:
+            lock = self.locks.setdefault(cached, Lock())
+        with lock:
+            if not os.path.exists(cached):
+                image = (builder or self.build_thumbnail)(image_path)
+                if image is None:
+                    self.log.error(f"Could not build {variant} for {image_path}")
+                    return None
+                self.write(image, cached)
+        with self.locks_lock:
+            self.locks.pop(cached, None)
+        return cached
+
+    def build_thumbnail(self, image_path):
+        # Decode at reduced size, then fit into a thumbnail_size square
+        image, _ = imread_reduced(image_path, self.thumbnail_size, self.thumbnail_size)
+        if image is None:
+            return None
+        h, w = image.shape[:2]
+        scale = self.thumbnail_size / max(h, w)
+        if scale < 1:
+            image = cv2.resize(image, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        return image
+
+    def write(self, image, cached):
+        # Write to a temp file and rename so readers never see a partial JPEG
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg', dir=self.cache_dir)
+        os.close(temp_fd)
+        try:
+            cv2.imwrite(temp_path, image, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            os.replace(temp_path, cached)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
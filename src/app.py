@@ -1,17 +1,20 @@
-import shutil
-from flask import Flask, request, render_template, send_file, jsonify
+import re
+import cv2
+from flask import Flask, Response, request, render_template, send_file, jsonify, abort
 import requests
 from werkzeug.utils import secure_filename
 import os
 from ImageOrganizer import ImageOrganizer
-import tempfile
-import zipfile
 import uuid
 import threading
 import time
 from dotenv import load_dotenv
-import SharedVariables as s
+import Metrics as metrics
+import ModelRegistry
+import BatchStore
+from BatchWorker import UPLOAD_FOLDER, PROCESSED_FOLDER, BATCH_TIMEOUT, QUEUE_TIMEOUT, start_embedded
 from LoggerConfig import setup_logger
+from ThumbnailCache import ThumbnailCache
 
 app = Flask(__name__)
 
@@ -21,10 +24,25 @@ TURNSTILE_SITE_KEY = os.getenv('CF_TURNSTILE_SITE_KEY', '')
 log = setup_logger("WebServer", "../log/webserver.log")
 
 # Configuration
-UPLOAD_FOLDER = '../img/web/uploads'
-PROCESSED_FOLDER = '../img/web/processed'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'tiff'}
 
+# Review of the Failed folder produced by main.py / FileWatcher.py. Disabled unless REVIEW_ENABLED=true
+# because it exposes the server's own photos.
+REVIEW_ENABLED = os.getenv('REVIEW_ENABLED', 'false').lower() == 'true'
+REVIEW_SAVE_PATH = os.getenv('REVIEW_SAVE_PATH', '../img/processed')
+REVIEW_FOLDER = os.getenv('REVIEW_FOLDER', os.path.join(REVIEW_SAVE_PATH, 'Failed'))
+THUMBNAIL_FOLDER = '../img/web/thumbnails'
+# Catalog of the library the reviewed images are saved into, shared with main.py and FileWatcher.py
+CATALOG_PATH = os.getenv('CATALOG_PATH', '../img/catalog.db')
+
+# Lets uploads request a profile of their batch. Off by default: the sampler and tracemalloc
+# see the whole process, so they slow down every batch running at the same time.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+
+# Batches are processed by BatchWorker threads of this process, or by separate BatchWorker.py
+# processes when this is 0 (needed under a WSGI server with several workers)
+EMBEDDED_BATCH_WORKERS = int(os.getenv('EMBEDDED_BATCH_WORKERS', '4'))
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200 MB limit
@@ -33,6 +51,24 @@ app.config['MAX_CONTENT_LENGTH'] = 200 * 1024 * 1024  # 200 MB limit
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
+def warm_models():
+    try:
+        timings = ModelRegistry.warm()
+        log.info(f"Models loaded: {', '.join(f'{name} {seconds:.2f}s' for name, seconds in timings.items())}")
+    except Exception as e:
+        log.error(f"Failed to preload models, they will be loaded by the first batch: {e}")
+
+batch_store = BatchStore.shared_store()
+
+if EMBEDDED_BATCH_WORKERS:
+    # Load the shared models in the background so the first batch does not wait for them
+    threading.Thread(target=warm_models, name="WarmModels", daemon=True).start()
+    start_embedded(EMBEDDED_BATCH_WORKERS)
+
+review_organizer = None
+review_organizer_lock = threading.Lock()
+thumbnail_cache = ThumbnailCache(THUMBNAIL_FOLDER) if REVIEW_ENABLED else None
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -51,13 +87,22 @@ def delayed_file_deletion(file_path, delay=360):
 
 @app.route('/', methods=['GET'])
 def index():
-    return render_template('index.html', turnstile_site_key=TURNSTILE_SITE_KEY)
+    return render_template('index.html', turnstile_site_key=TURNSTILE_SITE_KEY, profiling_enabled=PROFILING_ENABLED)
 
 @app.route('/processes', methods=['GET'])
 def processes():
-    active_processes = {batch_id: batch for batch_id, batch in s.batches.items() if batch['status'] == 'processing'}
+    active_processes = {batch['id']: batch for batch in batch_store.with_status('processing')}
     return jsonify(active_processes), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    counts = batch_store.counts()
+    batches_gauge = metrics.gauge("imgdate_batches", "Web batches currently known to the server, by status")
+    batches_gauge.clear()
+    for status, count in counts.items():
+        batches_gauge.set(count, status=status)
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/verify-turnstile', methods=['POST'])
 def verify_turnstile():
     
@@ -81,79 +126,68 @@ def start_upload():
     batch_id = str(uuid.uuid4())
     
     
-    # Create a temporary directory to store uploaded files
-    temp_dir = tempfile.mkdtemp()
-    
-    # Store batch information
-    s.batches[batch_id] = {
-        'status': 'started',
-        'files': [],
-        'temp_dir': temp_dir,
-        'IP': request.headers.get('CF-Connecting-IP'),
-        'User-Agent': request.headers.get('User-Agent'),
-        'Referrer': request.referrer,
-        'options': {
-            'date_format': request.form.get('date_format'),
-            'date_range': request.form.get('date_range'),
-            'fix_orientation': request.form.get('fix_orientation') == 'true',
-            'crop_images': request.form.get('crop_images') == 'true',
-            'date_images': request.form.get('date_images') == 'true',
-            'draw_contours': request.form.get('draw_contours') == 'true',
-            'sort_images': request.form.get('sort_images') == 'true',
-            'file_prefix': request.form.get('file_prefix', '').strip()
-        }
+    # Uploads go to a folder every batch worker can read, whichever process claims the batch
+    upload_dir = os.path.abspath(os.path.join(UPLOAD_FOLDER, batch_id))
+    os.makedirs(upload_dir)
+    options = {
+        'date_format': request.form.get('date_format'),
+        'date_range': request.form.get('date_range'),
+        'fix_orientation': request.form.get('fix_orientation') == 'true',
+        'orientation_mode': 'print' if request.form.get('orient_separately') == 'true' else 'scan',
+        'crop_images': request.form.get('crop_images') == 'true',
+        'date_images': request.form.get('date_images') == 'true',
+        'draw_contours': request.form.get('draw_contours') == 'true',
+        'sort_images': request.form.get('sort_images') == 'true',
+        'file_prefix': request.form.get('file_prefix', '').strip(),
+        'profile': PROFILING_ENABLED and request.form.get('profile') == 'true'
     }
 
-    # Save uploaded files to the temporary directory
+    # Save uploaded files to the upload directory
+    saved_files = []
     for file in files:
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            file_path = os.path.join(temp_dir, filename)
+            file_path = os.path.join(upload_dir, filename)
             file.save(file_path)
-            s.batches[batch_id]['files'].append(file_path)
+            saved_files.append(file_path)
 
-    # Start processing in a background thread
-    thread = threading.Thread(target=process_images, args=(batch_id, temp_dir, request.form))
-    thread.start()
+    # Recorded once the files are saved; a batch worker picks it up from the store
+    batch_store.create(batch_id, upload_dir, saved_files, options, ip=request.headers.get('CF-Connecting-IP'),
+                       user_agent=request.headers.get('User-Agent'), referrer=request.referrer)
 
     return jsonify({'message': 'Upload started', 'batchId': batch_id}), 200
 
 @app.route('/api/status/<batch_id>', methods=['GET'])
 def get_status(batch_id):
-    if batch_id in s.batches:
-        batch = s.batches[batch_id]
-        current_time = time.time()
-        
-        # If the batch is older than 15 minutes, consider it failed
-        if current_time - batch.get('start_time', current_time) > 15 * 60:  # 15 minutes in seconds
-            log.info(f"Current time: {current_time}, "
-                    f"Start time: {batch.get('start_time', current_time)}, "
-                    f"Time difference: {current_time - batch.get('start_time', current_time)}")
-            
-            batch['status'] = 'failed'
-            batch['error'] = 'Process timed out'
-        
-        return jsonify({
-            'status': batch['status'],
-            'error': batch.get('error'),
-            'current_image_num': batch.get('current_image_num', 0),
-            'num_images': batch.get('num_images', 0),
-        }), 200
-    else:
+    batch = batch_store.get(batch_id)
+    if batch is None:
         return jsonify({'error': 'Batch not found'}), 404
 
+    # The batch workers record the failure; polls only read, so they stay cheap
+    if BatchStore.BatchStore.is_stale(batch, BATCH_TIMEOUT, QUEUE_TIMEOUT):
+        batch['status'] = 'failed'
+        batch['error'] = 'Process timed out'
+
+    return jsonify({
+        'status': batch['status'],
+        'error': batch['error'],
+        'current_image_num': batch['current_image_num'],
+        'num_images': batch['num_images'],
+    }), 200
+
 @app.route('/download/<batch_id>')
 def download(batch_id):
-    if batch_id not in s.batches:
+    batch = batch_store.get(batch_id)
+    if batch is None:
         return jsonify({'error': 'Batch not found'}), 404
     
-    if s.batches[batch_id]['status'] != 'completed':
+    if batch['status'] != 'completed':
         return jsonify({'error': 'Batch not completed'}), 400
 
     zip_filename = f'ImgDate_{batch_id}.zip'
-    zip_path = os.path.join(app.config['PROCESSED_FOLDER'], zip_filename)
+    zip_path = batch['result_path']
     
-    if not os.path.exists(zip_path):
+    if not zip_path or not os.path.exists(zip_path):
         return jsonify({'error': 'File not found'}), 404
 
     try:
@@ -164,96 +198,122 @@ def download(batch_id):
     finally:
         delayed_file_deletion(zip_path)
 
-def process_images(batch_id, temp_dir, form):
-    batch = s.batches[batch_id]
-    batch['status'] = 'processing'
-    batch['start_time'] = time.time()
-
-    log.info("\n\n\n-----------------------------------")
-    log.info(f"Processing batch {batch_id}")
-    log.info(f"Uploaded files: {[os.path.basename(file) for file in batch['files']]}")
-
-    with tempfile.TemporaryDirectory() as tmpdirname:
-        scans_path = os.path.join(tmpdirname, 'scans')
-        save_path = os.path.join(tmpdirname, 'processed')
-        contours_path = os.path.join(scans_path, 'contours')
-        error_path = os.path.join(save_path, 'Failed')
-
-        os.makedirs(scans_path)
-        os.makedirs(save_path)
-        os.makedirs(error_path)
-
-        for file_path in batch['files']:
-            if os.path.exists(file_path):
-                shutil.move(file_path, os.path.join(scans_path, os.path.basename(file_path)))
-            else:
-                log.error(f"File not found: {file_path}")
-
-        s.date_format = form.get('date_format', None)
-        s.date_range = form.get('date_range', None)
-        
-        # Process images
-        image_organizer = ImageOrganizer(
-            save_path=save_path,
-            scans_path=scans_path,
-            error_path=error_path,
-            archive_scans=False,
-            sort_images=form.get('sort_images') == 'true',
-            fix_orientation=form.get('fix_orientation') == 'true',
-            crop_images=form.get('crop_images') == 'true',
-            date_images=form.get('date_images') == 'true',
-            draw_contours=form.get('draw_contours') == 'true',
-            batch_progress=batch
-        )
-
-        log.info("Options chosen:\n" + "\n".join(f"{k}={v}" for k, v in batch['options'].items()))
-        
-        try:
-            image_organizer.process_images()
-        except Exception as e:
-            batch['status'] = 'failed'
-            batch['error'] = str(e)
-            log.error(f"Error processing images: {str(e)}")
-            return
-        
-        finally:
-            # Clean up the temporary directory
-            temp_dir = batch.get('temp_dir')
-            if temp_dir and os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                log.info(f"Deleted temporary directory: {temp_dir}")
-                
-        # Apply prefix to processed images if provided
-        prefix = form.get('file_prefix', '').strip()
-        if prefix:
-            for root, _, files_in_dir in os.walk(save_path):
-                for file in files_in_dir:
-                    old_path = os.path.join(root, file)
-                    new_filename = f"{prefix}_{file}"
-                    new_path = os.path.join(root, new_filename)
-                    os.rename(old_path, new_path)
-
-        # Create a zip file of processed images
-        zip_filename = f'ImgDate_{batch_id}.zip'
-        zip_path = os.path.join(app.config['PROCESSED_FOLDER'], zip_filename)
-        processed_count = 0
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for root, _, files_in_dir in os.walk(save_path):
-                for file in files_in_dir:
-                    zipf.write(os.path.join(root, file),
-                               os.path.relpath(os.path.join(root, file), save_path))
-                    processed_count += 1
-
-            if form.get('draw_contours') == 'true' and os.path.exists(contours_path):
-                for root, _, files_in_dir in os.walk(contours_path):
-                    for file in files_in_dir:
-                        zipf.write(os.path.join(root, file),
-                                   os.path.relpath(os.path.join(root, file), scans_path))
-                        
-        log.info(f"Processed {processed_count} images successfully")
-        log.info("Finished processing request")
-        batch['status'] = 'completed'
-        batch['processed_count'] = processed_count
+def get_review_organizer():
+    global review_organizer
+    with review_organizer_lock:
+        if review_organizer is None:
+            review_organizer = ImageOrganizer(
+                save_path=REVIEW_SAVE_PATH,
+                scans_path='../img/unprocessed',
+                error_path=REVIEW_FOLDER,
+                archive_path=os.path.join(REVIEW_SAVE_PATH, 'archive'),
+                archive_scans=False,
+                sort_images=False,
+                fix_orientation=False,
+                crop_images=False,
+                date_images=True,
+                catalog_path=CATALOG_PATH
+            )
+        return review_organizer
+
+def get_review_image_path(filename):
+    """
+    Resolve a filename from the review folder, rejecting anything outside it.
+    """
+    if not REVIEW_ENABLED:
+        abort(404)
+    if filename != secure_filename(filename) or not allowed_file(filename):
+        abort(400)
+    image_path = os.path.join(REVIEW_FOLDER, filename)
+    if not os.path.isfile(image_path):
+        abort(404)
+    return image_path
+
+def build_date_corner(image_path):
+    image = cv2.imread(image_path)
+    if image is None:
+        return None
+    return get_review_organizer().date_extractor.crop_date_64(image, base_64=False)
+
+@app.route('/review', methods=['GET'])
+def review():
+    if not REVIEW_ENABLED:
+        abort(404)
+    return render_template('review.html')
+
+@app.route('/api/review/images', methods=['GET'])
+def review_images():
+    if not REVIEW_ENABLED:
+        abort(404)
+    images = []
+    for filename in sorted(os.listdir(REVIEW_FOLDER)):
+        if not allowed_file(filename) or not os.path.isfile(os.path.join(REVIEW_FOLDER, filename)):
+            continue
+        # Failed images are named date_MM-DD-YYYY_confidence-N_XX.jpg; offer that date as a suggestion
+        match = re.match(r"date_(\d{2})-(\d{2})-(\d{4})", filename)
+        images.append({
+            'name': filename,
+            'suggested_date': f"{match.group(1)}/{match.group(2)}/{match.group(3)}" if match else None,
+        })
+    return jsonify({'images': images}), 200
+
+@app.route('/review/thumbnail/<filename>', methods=['GET'])
+def review_thumbnail(filename):
+    image_path = get_review_image_path(filename)
+    cached = thumbnail_cache.get(image_path)
+    if cached is None:
+        abort(404)
+    return send_file(cached, mimetype='image/jpeg', max_age=3600)
+
+@app.route('/review/corner/<filename>', methods=['GET'])
+def review_corner(filename):
+    image_path = get_review_image_path(filename)
+    cached = thumbnail_cache.get(image_path, variant="date_corner", builder=build_date_corner)
+    if cached is None:
+        abort(404)
+    return send_file(cached, mimetype='image/jpeg', max_age=3600)
+
+@app.route('/api/review/commit', methods=['POST'])
+def review_commit():
+    """
+    Apply a batch of date edits: {"edits": [{"name": "...", "date": "mm/dd/yyyy"}, ...]}.
+    Each image is moved to the save path with only its metadata rewritten.
+    """
+    if not REVIEW_ENABLED:
+        abort(404)
+    data = request.get_json(silent=True)
+    edits = data.get('edits') if isinstance(data, dict) else None
+    if not isinstance(edits, list) or not edits:
+        return jsonify({'error': 'No edits provided'}), 400
+
+    organizer = get_review_organizer()
+    results = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            results.append({'name': '', 'saved': False, 'error': 'Invalid edit'})
+            continue
+        filename = str(edit.get('name', ''))
+        result = {'name': filename, 'saved': False}
+        results.append(result)
+
+        image_path = os.path.join(REVIEW_FOLDER, filename)
+        if filename != secure_filename(filename) or not os.path.isfile(image_path):
+            result['error'] = 'Image not found'
+            continue
+
+        date, is_valid = organizer.date_extractor.validate_date_format(str(edit.get('date', '')))
+        if not is_valid:
+            result['error'] = 'Invalid date'
+            continue
+
+        result['saved'] = organizer.save_image_file(image_path, date, 10, filename, None)
+        result['date'] = date
+        if not result['saved']:
+            result['error'] = 'Failed to save image'
+
+    saved = sum(1 for result in results if result['saved'])
+    log.info(f"Review commit: saved {saved} of {len(results)} images")
+    return jsonify({'saved': saved, 'results': results}), 200
 
 def check_turnstile(turnstile_response, visitor_ip):
     if not TURNSTILE_KEY:
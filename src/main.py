@@ -1,16 +1,34 @@
 import time
 import argparse
+import contextlib
 import shutil
 import os
 from ImageOrganizer import ImageOrganizer
-from DateEditor import ImageDateEditor
+from JobQueue import JobQueue
 from LoggerConfig import setup_logger
+import Metrics as metrics
+from Profiler import profile_run
+from ScanIndex import DEFAULT_MAX_GB
 
 def main():
     parser = argparse.ArgumentParser(description="Process images or start the editor.")
-    parser.add_argument("operation", choices=["organize", "process", "edit"], help="Operation to perform")
+    parser.add_argument("operation", choices=["organize", "process", "edit", "enqueue", "worker"],
+                        help="Operation to perform; enqueue and worker split organize across hosts sharing the img folder")
     parser.add_argument("-d", "--delete", action="store_true", help="(Debug) Delete files in save path before operation")
     parser.add_argument("-c", "--contours", action="store_true", help="(Debug) Show contours to highlight detected images")
+    parser.add_argument("-p", "--profile", action="store_true", help="Save a sampling profile and memory snapshot of the run to the save path")
+    parser.add_argument("-r", "--rotation", choices=["reencode", "exif", "lossless"], default="lossless",
+                        help="How photos that need rotating are saved: re-encoded, with the EXIF orientation tag, or rotated losslessly with jpegtran")
+    parser.add_argument("-m", "--memory-budget", type=int, help="Memory budget per worker in MB, scans wait until memory is available")
+    parser.add_argument("-e", "--escalations", type=int, default=100,
+                        help="Extra date reads (high detail, other corner, universal prompt) allowed for low confidence results")
+    parser.add_argument("--no-index", action="store_true",
+                        help="Process every scan from scratch instead of reusing the results of identical scans processed before")
+    parser.add_argument("--index-max-gb", type=float, default=DEFAULT_MAX_GB,
+                        help="Size the scan index is kept under, the least recently used scans are removed first")
+    parser.add_argument("-q", "--queue", help="Job queue folder for enqueue and worker, defaults to img/queue")
+    parser.add_argument("-l", "--lease", type=int, default=300,
+                        help="Seconds without a heartbeat after which a worker's scans are given to other workers")
     
 
     args = parser.parse_args()
@@ -37,7 +55,10 @@ def main():
     scans_path = os.path.join(base_path, 'unprocessed')
     save_path = os.path.join(base_path, 'processed')
     error_path = os.path.join(save_path, 'Failed')
+    index_path = os.path.join(base_path, 'index')
+    catalog_path = os.path.join(base_path, 'catalog.db')
     archive_path = os.path.join(save_path, 'archive')
+    queue_path = args.queue or os.path.join(base_path, 'queue')
 
     image_organizer = ImageOrganizer(save_path=save_path,
                                      scans_path=scans_path,
@@ -48,21 +69,44 @@ def main():
                                      fix_orientation=True,
                                      crop_images=False,
                                      date_images=True,
-                                     draw_contours=args.contours)
+                                     draw_contours=args.contours,
+                                     memory_budget_mb=args.memory_budget,
+                                     rotation_mode=args.rotation,
+                                     escalation_budget=args.escalations,
+                                     # The index entry lock only holds within one process, so workers on
+                                     # other hosts would write the same entries at once
+                                     index_path=None if args.no_index or args.operation == "worker" else index_path,
+                                     index_max_gb=args.index_max_gb,
+                                     # SQLite locking is not reliable on network shares, so workers do not
+                                     # write the catalog; run "python Catalog.py rebuild" once they are done
+                                     catalog_path=None if args.operation == "worker" else catalog_path)
     
-    date_editor = ImageDateEditor(source_folder_path=error_path, image_organizer=image_organizer)
+    if args.operation in ("edit", "process"):
+        # Imported here so organize runs do not load tkinter or open a window
+        from DateEditor import ImageDateEditor
+        date_editor = ImageDateEditor(source_folder_path=error_path, image_organizer=image_organizer)
 
     log.info(f"\n\n------------------------------\nStarting operation: {args.operation}\n------------------------------\n")
 
 
-    if args.operation == "organize":
-        image_organizer.process_images()
-    elif args.operation == "edit":
-        date_editor.source_folder_path=base_path
-        date_editor.start()
-    elif args.operation == "process":
-        image_organizer.process_images()
-        date_editor.start()
+    if args.profile:
+        profiler = profile_run(os.path.join(save_path, 'profile'), label=f"{args.operation}_{time.strftime('%Y%m%d-%H%M%S')}")
+    else:
+        profiler = contextlib.nullcontext()
+
+    with profiler:
+        if args.operation == "organize":
+            image_organizer.process_images()
+        elif args.operation == "edit":
+            date_editor.source_folder_path=base_path
+            date_editor.start()
+        elif args.operation == "process":
+            image_organizer.process_images()
+            date_editor.start()
+        elif args.operation == "enqueue":
+            image_organizer.enqueue_scans(JobQueue(queue_path, lease_seconds=args.lease))
+        elif args.operation == "worker":
+            image_organizer.process_queue(JobQueue(queue_path, lease_seconds=args.lease))
 
     end_time = time.time()
     seconds = end_time - start_time
@@ -72,6 +116,8 @@ def main():
         minutes = seconds / 60
         log.info(f"Time taken to process images: {minutes} minutes")
 
+    log.info(f"\nRun summary:\n{metrics.summary_table()}")
+
     
 
 if __name__ == "__main__":
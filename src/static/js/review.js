@@ -0,0 +1,241 @@
+
+// Global variables
+let images = [];            // [{name, suggested_date, date, saved}]
+let focusIndex = 0;
+let anchorIndex = 0;        // Start of a Shift selection
+const selected = new Set(); // Indexes of selected images
+
+// DOM elements
+const reviewGrid = document.getElementById('reviewGrid');
+const cornerImage = document.getElementById('cornerImage');
+const cornerTitle = document.getElementById('cornerTitle');
+const reviewDate = document.getElementById('reviewDate');
+const selectionText = document.getElementById('selectionText');
+const commitText = document.getElementById('commitText');
+const assignButton = document.getElementById('assignButton');
+const commitButton = document.getElementById('commitButton');
+
+// Event listeners
+document.addEventListener('DOMContentLoaded', loadImages);
+document.addEventListener('keydown', handleKeyDown);
+assignButton.addEventListener('click', assignDate);
+commitButton.addEventListener('click', commitEdits);
+
+async function loadImages() {
+    try {
+        const response = await fetch('/api/review/images');
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        images = data.images.map(image => ({ ...image, date: null, saved: false }));
+        renderGrid();
+        setFocus(0, false, false);
+    } catch (error) {
+        console.error('Error loading images:', error);
+        commitText.innerText = 'Failed to load images';
+    }
+}
+
+function renderGrid() {
+    reviewGrid.innerHTML = '';
+    images.forEach((image, index) => {
+        const item = document.createElement('div');
+        item.className = 'review-item';
+        item.dataset.index = index;
+
+        // Thumbnails load lazily as they scroll into view
+        const img = document.createElement('img');
+        img.loading = 'lazy';
+        img.src = `/review/thumbnail/${encodeURIComponent(image.name)}`;
+        img.alt = image.name;
+
+        const name = document.createElement('div');
+        name.innerText = image.name;
+
+        const date = document.createElement('div');
+        date.className = 'review-date';
+        date.innerText = image.suggested_date ? `Read: ${image.suggested_date}` : 'No date read';
+
+        item.append(img, name, date);
+        item.addEventListener('click', (e) => setFocus(index, e.shiftKey, e.ctrlKey || e.metaKey));
+        reviewGrid.appendChild(item);
+    });
+    if (images.length === 0) {
+        reviewGrid.innerText = 'No images to review.';
+    }
+}
+
+function getItem(index) {
+    return reviewGrid.children[index];
+}
+
+function setFocus(index, extend, toggle) {
+    if (images.length === 0) return;
+    index = Math.max(0, Math.min(images.length - 1, index));
+
+    if (extend) {
+        // Select the run of frames between the anchor and the new focus
+        selected.clear();
+        const [start, end] = [Math.min(anchorIndex, index), Math.max(anchorIndex, index)];
+        for (let i = start; i <= end; i++) selected.add(i);
+    } else if (toggle) {
+        selected.has(index) ? selected.delete(index) : selected.add(index);
+        anchorIndex = index;
+    } else {
+        selected.clear();
+        selected.add(index);
+        anchorIndex = index;
+    }
+
+    focusIndex = index;
+    updateSelection();
+    showCorner(index);
+    getItem(index).scrollIntoView({ block: 'nearest' });
+}
+
+function updateSelection() {
+    images.forEach((image, index) => {
+        const item = getItem(index);
+        item.classList.toggle('selected', selected.has(index));
+        item.classList.toggle('focused', index === focusIndex);
+    });
+    selectionText.innerText = `${selected.size} selected, ${countPending()} edits pending`;
+}
+
+function showCorner(index) {
+    const image = images[index];
+    cornerTitle.innerText = image.name;
+    cornerImage.src = `/review/corner/${encodeURIComponent(image.name)}`;
+}
+
+function countPending() {
+    return images.filter(image => image.date && !image.saved).length;
+}
+
+// Accepts mm/dd/yyyy, mm-dd-yy, mm dd yy, mmddyy and mmddyyyy; returns mm/dd/yyyy or null
+function parseDate(text) {
+    text = text.trim();
+    let match = text.match(/^(\d{1,2})[\/\s.-](\d{1,2})[\/\s.-](\d{2}|\d{4})$/) || text.match(/^(\d{2})(\d{2})(\d{2}|\d{4})$/);
+    if (!match) return null;
+
+    let [, month, day, year] = match;
+    if (year.length === 2) {
+        const currentYear = new Date().getFullYear() % 100;
+        year = (parseInt(year, 10) > currentYear ? '19' : '20') + year;
+    }
+    const parsed = new Date(parseInt(year, 10), parseInt(month, 10) - 1, parseInt(day, 10));
+    if (parsed.getMonth() !== parseInt(month, 10) - 1 || parsed.getDate() !== parseInt(day, 10)) return null;
+    return `${month.padStart(2, '0')}/${day.padStart(2, '0')}/${year}`;
+}
+
+function assignDate() {
+    if (selected.size === 0) {
+        commitText.innerText = 'No images selected';
+        return;
+    }
+    const date = parseDate(reviewDate.value);
+    if (!date) {
+        commitText.innerText = 'Invalid date';
+        return;
+    }
+
+    selected.forEach(index => {
+        const image = images[index];
+        if (image.saved) return;
+        image.date = date;
+        const item = getItem(index);
+        item.classList.add('assigned');
+        item.querySelector('.review-date').innerText = `Set: ${date}`;
+    });
+    commitText.innerText = '';
+    reviewDate.value = '';
+
+    // Continue with the frame after the selection
+    setFocus(Math.max(...selected) + 1, false, false);
+}
+
+async function commitEdits() {
+    const edits = images.filter(image => image.date && !image.saved).map(image => ({ name: image.name, date: image.date }));
+    if (edits.length === 0) {
+        commitText.innerText = 'No edits to save';
+        return;
+    }
+
+    commitButton.disabled = true;
+    commitText.innerText = `Saving ${edits.length} images...`;
+    try {
+        const response = await fetch('/api/review/commit', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ edits })
+        });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+
+        const failed = [];
+        data.results.forEach(result => {
+            const index = images.findIndex(image => image.name === result.name);
+            if (index < 0) return;
+            if (result.saved) {
+                images[index].saved = true;
+                getItem(index).classList.add('saved');
+            } else {
+                failed.push(`${result.name}: ${result.error}`);
+            }
+        });
+        commitText.innerText = `Saved ${data.saved} of ${edits.length} images` + (failed.length ? `\n${failed.join('\n')}` : '');
+    } catch (error) {
+        console.error('Error saving edits:', error);
+        commitText.innerText = 'Failed to save edits';
+    } finally {
+        commitButton.disabled = false;
+        updateSelection();
+    }
+}
+
+function columnsPerRow() {
+    const first = getItem(0);
+    if (!first) return 1;
+    return Math.max(1, Math.round(reviewGrid.clientWidth / first.offsetWidth));
+}
+
+function handleKeyDown(e) {
+    if ((e.ctrlKey || e.metaKey) && e.key === 's') {
+        e.preventDefault();
+        commitEdits();
+        return;
+    }
+    if (e.key === 'Enter') {
+        e.preventDefault();
+        assignDate();
+        return;
+    }
+
+    // Keep typing in the date field unless the key is a navigation key
+    const moves = {
+        ArrowLeft: -1,
+        ArrowRight: 1,
+        ArrowUp: -columnsPerRow(),
+        ArrowDown: columnsPerRow()
+    };
+    if (e.key in moves) {
+        e.preventDefault();
+        setFocus(focusIndex + moves[e.key], e.shiftKey, false);
+    } else if (e.key === 'Escape') {
+        selected.clear();
+        updateSelection();
+    } else if ((e.ctrlKey || e.metaKey) && e.key === 'a' && document.activeElement !== reviewDate) {
+        e.preventDefault();
+        images.forEach((image, index) => selected.add(index));
+        updateSelection();
+    } else if (e.key === ' ' && document.activeElement !== reviewDate) {
+        e.preventDefault();
+        setFocus(focusIndex, false, true);
+    } else if (document.activeElement !== reviewDate && /^[0-9\/\-. ]$/.test(e.key)) {
+        // Start typing a date from anywhere on the page
+        reviewDate.focus();
+    }
+}